@@ -0,0 +1,263 @@
+import argparse
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import config
+from batch import MANIFEST_NAME, VIDEO_EXTENSIONS
+from engine_pool import _init_worker
+
+# Offline analysis of recordings (replaces running monitor.py / secure_monitor.py by hand).
+# Runs any combination of the physics engine, the cross-correlation check (monitor.py) and the
+# RGB spike check (secure_monitor.py) over files, directories and globs with a process pool
+# configured like the API's engine workers. Each finished file is appended to a JSONL file right
+# away, so an interrupted run continues where it stopped: files already in the output (with every
+# requested analysis actually run, not skipped for want of a flash offset) are skipped; a file run
+# again gets a new record, and the last record of a file is the current one. Plots are only rendered with --plots, by a thread of this
+# process on the Agg canvas, while the workers go on with the next files.
+#
+# The engine decodes only its analysis window (see physics_engine); the two center-ROI checks
+# share one full decode of the file.
+
+ANALYSES = ("engine", "correlation", "spikes")
+CENTER_ANALYSES = ("correlation", "spikes")
+
+
+def collect_inputs(patterns, recursive: bool = False) -> list:
+    """Video files named by paths, directories (videos inside) and glob patterns, sorted, no duplicates."""
+    files = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            if recursive:
+                candidates = [os.path.join(root, name) for root, _, names in os.walk(pattern) for name in names]
+            else:
+                candidates = [os.path.join(pattern, name) for name in os.listdir(pattern)]
+            files.update(path for path in candidates
+                         if path.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(path))
+        elif glob.has_magic(pattern):
+            files.update(path for path in glob.glob(pattern, recursive=True)
+                         if path.lower().endswith(VIDEO_EXTENSIONS) and os.path.isfile(path))
+        elif os.path.isfile(pattern):
+            files.add(pattern)
+        else:
+            print(f"⚠️  Not found: {pattern}", file=sys.stderr)
+    return sorted(os.path.abspath(path) for path in files)
+
+
+class FlashOffsets:
+    """Per-file flash offsets: --manifest, else a manifest.json next to the file, else --flash-offset."""
+
+    def __init__(self, default: float = None, manifest: str = None):
+        self.default = default
+        self.explicit = self._load(manifest) if manifest else None
+        self._by_dir = {}
+
+    @staticmethod
+    def _load(path: str) -> dict:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def get(self, path: str):
+        manifest = self.explicit
+        if manifest is None:
+            directory = os.path.dirname(path)
+            if directory not in self._by_dir:
+                candidate = os.path.join(directory, MANIFEST_NAME)
+                self._by_dir[directory] = self._load(candidate) if os.path.isfile(candidate) else {}
+            manifest = self._by_dir[directory]
+        offset = manifest.get(os.path.basename(path), self.default)
+        return None if offset is None else float(offset)
+
+
+def load_done(out_path: str, analyses) -> set:
+    """Files the output already has a record for, with every requested analysis run (resume)."""
+    done = set()
+    if not os.path.exists(out_path):
+        return done
+    with open(out_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Line cut off by an interruption
+            # A skipped analysis (no flash offset back then) is still to do
+            ran = {name for name, result in record.get("analyses", {}).items() if "skipped" not in result}
+            if record.get("error") is None and set(analyses) <= ran:
+                done.add(record["file"])
+    return done
+
+
+def analyze_file(path: str, analyses, flash_offset: float = None, keep_trace: bool = False):
+    """Worker job: (record, center trace arrays for plotting or None)."""
+    # Imported in the worker, after _init_worker has configured OpenCV
+    from physics_engine import analyze_video_challenge
+
+    start = time.perf_counter()
+    record = {"file": path, "size": os.path.getsize(path), "analyses": {}, "error": None}
+    plot_data = None
+    try:
+        if "engine" in analyses:
+            if flash_offset is None:
+                record["analyses"]["engine"] = {
+                    "skipped": f"no flash offset (pass --flash-offset or list the file in {MANIFEST_NAME})"}
+            else:
+                result = analyze_video_challenge(path, flash_offset)
+                result.pop("timings", None)
+                record["analyses"]["engine"] = dict(result, flash_offset_ms=flash_offset)
+        if any(name in analyses for name in CENTER_ANALYSES):
+            from monitor import analyze_liveness
+            from secure_monitor import analyze_challenge
+            from signals import extract_trace
+
+            trace = extract_trace(path, rois=("center",))
+            if trace is None:
+                raise IOError("Error opening video file.")
+            if "correlation" in analyses:
+                record["analyses"]["correlation"] = analyze_liveness(path, trace)
+            if "spikes" in analyses:
+                record["analyses"]["spikes"] = analyze_challenge(path, trace)
+            if keep_trace:
+                plot_data = (trace.timestamps.copy(), trace.means("center").copy(), trace.fps)
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["wall_ms"] = round((time.perf_counter() - start) * 1000.0, 3)
+    return record, plot_data
+
+
+def plot_name(plots_dir: str, path: str, analysis: str) -> str:
+    # Same-named files from different directories (-r, several inputs) must not share a plot
+    digest = hashlib.sha1(path.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(plots_dir, f"{os.path.splitext(os.path.basename(path))[0]}-{digest}.{analysis}.png")
+
+
+def render_plots(plot_data, targets: dict):
+    """Draws the center-ROI checks of one file with the Agg canvas ({analysis: png path})."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    from monitor import plot_liveness
+    from secure_monitor import plot_challenge
+    from signals import Trace
+
+    timestamps, bgr, fps = plot_data
+    trace = Trace.from_arrays(timestamps, bgr, "center", fps)
+    draw = {"correlation": plot_liveness, "spikes": plot_challenge}
+    for analysis, target in targets.items():
+        # Figure + Agg canvas, no pyplot: no global state, safe off the main thread
+        figure = Figure(figsize=(10, 8 if analysis == "correlation" else 10))
+        FigureCanvasAgg(figure)
+        draw[analysis](figure, trace)
+        figure.savefig(target)
+
+
+def _summary_line(record: dict) -> str:
+    if record["error"]:
+        return f"❌ {os.path.basename(record['file'])}: {record['error']}"
+    parts = []
+    for name, result in record["analyses"].items():
+        if "skipped" in result:
+            parts.append(f"{name} skipped")
+            continue
+        verdict = result.get("is_liveness_verified", result.get("is_live"))
+        parts.append(f"{name} {'✅' if verdict else '❌'}")
+    return f"{os.path.basename(record['file'])}: {', '.join(parts)} ({record['wall_ms']:.0f} ms)"
+
+
+def run(files, analyses, offsets: FlashOffsets, out_path: str, workers: int, plots_dir: str = None) -> dict:
+    """Analyzes files in a process pool, appending one JSONL record per file as it finishes."""
+    counts = {"analyzed": 0, "errors": 0, "plots": 0, "plot_errors": 0}
+    plot_analyses = [name for name in analyses if name in CENTER_ANALYSES] if plots_dir else []
+    if plot_analyses:
+        os.makedirs(plots_dir, exist_ok=True)
+
+    # An interrupted run can leave the last line without its newline
+    if os.path.exists(out_path) and os.path.getsize(out_path):
+        with open(out_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    else:
+        needs_newline = False
+
+    context = multiprocessing.get_context("spawn")
+    with open(out_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="deepshield-plots") as plotter, \
+            ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                                initargs=(config.ENGINE_CV_THREADS,)) as executor:
+        if needs_newline:
+            out.write("\n")
+        futures = [executor.submit(analyze_file, path, analyses, offsets.get(path) if "engine" in analyses else None,
+                                   bool(plot_analyses))
+                   for path in files]
+        plot_futures = []
+        for future in as_completed(futures):
+            record, plot_data = future.result()
+            if plot_data is not None:
+                targets = {name: plot_name(plots_dir, record["file"], name) for name in plot_analyses}
+                record["plots"] = targets
+                plot_futures.append((record["file"], plotter.submit(render_plots, plot_data, targets)))
+            record["analyzed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            counts["analyzed"] += 1
+            counts["errors"] += record["error"] is not None
+            print(_summary_line(record))
+
+        for path, future in plot_futures:
+            try:
+                future.result()
+                counts["plots"] += 1
+            except Exception as e:
+                counts["plot_errors"] += 1
+                print(f"⚠️  Plot failed for {os.path.basename(path)}: {e}", file=sys.stderr)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run the liveness analyses over recordings")
+    parser.add_argument("inputs", nargs="+", help="Video files, directories or glob patterns")
+    parser.add_argument("--analyses", default=",".join(ANALYSES),
+                        help=f"Comma-separated subset of {', '.join(ANALYSES)} (default: all)")
+    parser.add_argument("--flash-offset", type=float, help="Flash offset (ms) for files without a manifest entry")
+    parser.add_argument("--manifest", help=f"JSON {{filename: flash offset ms}} (default: {MANIFEST_NAME} "
+                                           "next to each file)")
+    parser.add_argument("--out", default="analysis_results.jsonl", help="JSONL output, appended to")
+    parser.add_argument("--workers", type=int, default=config.ENGINE_WORKERS or os.cpu_count() or 1,
+                        help="Processes (default: DEEPSHIELD_ENGINE_WORKERS)")
+    parser.add_argument("--plots", metavar="DIR", help="Also render PNG plots of the center-ROI checks here")
+    parser.add_argument("-r", "--recursive", action="store_true", help="Descend into subdirectories")
+    parser.add_argument("--no-resume", action="store_true", help="Analyze files already in --out again")
+    args = parser.parse_args(argv)
+
+    analyses = [name.strip() for name in args.analyses.split(",") if name.strip()]
+    unknown = [name for name in analyses if name not in ANALYSES]
+    if unknown or not analyses:
+        parser.error(f"unknown analyses: {', '.join(unknown) or '(none)'} (choose from {', '.join(ANALYSES)})")
+
+    files = collect_inputs(args.inputs, args.recursive)
+    done = set() if args.no_resume else load_done(args.out, analyses)
+    todo = [path for path in files if path not in done]
+    if done and len(todo) < len(files):
+        print(f"⏭️  Skipping {len(files) - len(todo)} file(s) already in {args.out}")
+    if not todo:
+        print("✅ Nothing to analyze")
+        return 0
+
+    print(f"🚀 Running {', '.join(analyses)} on {len(todo)} file(s) with {args.workers} worker(s)...")
+    start = time.perf_counter()
+    counts = run(todo, analyses, FlashOffsets(args.flash_offset, args.manifest), args.out, args.workers,
+                 args.plots)
+    print(f"\n📊 {counts['analyzed']} file(s) in {time.perf_counter() - start:.2f}s, {counts['errors']} error(s); "
+          f"results in {args.out}")
+    if args.plots:
+        print(f"🖼️  {counts['plots']} plot set(s) in {args.plots}"
+              + (f", {counts['plot_errors']} failed" if counts["plot_errors"] else ""))
+    return 1 if counts["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
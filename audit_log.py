@@ -0,0 +1,214 @@
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+import config
+import metrics
+
+# Per-request audit log.
+# Every /api/verify_liveness call leaves one JSON line: request id, upload size, frame counts,
+# stage timings, delta, latency, verdict and failure category. write() only appends the record to
+# a bounded in-memory queue; a writer thread serializes the queued records, appends them to the
+# log file in batches and fsyncs at most every DEEPSHIELD_AUDIT_LOG_FSYNC_S seconds, so logging
+# adds no file I/O to a request. When the queue is full (the disk cannot keep up with a burst) new
+# records are dropped and counted in deepshield_audit_log_total instead of growing memory.
+# The file is rotated by size and by age; the newest DEEPSHIELD_AUDIT_LOG_BACKUPS rotated files
+# are kept (audit.jsonl.20261017-120000, ...).
+
+logger = logging.getLogger("deepshield.audit")
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+
+class AuditLog:
+    """
+    Bounded record queue drained by one writer thread into a size/time-rotated JSONL file.
+    """
+
+    def __init__(self, path: str = None, max_records: int = None, batch_size: int = None,
+                 fsync_interval: float = None, max_bytes: int = None, rotate_interval: float = None,
+                 backups: int = None):
+        self.path = config.AUDIT_LOG if path is None else path
+        self.max_records = max(1, max_records or config.AUDIT_LOG_QUEUE_SIZE)
+        self.batch_size = max(1, batch_size or config.AUDIT_LOG_BATCH_SIZE)
+        self.fsync_interval = config.AUDIT_LOG_FSYNC_S if fsync_interval is None else fsync_interval
+        self.max_bytes = int(config.AUDIT_LOG_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.rotate_interval = config.AUDIT_LOG_ROTATE_S if rotate_interval is None else rotate_interval
+        self.backups = config.AUDIT_LOG_BACKUPS if backups is None else backups
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+        self._file = None
+        self._opened_at = 0.0
+        self._synced_at = 0.0
+        self._unsynced = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path) and self.path != "off"
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="deepshield-audit", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """Writes and fsyncs what is still queued (within timeout) and stops the writer."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def write(self, record: dict) -> bool:
+        """Queues a record (not copied: do not change it afterwards). Never raises, never waits for I/O."""
+        if self._thread is None:
+            return False
+        with self._cond:
+            if len(self._queue) >= self.max_records:
+                queued = False
+            else:
+                self._queue.append(record)
+                queued = True
+                if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                    self._cond.notify()
+        metrics.AUDIT_LOG.inc(outcome="queued" if queued else "dropped_queue_full")
+        return queued
+
+    def _next_batch(self):
+        with self._cond:
+            # Wake up for a full batch, for the next due fsync, or to write what arrived meanwhile
+            while len(self._queue) < self.batch_size and not self._closing:
+                if self._unsynced:
+                    remaining = self._synced_at + self.fsync_interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                elif self._queue:
+                    self._cond.wait(self.fsync_interval)
+                    break
+                else:
+                    self._cond.wait()
+            if not self._queue and self._closing:
+                return None
+            return [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+    def _run(self):
+        try:
+            while True:
+                batch = self._next_batch()
+                if batch is None:
+                    return
+                if batch:
+                    self._write_batch(batch)
+                if self._unsynced and (self._closing or time.monotonic() - self._synced_at >= self.fsync_interval):
+                    self._sync()
+        finally:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def _write_batch(self, batch):
+        try:
+            data = "".join(json.dumps(record, default=str) + "\n" for record in batch).encode("utf-8")
+            self._maybe_rotate(len(data))
+            self._file.write(data)
+            self._file.flush()
+            self._unsynced = True
+            metrics.AUDIT_LOG.inc(len(batch), outcome="written")
+        except Exception:
+            logger.exception("Writing audit records failed")
+            metrics.AUDIT_LOG.inc(len(batch), outcome="dropped_error")
+
+    def _sync(self):
+        if self._file is not None and self._unsynced:
+            try:
+                os.fsync(self._file.fileno())
+            except OSError:
+                logger.exception("Syncing the audit log failed")
+        self._unsynced = False
+        self._synced_at = time.monotonic()
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+        # An existing file counts as opened now: its age is only known from this process
+        self._opened_at = time.monotonic()
+
+    def _maybe_rotate(self, incoming: int):
+        if self._file is None:
+            self._open()
+        size = self._file.tell()
+        too_big = self.max_bytes > 0 and size and size + incoming > self.max_bytes
+        too_old = self.rotate_interval > 0 and size and time.monotonic() - self._opened_at >= self.rotate_interval
+        if not (too_big or too_old):
+            return
+        self._sync()
+        self._file.close()
+        self._file = None
+        target = f"{self.path}.{time.strftime('%Y%m%d-%H%M%S')}"
+        # Several rotations within a second: number past the newest one (pruning may have freed
+        # lower numbers, and reusing one would make the newest file sort as the oldest)
+        taken = glob.glob(glob.escape(target) + "*")
+        if taken:
+            target = f"{target}-{max(self._rotation_age(name)[2] for name in taken) + 1}"
+        os.replace(self.path, target)
+        metrics.AUDIT_LOG.inc(outcome="rotated")
+        if self.backups >= 0:
+            rotated = sorted(glob.glob(glob.escape(self.path) + ".*"), key=self._rotation_age)
+            for old in rotated[:max(0, len(rotated) - self.backups)]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        self._open()
+
+    def _rotation_age(self, name: str):
+        # <path>.<YYYYmmdd-HHMMSS>[-<n>]: by timestamp, then by counter within the same second
+        stamp = name[len(self.path) + 1:]
+        date, _, clock = stamp.partition("-")
+        clock, _, counter = clock.partition("-")
+        return date, clock, int(counter) if counter.isdigit() else 0
+
+
+def verify_record(request_id: str, status: int, outcome: str, upload_bytes: int = None, result: dict = None,
+                  stages_ms: dict = None, frames: dict = None, category: str = None) -> dict:
+    """The audit record of one /api/verify_liveness call."""
+    result = result or {}
+    record = {
+        "ts": round(time.time(), 3),
+        "request_id": request_id,
+        "endpoint": "verify",
+        "status": status,
+        "outcome": outcome,
+        "upload_bytes": upload_bytes,
+        "frames": frames or {},
+        "stages_ms": {stage: round(ms, 3) for stage, ms in (stages_ms or {}).items()},
+        "delta": result.get("delta"),
+        "latency_ms": result.get("latency_ms"),
+        "verdict": result.get("is_liveness_verified"),
+        "error_category": category,
+        "message": result.get("message"),
+    }
+    for key in ("cache", "challenge_id"):
+        if key in result:
+            record[key] = result[key]
+    return record
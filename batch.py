@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from functools import partial
+
+from starlette.concurrency import run_in_threadpool
+
+import config
+import metrics
+from engine_pool import EngineBusy
+from ingest import UploadSource, read_upload
+from physics_engine import analyze_video_challenge
+from probe import UploadRejected
+
+# Batch verification (audits / re-verification).
+# Items come from repeated multipart files or a zip archive. They run through the shared engine
+# pool with a per-batch concurrency cap, and one NDJSON line is streamed per item as soon as it
+# completes, followed by a summary line. A failing item never aborts the batch.
+# Every item is admitted like a /api/verify_liveness upload: probed against the DEEPSHIELD_MAX_*
+# limits before any decode (rejected items get "status": 413) and analyzed under its own
+# DEEPSHIELD_REQUEST_DEADLINE_S. Archive members are extracted one at a time as their item is
+# scheduled, in memory up to DEEPSHIELD_INGEST_MAX_MEMORY_MB and streamed to a temp file above.
+
+VIDEO_EXTENSIONS = (".webm", ".mp4", ".mkv", ".avi", ".mov")
+MANIFEST_NAME = "manifest.json"
+
+
+class BatchError(Exception):
+    """Raised for malformed batch requests (rejected with 400 before any work starts)."""
+
+
+class BatchItem:
+    def __init__(self, index: int, name: str, flash_offset: float, load):
+        self.index = index
+        self.name = name
+        self.flash_offset = flash_offset
+        # Coroutine function returning the item's ingest.UploadSource; called only when the item is scheduled
+        self.load = load
+
+
+def _check_upload_size(size: int):
+    # Declared size only: the probe applies every limit once the item is read
+    if size is not None and size > config.MAX_UPLOAD_MB * 1024 * 1024:
+        raise UploadRejected(f"Upload exceeds {config.MAX_UPLOAD_MB:g} MB")
+
+
+def _extract_member(archive: zipfile.ZipFile, name: str) -> UploadSource:
+    """One archive member as an UploadSource, read in chunks rather than held whole when large."""
+    info = archive.getinfo(name)
+    with archive.open(info) as member:
+        if info.file_size <= config.INGEST_MAX_MEMORY_MB * 1024 * 1024:
+            data = member.read()
+            return UploadSource(data, len(data))
+        fd, temp_path = tempfile.mkstemp(suffix=os.path.splitext(name)[1] or ".webm")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                shutil.copyfileobj(member, out)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+        return UploadSource(temp_path, info.file_size, temp_path=temp_path)
+
+
+def items_from_uploads(video_files, flash_offsets, default_offset: float = None):
+    """Multipart bundle: repeated video_files with flash_offsets in the same order (or one default)."""
+    flash_offsets = flash_offsets or []
+    if flash_offsets and len(flash_offsets) != len(video_files):
+        raise BatchError(f"Got {len(video_files)} videos but {len(flash_offsets)} flash offsets")
+    if not flash_offsets and default_offset is None:
+        raise BatchError("Provide flash_offsets (one per video) or a default flash_offset")
+
+    items = []
+    for index, upload in enumerate(video_files):
+        offset = flash_offsets[index] if flash_offsets else default_offset
+
+        async def load(upload=upload):
+            _check_upload_size(upload.size)
+            return await read_upload(upload)
+
+        items.append(BatchItem(index, upload.filename or f"item-{index}", offset, load))
+    return items
+
+
+def items_from_archive(file, default_offset: float = None):
+    """
+    Zip archive of videos (a seekable file, e.g. the spooled upload; it must stay open while the
+    batch runs). Offsets come from an optional manifest.json ({"name.webm": offset_ms, ...}) and
+    fall back to the request's flash_offset.
+    """
+    try:
+        archive = zipfile.ZipFile(file)
+    except zipfile.BadZipFile as e:
+        raise BatchError(f"Invalid archive: {e}")
+
+    manifest = {}
+    if MANIFEST_NAME in archive.namelist():
+        try:
+            manifest = json.loads(archive.read(MANIFEST_NAME))
+        except ValueError as e:
+            raise BatchError(f"Invalid {MANIFEST_NAME}: {e}")
+
+    names = sorted(
+        info.filename for info in archive.infolist()
+        if not info.is_dir() and info.filename.lower().endswith(VIDEO_EXTENSIONS)
+    )
+    items = []
+    for index, name in enumerate(names):
+        offset = manifest.get(name, manifest.get(os.path.basename(name), default_offset))
+        if offset is None:
+            raise BatchError(f"No flash offset for '{name}' (add it to {MANIFEST_NAME} or send flash_offset)")
+
+        async def load(name=name):
+            _check_upload_size(archive.getinfo(name).file_size)
+            return await run_in_threadpool(_extract_member, archive, name)
+
+        items.append(BatchItem(index, name, float(offset), load))
+    return items
+
+
+async def _run_item(item: BatchItem, engine_pool, semaphore, probe_upload) -> dict:
+    async with semaphore:
+        line = {"index": item.index, "name": item.name, "flash_offset": item.flash_offset}
+        deadline = time.time() + config.REQUEST_DEADLINE_S if config.REQUEST_DEADLINE_S > 0 else None
+        source = None
+        try:
+            source = await item.load()
+            info, admission = await probe_upload(source, None, item.flash_offset)
+            if info is None:
+                result = {
+                    "is_liveness_verified": False,
+                    "latency_ms": 0.0,
+                    "delta": 0.0,
+                    "message": "Error opening video file."
+                }
+            else:
+                engine = partial(analyze_video_challenge, detect_width=admission["detect_width"], deadline=deadline)
+                while True:
+                    try:
+                        result = await engine_pool.run(engine, source.video, item.flash_offset,
+                                                       cost=admission["cost_s"])
+                        break
+                    except EngineBusy as e:
+                        # Batch work yields to live traffic: wait for a slot instead of failing the item
+                        await asyncio.sleep(e.retry_after)
+            metrics.record_result("batch", result)
+            line.update({"ok": True, "result": result})
+        except UploadRejected as e:
+            metrics.REQUESTS.inc(endpoint="batch", outcome="too_large")
+            line.update({"ok": False, "status": 413, "error": str(e)})
+        except Exception as e:
+            metrics.REQUESTS.inc(endpoint="batch", outcome="failed")
+            metrics.FAILURES.inc(category="batch_item")
+            line.update({"ok": False, "error": str(e) or type(e).__name__})
+        finally:
+            if source is not None:
+                await run_in_threadpool(source.cleanup)
+        return line
+
+
+async def stream_batch(items, engine_pool, concurrency: int, probe_upload):
+    """
+    Async generator of NDJSON lines, one per item in completion order, then a summary.
+    probe_upload(source, schedule, flash_offset) -> (info, admission) is the API's upload probe.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    tasks = [asyncio.ensure_future(_run_item(item, engine_pool, semaphore, probe_upload)) for item in items]
+    succeeded = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            line = await next_done
+            if line["ok"]:
+                succeeded += 1
+            else:
+                failed += 1
+            yield json.dumps(line) + "\n"
+    finally:
+        # Client went away: stop scheduling the rest of the batch
+        for task in tasks:
+            task.cancel()
+
+    yield json.dumps({"summary": True, "total": len(items), "succeeded": succeeded, "failed": failed}) + "\n"
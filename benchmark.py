@@ -1,86 +1,298 @@
-import requests
+import argparse
+import asyncio
+import json
 import os
-import glob
-from concurrent.futures import ThreadPoolExecutor
+import platform
+import subprocess
+import sys
+import time
+
+import httpx
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# HTTP load benchmark for /api/verify_liveness.
+# Starts the app locally (in-process ASGI or a uvicorn subprocess), sweeps client concurrency
+# levels with a closed loop of back-to-back requests, and reports throughput, latency
+# percentiles, error / rejection (429/503) rates and server CPU / RSS for every level.
+# Results are written as JSON so builds can be compared.
+# Every request uploads the same bytes with the same flash_offset, which the verdict cache would
+# answer without the engine ("hit" / "shared"). The local modes therefore start the app with
+# DEEPSHIELD_RESULT_CACHE_SIZE=0; for --mode url the cache answers are counted per level.
+
+ENDPOINT = "/api/verify_liveness"
+REJECT_STATUSES = (429, 503)
+
+
+class ServerSampler:
+    """Samples CPU time and RSS of the server process tree (API process + engine workers)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.rss_peak = 0
+        self._task = None
+        self._cpu_start = 0.0
+        self._wall_start = 0.0
+
+    def _tree(self):
+        try:
+            root = psutil.Process(self.pid)
+            return [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return []
+
+    def _cpu_seconds(self):
+        total = 0.0
+        for proc in self._tree():
+            try:
+                times = proc.cpu_times()
+                total += times.user + times.system
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    def _rss(self):
+        total = 0
+        for proc in self._tree():
+            try:
+                total += proc.memory_info().rss
+            except psutil.NoSuchProcess:
+                pass
+        return total
+
+    async def _sample(self, interval: float):
+        while True:
+            self.rss_peak = max(self.rss_peak, self._rss())
+            await asyncio.sleep(interval)
+
+    def start(self, interval: float = 0.25):
+        self.rss_peak = 0
+        self._cpu_start = self._cpu_seconds()
+        self._wall_start = time.perf_counter()
+        self._task = asyncio.ensure_future(self._sample(interval))
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        cpu_seconds = self._cpu_seconds() - self._cpu_start
+        wall = time.perf_counter() - self._wall_start
+        return {
+            "cpu_seconds": cpu_seconds,
+            "cpu_percent": 100.0 * cpu_seconds / wall if wall > 0 else 0.0,
+            "rss_mb_peak": self.rss_peak / (1024 * 1024),
+        }
+
+
+async def run_level(client, videos, flash_offset, concurrency, duration, max_requests):
+    latencies = []
+    statuses = {}
+    cached = 0
+    errors = 0
+    issued = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker(worker_id):
+        nonlocal cached, errors, issued
+        i = worker_id
+        while time.perf_counter() < deadline and (not max_requests or issued < max_requests):
+            issued += 1
+            name, data = videos[i % len(videos)]
+            i += concurrency
+            start = time.perf_counter()
+            try:
+                response = await client.post(
+                    ENDPOINT,
+                    files={"video_file": (name, data, "video/webm")},
+                    data={"flash_offset": str(flash_offset)},
+                )
+                status = response.status_code
+                if status == 200:
+                    body = response.json()
+                    if "Internal Server Error" in body.get("message", ""):
+                        status = "engine_error"
+                    elif body.get("cache") in ("hit", "shared"):
+                        cached += 1
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            if status == 200:
+                latencies.append((time.perf_counter() - start) * 1000.0)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    total = sum(statuses.values()) + errors
+    ok = statuses.get(200, 0)
+    rejected = sum(statuses.get(s, 0) for s in REJECT_STATUSES)
+    failed = total - ok - rejected
+    ok_latencies = np.array(latencies) if latencies else np.zeros(1)
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": ok,
+        "rejected": rejected,
+        "errors": failed,
+        "statuses": {str(k): v for k, v in statuses.items()},
+        # Answered by the verdict cache, not the engine (only possible with --mode url)
+        "cached": cached,
+        "elapsed_s": elapsed,
+        "throughput_rps": ok / elapsed if elapsed > 0 else 0.0,
+        "error_rate": failed / total if total else 0.0,
+        "rejection_rate": rejected / total if total else 0.0,
+        # Latency of successful verifications only; fast 503 rejections would hide queueing
+        "latency_ms": {
+            "p50": float(np.percentile(ok_latencies, 50)),
+            "p95": float(np.percentile(ok_latencies, 95)),
+            "p99": float(np.percentile(ok_latencies, 99)),
+            "mean": float(np.mean(ok_latencies)),
+            "max": float(np.max(ok_latencies)),
+        },
+    }
+
+
+async def wait_ready(client, timeout: float):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if (await client.get("/api/ready")).status_code == 200:
+                return True
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.25)
+    return False
 
-API_URL = "http://127.0.0.1:8000/verify_liveness"
-REAL_DIR = os.path.join("test_data", "real")
-FAKE_DIR = os.path.join("test_data", "fakes")
 
-# Challenge pattern used for testing (Must match what's in the videos)
-CHALLENGE = "red,green,blue"
+async def sweep(client, server_pid, args, videos):
+    if not await wait_ready(client, args.ready_timeout):
+        print("⚠️  Server never reported ready; benchmarking anyway")
 
-def test_video(file_path):
+    sampler = ServerSampler(server_pid) if psutil and server_pid else None
+    if sampler is None:
+        print("ℹ️  Server CPU/RSS not sampled (install psutil, and use --mode asgi/uvicorn or --server-pid)")
+
+    levels = []
+    print(f"{'conc':>5} {'req':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'err%':>6} {'rej%':>6} {'cpu%':>7} {'rss MB':>8}")
+    for concurrency in args.concurrency:
+        # Short warm-up so each level starts from a steady state
+        await run_level(client, videos, args.flash_offset, concurrency, args.warmup, 0)
+
+        if sampler:
+            sampler.start()
+        level = await run_level(client, videos, args.flash_offset, concurrency, args.duration, args.requests)
+        level["server"] = await sampler.stop() if sampler else None
+        levels.append(level)
+
+        server = level["server"] or {"cpu_percent": float("nan"), "rss_mb_peak": float("nan")}
+        lat = level["latency_ms"]
+        print(f"{concurrency:>5} {level['requests']:>6} {level['throughput_rps']:>8.2f} {lat['p50']:>8.0f} "
+              f"{lat['p95']:>8.0f} {lat['p99']:>8.0f} {100 * level['error_rate']:>6.1f} "
+              f"{100 * level['rejection_rate']:>6.1f} {server['cpu_percent']:>7.0f} {server['rss_mb_peak']:>8.0f}")
+        if level["cached"]:
+            print(f"⚠️  {level['cached']} of {level['ok']} answers came from the verdict cache, not the engine "
+                  f"(start the server with DEEPSHIELD_RESULT_CACHE_SIZE=0)")
+    return levels
+
+
+async def run_asgi(args, videos):
+    import main
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://deepshield", timeout=args.timeout) as client:
+            return await sweep(client, os.getpid(), args, videos)
+
+
+async def run_uvicorn(args, videos):
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.port),
+           "--log-level", "warning"]
+    server = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)))
     try:
-        files = {'video': open(file_path, 'rb')}
-        data = {'challenge_pattern': CHALLENGE}
-        response = requests.post(API_URL, files=files, data=data)
-        if response.status_code == 200:
-            return response.json()
-        return None
-    except Exception as e:
-        print(f"Error testing {file_path}: {e}")
+        limits = httpx.Limits(max_connections=max(args.concurrency))
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=args.timeout,
+                                     limits=limits) as client:
+            return await sweep(client, server.pid, args, videos)
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+async def run_url(args, videos):
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        return await sweep(client, args.server_pid, args, videos)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
         return None
 
-# Redirect print to file
-import sys
-sys.stdout = open("benchmark_results.txt", "w", encoding="utf-8")
-
-def run_benchmark():
-    print("🚀 Starting DeepShield Benchmark...")
-    
-    real_videos = glob.glob(os.path.join(REAL_DIR, "*.*"))
-    fake_videos = glob.glob(os.path.join(FAKE_DIR, "*.*"))
-    
-    print(f"Found {len(real_videos)} Real videos and {len(fake_videos)} Fake videos.")
-    
-    tp = 0 # True Positive (Real detected as Real)
-    tn = 0 # True Negative (Fake detected as Fake)
-    fp = 0 # False Positive (Fake detected as Real)
-    fn = 0 # False Negative (Real detected as Fake)
-    
-    # Test Real Videos
-    print("\nTesting Real Videos...")
-    for vid in real_videos:
-        res = test_video(vid)
-        if res and res['is_real']:
-            print(f"✅ [PASS] {os.path.basename(vid)} -> Real (Conf: {res['confidence']})")
-            tp += 1
-        else:
-            print(f"❌ [FAIL] {os.path.basename(vid)} -> Fake (Conf: {res.get('confidence', 0) if res else 'Err'})")
-            fn += 1
-            
-    # Test Fake Videos
-    print("\nTesting Fake Videos...")
-    for vid in fake_videos:
-        res = test_video(vid)
-        if res and not res['is_real']:
-            print(f"✅ [PASS] {os.path.basename(vid)} -> Fake")
-            tn += 1
-        else:
-            print(f"❌ [FAIL] {os.path.basename(vid)} -> Real (Conf: {res.get('confidence', 0) if res else 'Err'})")
-            fp += 1
-
-    # Metrics
-    total_real = len(real_videos)
-    total_fake = len(fake_videos)
-    
-    accuracy = (tp + tn) / (total_real + total_fake) if (total_real + total_fake) > 0 else 0
-    
-    print("\n" + "="*40)
-    print(f"📊 BENCHMARK RESULTS")
-    print(f"Accuracy: {accuracy*100:.2f}%")
-    print(f"True Positives: {tp}/{total_real}")
-    print(f"True Negatives: {tn}/{total_fake}")
-    print("="*40)
-    
-    if fn > 0:
-        print("💡 Suggestion: Decrease Confidence Threshold? (Too many Reals rejected)")
-    if fp > 0:
-        print("💡 Suggestion: Increase Confidence Threshold? (Too many Fakes accepted)")
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepShield HTTP load benchmark")
+    parser.add_argument("--video", action="append", required=True, help="Challenge video to upload (repeatable)")
+    parser.add_argument("--flash-offset", type=float, default=1000.0, help="flash_offset (ms) sent with each upload")
+    parser.add_argument("--mode", choices=("asgi", "uvicorn", "url"), default="uvicorn",
+                        help="asgi = in-process app, uvicorn = local server subprocess, url = existing server")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Base URL for --mode url")
+    parser.add_argument("--server-pid", type=int, help="Server pid to sample CPU/RSS in --mode url")
+    parser.add_argument("--port", type=int, default=8077, help="Port for --mode uvicorn")
+    parser.add_argument("--concurrency", default="1,2,4,8,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=20.0, help="Seconds per level")
+    parser.add_argument("--requests", type=int, default=0, help="Max requests per level (0 = duration only)")
+    parser.add_argument("--warmup", type=float, default=2.0, help="Warm-up seconds before each level")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout (s)")
+    parser.add_argument("--ready-timeout", type=float, default=120.0, help="Wait for /api/ready (s)")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    args = parser.parse_args()
+    args.concurrency = [int(c) for c in args.concurrency.split(",")]
+
+    videos = []
+    for path in args.video:
+        with open(path, "rb") as f:
+            videos.append((os.path.basename(path), f.read()))
+
+    if args.mode != "url":
+        # Identical uploads would be answered from the verdict cache; measure the engine instead.
+        # Set before main is imported (asgi) and inherited by the uvicorn subprocess.
+        os.environ["DEEPSHIELD_RESULT_CACHE_SIZE"] = "0"
+    print(f"🚀 DeepShield load benchmark ({args.mode}) on {len(videos)} video(s)")
+    runner = {"asgi": run_asgi, "uvicorn": run_uvicorn, "url": run_url}[args.mode]
+    levels = asyncio.run(runner(args, videos))
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_revision": git_revision(),
+            "mode": args.mode,
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "videos": [name for name, _ in videos],
+            "flash_offset": args.flash_offset,
+            "duration_s": args.duration,
+            "config": {k: v for k, v in os.environ.items() if k.startswith("DEEPSHIELD_")},
+            "result_cache": "off" if args.mode != "url" else "server setting (see levels[].cached)",
+        },
+        "levels": levels,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {args.output}")
+
 
 if __name__ == "__main__":
-    if not os.path.exists(REAL_DIR) or not os.path.exists(FAKE_DIR):
-        print("Error: test_data/real and test_data/fakes directories must exist.")
-    else:
-        run_benchmark()
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from detectors import get_detector
+from physics_engine import analyze_video_challenge
+from tracking import FaceTracker
+
+# Detection-resolution benchmark.
+# For every (detect_width, scale_factor, roi_mode) setting it measures the face-localisation
+# cost per frame and how closely the boxes match the reference setting (native resolution,
+# scale factor 1.1, full detection on every frame), plus the end-to-end verdict and delta.
+
+
+def load_frames(path: str, max_frames: int):
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def iou(a, b):
+    if a is None or b is None:
+        return 1.0 if a is None and b is None else 0.0
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    ix = max(0, min(ax + aw, bx + bw) - max(ax, bx))
+    iy = max(0, min(ay + ah, by + bh) - max(ay, by))
+    inter = ix * iy
+    union = aw * ah + bw * bh - inter
+    return inter / union if union > 0 else 0.0
+
+
+def locate_all(frames, detector, mode, detect_width, scale_factor):
+    tracker = FaceTracker(detector, mode=mode, detect_width=detect_width, scale_factor=scale_factor)
+    start = time.perf_counter()
+    boxes = [tracker.locate(frame) for frame in frames]
+    elapsed = time.perf_counter() - start
+    return boxes, elapsed
+
+
+def run_benchmark(videos, widths, scale_factors, modes, flash_offset, max_frames):
+    detector = get_detector()
+    results = []
+
+    for path in videos:
+        frames = load_frames(path, max_frames)
+        if not frames:
+            print(f"⚠️  Skipping {path}: no frames decoded")
+            continue
+        height, width = frames[0].shape[:2]
+        print(f"\n🎞️  {os.path.basename(path)} ({width}x{height}, {len(frames)} frames)")
+
+        reference_boxes, _ = locate_all(frames, detector, "detect", 0, 1.1)
+        # The same recording under a grid of settings: none of these runs is a session for the trace store
+        reference = analyze_video_challenge(path, flash_offset, roi_mode="detect", detect_width=0, scale_factor=1.1,
+                                            record=False)
+
+        print(f"{'mode':<7} {'width':>6} {'scale':>6} {'ms/frame':>9} {'mean IoU':>9} {'found':>6} {'delta':>8} {'verdict':>8}")
+        for mode in modes:
+            for detect_width in widths:
+                for scale_factor in scale_factors:
+                    boxes, elapsed = locate_all(frames, detector, mode, detect_width, scale_factor)
+                    ious = [iou(a, b) for a, b in zip(reference_boxes, boxes)]
+                    found = sum(1 for b in boxes if b is not None) / len(boxes)
+                    engine = analyze_video_challenge(path, flash_offset, roi_mode=mode,
+                                                     detect_width=detect_width, scale_factor=scale_factor,
+                                                     record=False)
+                    row = {
+                        "video": path,
+                        "resolution": [width, height],
+                        "mode": mode,
+                        "detect_width": detect_width,
+                        "scale_factor": scale_factor,
+                        "ms_per_frame": 1000.0 * elapsed / len(frames),
+                        "mean_iou": float(np.mean(ious)),
+                        "face_found_ratio": found,
+                        "delta": engine["delta"],
+                        "delta_error": engine["delta"] - reference["delta"],
+                        "verdict": engine["is_liveness_verified"],
+                        "verdict_matches_reference": engine["is_liveness_verified"] == reference["is_liveness_verified"],
+                    }
+                    results.append(row)
+                    print(f"{mode:<7} {detect_width or 'native':>6} {scale_factor:>6.2f} {row['ms_per_frame']:>9.2f} "
+                          f"{row['mean_iou']:>9.3f} {found:>6.0%} {row['delta']:>8.2f} {str(row['verdict']):>8}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare face-detection resolution / scale-factor settings")
+    parser.add_argument("videos", nargs="+", help="Video files or glob patterns")
+    parser.add_argument("--widths", default="0,640,480,320,240", help="Detection widths (0 = native)")
+    parser.add_argument("--scale-factors", default="1.1,1.2,1.3", help="Cascade pyramid steps")
+    parser.add_argument("--modes", default="detect,track", help="ROI modes to compare")
+    parser.add_argument("--flash-offset", type=float, default=1000.0, help="Flash offset (ms) for the verdict")
+    parser.add_argument("--max-frames", type=int, default=150, help="Frames per video used for timing")
+    parser.add_argument("--json", help="Write all rows to this JSON file")
+    args = parser.parse_args()
+
+    videos = []
+    for pattern in args.videos:
+        videos.extend(sorted(glob.glob(pattern)) or [pattern])
+
+    results = run_benchmark(
+        videos,
+        widths=[int(w) for w in args.widths.split(",")],
+        scale_factors=[float(s) for s in args.scale_factors.split(",")],
+        modes=args.modes.split(","),
+        flash_offset=args.flash_offset,
+        max_frames=args.max_frames,
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\n💾 Wrote {len(results)} rows to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import config
+from engine_pool import _init_worker, _timed_call
+from physics_engine import analyze_video_challenge
+from synthetic_clips import CORPUS_FILE, generate_corpus, load_corpus
+
+# Offline engine benchmark.
+# Runs analyze_video_challenge directly (no HTTP) over a synthetic corpus with a process pool
+# configured like the API's engine workers, and reports decode/analysis throughput, per-clip
+# wall time and accuracy against the corpus labels. With --baseline it compares against an
+# earlier run and exits non-zero on an accuracy or throughput regression.
+
+
+def _frames(result: dict) -> int:
+    # Frames pulled from the decoder: analyzed ones plus those only grabbed (outside the window)
+    return result.get("analyzed_frames", 0) + result.get("skipped_frames", 0)
+
+
+def run_corpus(directory: str, specs, workers: int):
+    rows = []
+    context = multiprocessing.get_context("spawn")
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(config.ENGINE_CV_THREADS,)) as executor:
+        futures = {
+            executor.submit(_timed_call, analyze_video_challenge, os.path.join(directory, spec.filename),
+                            spec.flash_offset_ms): spec
+            for spec in specs
+        }
+        for future in as_completed(futures):
+            spec = futures[future]
+            result, elapsed = future.result()
+            frames = _frames(result)
+            verdict = result["is_liveness_verified"]
+            rows.append({
+                "name": spec.name,
+                "kind": spec.kind,
+                "codec": spec.codec,
+                "resolution": [spec.width, spec.height],
+                "fps": spec.fps,
+                "expected": spec.expected,
+                "verdict": verdict,
+                "correct": verdict == spec.expected,
+                "delta": result["delta"],
+                "latency_ms": result["latency_ms"],
+                "message": result["message"],
+                "frames": frames,
+                "wall_ms": 1000.0 * elapsed,
+                "frames_per_s": frames / elapsed if elapsed > 0 else 0.0,
+                "stages_ms": result.get("timings", {}).get("stages_ms", {}),
+            })
+    wall = time.perf_counter() - start
+    rows.sort(key=lambda row: row["name"])
+    return rows, wall
+
+
+def summarize(rows, wall: float, workers: int) -> dict:
+    wall_ms = np.array([row["wall_ms"] for row in rows])
+    total_frames = sum(row["frames"] for row in rows)
+    lives = [row for row in rows if row["expected"]]
+    fakes = [row for row in rows if not row["expected"]]
+    stages_ms = {}
+    for row in rows:
+        for stage, ms in row["stages_ms"].items():
+            stages_ms[stage] = stages_ms.get(stage, 0.0) + ms
+    by_kind = {}
+    for row in rows:
+        entry = by_kind.setdefault(row["kind"], {"clips": 0, "correct": 0})
+        entry["clips"] += 1
+        entry["correct"] += int(row["correct"])
+    return {
+        "clips": len(rows),
+        "workers": workers,
+        "wall_s": wall,
+        "clips_per_s": len(rows) / wall if wall > 0 else 0.0,
+        "frames_per_s": total_frames / wall if wall > 0 else 0.0,
+        "clip_wall_ms": {
+            "p50": float(np.percentile(wall_ms, 50)),
+            "p95": float(np.percentile(wall_ms, 95)),
+            "max": float(np.max(wall_ms)),
+        },
+        "accuracy": sum(row["correct"] for row in rows) / len(rows),
+        # False accept: a fake verified as live. False reject: a live clip rejected.
+        "false_accept_rate": sum(row["verdict"] for row in fakes) / len(fakes) if fakes else 0.0,
+        "false_reject_rate": sum(not row["verdict"] for row in lives) / len(lives) if lives else 0.0,
+        "by_kind": by_kind,
+        # Engine time per stage summed over all clips (where the CPU went)
+        "stages_ms": stages_ms,
+    }
+
+
+def compare(summary: dict, baseline: dict, max_slowdown: float, max_accuracy_drop: float):
+    """Returns a list of regression messages (empty when within tolerance)."""
+    problems = []
+    base = baseline["summary"]
+    if summary["accuracy"] < base["accuracy"] - max_accuracy_drop:
+        problems.append(f"accuracy {summary['accuracy']:.1%} < baseline {base['accuracy']:.1%}")
+    if summary["frames_per_s"] < base["frames_per_s"] * (1.0 - max_slowdown):
+        problems.append(f"throughput {summary['frames_per_s']:.0f} frames/s < baseline "
+                        f"{base['frames_per_s']:.0f} frames/s (-{max_slowdown:.0%} allowed)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline engine throughput / accuracy benchmark")
+    parser.add_argument("corpus", help="Corpus directory (from synthetic_clips.py)")
+    parser.add_argument("--generate", type=int, metavar="N", help="Generate an N-clip corpus first if missing")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for --generate")
+    parser.add_argument("--workers", type=int, default=config.ENGINE_WORKERS or os.cpu_count() or 1,
+                        help="Engine processes (default: DEEPSHIELD_ENGINE_WORKERS)")
+    parser.add_argument("--json", help="Write rows and summary to this JSON file")
+    parser.add_argument("--baseline", help="Earlier --json output to compare against")
+    parser.add_argument("--max-slowdown", type=float, default=0.15, help="Allowed frames/s drop vs baseline")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0, help="Allowed accuracy drop vs baseline")
+    args = parser.parse_args()
+
+    if args.generate and not os.path.exists(os.path.join(args.corpus, CORPUS_FILE)):
+        print(f"🎨 Generating {args.generate} clips in {args.corpus} (seed {args.seed})...")
+        generate_corpus(args.corpus, args.generate, args.seed)
+    specs = load_corpus(args.corpus)
+
+    print(f"🚀 Running {len(specs)} clips on {args.workers} worker(s)...")
+    rows, wall = run_corpus(args.corpus, specs, args.workers)
+
+    print(f"{'clip':<32} {'exp':>5} {'got':>5} {'delta':>7} {'lat ms':>7} {'frames':>6} {'wall ms':>8} {'fps':>7}")
+    for row in rows:
+        mark = "" if row["correct"] else "  ❌"
+        print(f"{row['name']:<32} {str(row['expected']):>5} {str(row['verdict']):>5} {row['delta']:>7.2f} "
+              f"{row['latency_ms']:>7.0f} {row['frames']:>6} {row['wall_ms']:>8.0f} {row['frames_per_s']:>7.0f}{mark}")
+
+    summary = summarize(rows, wall, args.workers)
+    print(f"\n📊 {summary['clips']} clips in {wall:.2f}s: {summary['frames_per_s']:.0f} frames/s, "
+          f"clip p50 {summary['clip_wall_ms']['p50']:.0f} ms / p95 {summary['clip_wall_ms']['p95']:.0f} ms")
+    engine_ms = summary["stages_ms"].get("engine") or 1.0
+    print("⏱️  " + ", ".join(f"{stage} {100 * ms / engine_ms:.0f}%" for stage, ms in summary["stages_ms"].items()
+                           if stage != "engine"))
+    print(f"🎯 Accuracy {summary['accuracy']:.1%} (FAR {summary['false_accept_rate']:.1%}, "
+          f"FRR {summary['false_reject_rate']:.1%})")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "rows": rows}, f, indent=2)
+        print(f"💾 Results written to {args.json}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            problems = compare(summary, json.load(f), args.max_slowdown, args.max_accuracy_drop)
+        for problem in problems:
+            print(f"⚠️  Regression: {problem}")
+        if problems:
+            sys.exit(1)
+        print("✅ No regression against baseline")
+
+
+if __name__ == "__main__":
+    main()
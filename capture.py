@@ -0,0 +1,264 @@
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+import zipfile
+from collections import deque
+
+import config
+import metrics
+
+# Background dataset capture ("Blackbox").
+# Finished uploads and their verdicts are offered to a bounded in-memory queue; a writer thread
+# packs them into compressed zip batches (videos plus a manifest.jsonl) and hands each batch to a
+# backend: a local directory (dataset/collected_videos by default) or Firebase Storage. offer()
+# never blocks and never raises, so capture cannot delay or fail a verification. Uploads are
+# sampled at DEEPSHIELD_CAPTURE_RATE; when the queue is full the newest or the oldest record is
+# dropped (DEEPSHIELD_CAPTURE_OVERFLOW) and counted in deepshield_capture_total.
+# Captured videos are biometric data: only enable this with the users' consent.
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest")
+COMPRESSION = {"stored": zipfile.ZIP_STORED, "deflated": zipfile.ZIP_DEFLATED,
+               "bzip2": zipfile.ZIP_BZIP2, "lzma": zipfile.ZIP_LZMA}
+
+logger = logging.getLogger("deepshield.capture")
+
+
+class _Record:
+    __slots__ = ("id", "video", "path", "size", "extension", "metadata")
+
+    def __init__(self, video, size: int, extension: str, metadata: dict):
+        self.id = uuid.uuid4().hex
+        # Either the upload bytes, or a hard link to a spooled upload that this record owns
+        self.video = video if isinstance(video, bytes) else None
+        self.path = None if isinstance(video, bytes) else video
+        self.size = size
+        self.extension = extension
+        self.metadata = metadata
+
+    def read(self) -> bytes:
+        if self.video is not None:
+            return self.video
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def discard(self):
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+class CaptureBackend:
+    """Where finished batches go."""
+
+    def write(self, name: str, data: bytes):
+        raise NotImplementedError
+
+
+class LocalDirectoryBackend(CaptureBackend):
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def write(self, name: str, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name and renamed, so readers never see a partial batch
+        path = os.path.join(self.directory, name)
+        partial = path + ".partial"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+
+
+class FirebaseStorageBackend(CaptureBackend):
+    """Batches uploaded to a Firebase Storage bucket with the serviceAccountKey.json credentials."""
+
+    PREFIX = "collected_videos/"
+
+    def __init__(self, bucket: str, credentials_file: str = "serviceAccountKey.json"):
+        try:
+            import firebase_admin
+            from firebase_admin import credentials, storage
+        except ImportError:
+            raise RuntimeError("DEEPSHIELD_CAPTURE_BACKEND is a firebase:// URL but firebase-admin is not installed")
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(credentials_file), {"storageBucket": bucket})
+        self._bucket = storage.bucket(bucket)
+
+    def write(self, name: str, data: bytes):
+        self._bucket.blob(self.PREFIX + name).upload_from_string(data, content_type="application/zip")
+
+
+def create_backend(spec: str = None) -> CaptureBackend:
+    spec = spec or config.CAPTURE_BACKEND
+    if spec.startswith("firebase://"):
+        return FirebaseStorageBackend(spec[len("firebase://"):])
+    if spec.startswith("file://"):
+        spec = spec[len("file://"):]
+    return LocalDirectoryBackend(spec)
+
+
+class CapturePipeline:
+    """
+    Bounded capture queue (by record count and bytes) drained by one writer thread. A batch is
+    written once batch_size records are waiting or flush_interval seconds after its first one.
+    """
+
+    def __init__(self, backend: CaptureBackend = None, rate: float = None, max_records: int = None,
+                 max_bytes: int = None, overflow: str = None, batch_size: int = None,
+                 flush_interval: float = None, compression: str = None):
+        self.rate = config.CAPTURE_RATE if rate is None else rate
+        self.max_records = max(1, max_records or config.CAPTURE_QUEUE_SIZE)
+        self.max_bytes = max_bytes or int(config.CAPTURE_QUEUE_MB * 1024 * 1024)
+        self.overflow = overflow or config.CAPTURE_OVERFLOW
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown capture overflow policy '{self.overflow}' "
+                             f"(choose from {', '.join(OVERFLOW_POLICIES)})")
+        compression = compression or config.CAPTURE_COMPRESSION
+        if compression not in COMPRESSION:
+            raise ValueError(f"Unknown capture compression '{compression}' (choose from {', '.join(COMPRESSION)})")
+        self.compression = COMPRESSION[compression]
+        self.batch_size = max(1, batch_size or config.CAPTURE_BATCH_SIZE)
+        self.flush_interval = config.CAPTURE_FLUSH_S if flush_interval is None else flush_interval
+        self._backend = backend
+        self._queue = deque()
+        self._bytes = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closing = False
+        self._batches = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def __len__(self):
+        return len(self._queue)
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        if self._backend is None:
+            self._backend = create_backend()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name="deepshield-capture", daemon=True)
+        self._thread.start()
+
+    def close(self, timeout: float = 10.0):
+        """Writes what is still queued (within timeout) and stops the writer."""
+        if self._thread is None:
+            return
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def offer(self, video, result: dict, params: dict = None, extension: str = ".webm") -> bool:
+        """
+        Queues an upload (bytes or the path of a spooled upload) with its verdict, if it is sampled
+        and fits. Returns whether it was queued; never raises and never waits for the writer.
+        """
+        if not self.enabled or self._thread is None:
+            return False
+        try:
+            if random.random() >= self.rate:
+                metrics.CAPTURE.inc(outcome="skipped")
+                return False
+            if not isinstance(video, bytes):
+                # Spooled upload: hard-link it so the request can delete its copy right away
+                link = f"{video}.capture"
+                os.link(video, link)
+                video = link
+                size = os.path.getsize(link)
+            else:
+                size = len(video)
+            metadata = {
+                "captured_at": time.time(),
+                "params": params or {},
+                "result": {k: v for k, v in result.items() if k not in ("timings", "profile")},
+            }
+            return self._enqueue(_Record(video, size, extension, metadata))
+        except Exception:
+            logger.exception("Capture failed")
+            metrics.CAPTURE.inc(outcome="dropped_error")
+            return False
+
+    def _enqueue(self, record: _Record) -> bool:
+        dropped = []
+        with self._cond:
+            if record.size > self.max_bytes:
+                dropped.append(record)
+            elif self.overflow == "drop_newest":
+                if len(self._queue) >= self.max_records or self._bytes + record.size > self.max_bytes:
+                    dropped.append(record)
+            else:
+                while self._queue and (len(self._queue) >= self.max_records
+                                       or self._bytes + record.size > self.max_bytes):
+                    oldest = self._queue.popleft()
+                    self._bytes -= oldest.size
+                    dropped.append(oldest)
+            queued = record not in dropped
+            if queued:
+                self._queue.append(record)
+                self._bytes += record.size
+                self._cond.notify()
+        for old in dropped:
+            old.discard()
+        if dropped:
+            metrics.CAPTURE.inc(len(dropped), outcome="dropped_queue_full")
+        if queued:
+            metrics.CAPTURE.inc(outcome="queued")
+        return queued
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._queue and not self._closing:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            # Give a batch time to fill up, unless we are shutting down
+            deadline = time.monotonic() + self.flush_interval
+            while len(self._queue) < self.batch_size and not self._closing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            self._bytes -= sum(record.size for record in batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                name, data = self._pack(batch)
+                self._backend.write(name, data)
+                metrics.CAPTURE.inc(len(batch), outcome="written")
+            except Exception:
+                logger.exception("Writing a capture batch failed")
+                metrics.CAPTURE.inc(len(batch), outcome="dropped_error")
+            finally:
+                for record in batch:
+                    record.discard()
+
+    def _pack(self, batch):
+        self._batches += 1
+        name = f"blackbox-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._batches:06d}.zip"
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", compression=self.compression, compresslevel=1
+                             if self.compression == zipfile.ZIP_DEFLATED else None) as archive:
+            manifest = []
+            for record in batch:
+                video_name = record.id + record.extension
+                archive.writestr(video_name, record.read())
+                manifest.append(json.dumps(dict(record.metadata, id=record.id, video=video_name, size=record.size)))
+            archive.writestr("manifest.jsonl", "\n".join(manifest) + "\n", compress_type=zipfile.ZIP_DEFLATED)
+        return name, buffer.getvalue()
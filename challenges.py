@@ -0,0 +1,232 @@
+import json
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from correlation import ReferenceBank
+
+# Server-issued challenges.
+# /api/challenge draws a random flash schedule (colors, lead-in, hold times) and stores it under a
+# single-use id with a TTL. The reference waveform the recording should follow (one 0/1 curve per
+# color channel on a fixed time grid) and its spectra are precomputed at issue time, so verifying
+# an answer is a store lookup plus one small FFT correlation in the engine.
+# Stores implement the ChallengeStore interface: MemoryChallengeStore for a single API process,
+# RedisChallengeStore when several API processes must see the same sessions.
+
+COLORS = ("red", "green", "blue")
+# Trace channel index (B, G, R) each flash color is scored on
+COLOR_CHANNELS = {"blue": 0, "green": 1, "red": 2}
+
+LEAD_IN_MS = (400.0, 900.0)
+HOLD_MS = (300.0, 700.0)
+
+# Reference waveform grid and the response delays it is matched over
+TEMPLATE_STEP_MS = 1000.0 / 30.0
+TEMPLATE_MAX_LAG_MS = 500.0
+TEMPLATE_TAIL_MS = 500.0
+
+_random = secrets.SystemRandom()
+
+
+class ChallengeTemplate:
+    """
+    Expected response to a schedule: per-color 0/1 waveforms (1 while that color is on screen)
+    sampled every step_ms from start_ms, relative to the first flash. match() scores a recorded
+    B/G/R trace against it; the bank's spectra are computed up front.
+    """
+
+    def __init__(self, schedule, lead_in_ms: float):
+        first = schedule[0]["offset_ms"]
+        end = max(flash["offset_ms"] + flash["duration_ms"] for flash in schedule) - first + TEMPLATE_TAIL_MS
+        self.start_ms = -lead_in_ms
+        self.step_ms = TEMPLATE_STEP_MS
+        grid = self.start_ms + self.step_ms * np.arange(int(np.ceil((end - self.start_ms) / self.step_ms)))
+        self.colors = [color for color in COLORS if any(flash["color"] == color for flash in schedule)]
+        waveforms = np.zeros((len(self.colors), len(grid)))
+        for flash in schedule:
+            start = flash["offset_ms"] - first
+            on = (grid >= start) & (grid < start + flash["duration_ms"])
+            waveforms[self.colors.index(flash["color"])][on] = 1.0
+        self.bank = ReferenceBank(waveforms, labels=self.colors).warm(len(grid))
+
+    def match(self, bgr_arr, time_arr, first_flash_ms: float) -> dict:
+        """
+        Correlation per color between the recording and the reference, at the best response delay
+        in [0, TEMPLATE_MAX_LAG_MS], plus their mean. bgr_arr is (frames, 3), time_arr in ms.
+        """
+        times = np.asarray(time_arr, dtype=np.float64)
+        grid = first_flash_ms + self.start_ms + self.step_ms * np.arange(self.bank.length)
+        signals = np.stack([np.interp(grid, times, np.asarray(bgr_arr[:, COLOR_CHANNELS[color]], dtype=np.float64))
+                            for color in self.colors])
+        correlation = self.bank.correlate_each(signals)
+        zero_lag = self.bank.length - 1
+        max_lag = int(TEMPLATE_MAX_LAG_MS / self.step_ms)
+        coefficients = correlation[:, zero_lag:zero_lag + max_lag + 1].max(axis=1)
+        return {
+            "coefficient": float(coefficients.mean()),
+            "by_color": {color: float(c) for color, c in zip(self.colors, coefficients)},
+        }
+
+
+class Challenge:
+    """One issued challenge. schedule: [{"color", "offset_ms", "duration_ms"}], offsets from recording start."""
+
+    def __init__(self, challenge_id: str, schedule, lead_in_ms: float, issued_at: float = None):
+        self.id = challenge_id
+        self.schedule = schedule
+        self.lead_in_ms = lead_in_ms
+        self.issued_at = time.time() if issued_at is None else issued_at
+        self.template = ChallengeTemplate(schedule, lead_in_ms)
+
+    def to_dict(self) -> dict:
+        return {"challenge_id": self.id, "schedule": self.schedule, "lead_in_ms": self.lead_in_ms,
+                "issued_at": self.issued_at}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Challenge":
+        return cls(data["challenge_id"], data["schedule"], data["lead_in_ms"], data["issued_at"])
+
+    def flash_schedule(self, reported=None, first_flash_ms: float = None):
+        """
+        [(color, offset_ms), ...] to score: the flash starts the client reports (validated against
+        the issued schedule), or the issued timings shifted to start at first_flash_ms.
+        Raises ValueError when the answer does not fit the challenge.
+        """
+        planned = [flash["offset_ms"] for flash in self.schedule]
+        colors = [flash["color"] for flash in self.schedule]
+        if reported is None:
+            if first_flash_ms is None:
+                raise ValueError("no flash timings reported")
+            return [(color, first_flash_ms + offset - planned[0]) for color, offset in zip(colors, planned)]
+
+        if [color for color, _ in reported] != colors:
+            raise ValueError("flash colors do not match the issued sequence")
+        first = reported[0][1]
+        tolerance = config.CHALLENGE_TIMING_TOLERANCE_MS
+        for (color, offset), expected in zip(reported, planned):
+            if abs((offset - first) - (expected - planned[0])) > tolerance:
+                raise ValueError(f"{color} flash at {offset:.0f} ms is off the issued timing")
+        return list(reported)
+
+
+def issue_challenge(min_flashes: int = None, max_flashes: int = None) -> Challenge:
+    """Random schedule: every color at least once, no color twice in a row, random lead-in and holds."""
+    min_flashes = max(1, min_flashes or config.CHALLENGE_MIN_FLASHES)
+    max_flashes = max(min_flashes, max_flashes or config.CHALLENGE_MAX_FLASHES)
+    count = _random.randint(min_flashes, max_flashes)
+
+    colors = list(COLORS)
+    _random.shuffle(colors)
+    colors = colors[:count]
+    while len(colors) < count:
+        colors.append(_random.choice([c for c in COLORS if c != colors[-1]]))
+
+    lead_in_ms = round(_random.uniform(*LEAD_IN_MS))
+    schedule = []
+    offset = lead_in_ms
+    for color in colors:
+        duration = round(_random.uniform(*HOLD_MS))
+        schedule.append({"color": color, "offset_ms": offset, "duration_ms": duration})
+        offset += duration
+    return Challenge(secrets.token_urlsafe(16), schedule, lead_in_ms)
+
+
+class ChallengeStore:
+    """
+    Session store interface (Redis semantics: SET with expiry, GETDEL). Challenges are single use,
+    so the only read is take(). Stores that can count their live sessions cheaply set countable and
+    implement __len__ (read on every /metrics scrape).
+    """
+
+    countable = False
+
+    def put(self, challenge: Challenge, ttl: float):
+        raise NotImplementedError
+
+    def take(self, challenge_id: str):
+        """Removes and returns the challenge, or None if it is unknown, used or expired."""
+        raise NotImplementedError
+
+    def __len__(self):
+        raise NotImplementedError
+
+
+class MemoryChallengeStore(ChallengeStore):
+    """
+    In-process store: an OrderedDict in issue order, so lookups, expiry (from the oldest end) and
+    eviction at max_sessions are all O(1) per operation.
+    """
+
+    countable = True
+
+    def __init__(self, max_sessions: int = None):
+        self.max_sessions = max_sessions or config.CHALLENGE_MAX_SESSIONS
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+
+    def _expire(self, now: float):
+        while self._sessions:
+            expires_at, _ = next(iter(self._sessions.values()))
+            if expires_at > now:
+                break
+            self._sessions.popitem(last=False)
+
+    def put(self, challenge: Challenge, ttl: float):
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            while len(self._sessions) >= self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+            self._sessions[challenge.id] = (now + ttl, challenge)
+
+    def take(self, challenge_id: str):
+        with self._lock:
+            entry = self._sessions.pop(challenge_id, None)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def __len__(self):
+        with self._lock:
+            self._expire(time.monotonic())
+            return len(self._sessions)
+
+
+class RedisChallengeStore(ChallengeStore):
+    """Challenges shared by all API processes through Redis (the template is rebuilt on take)."""
+
+    KEY_PREFIX = "deepshield:challenge:"
+    # No session count (deepshield_challenge_sessions is not exported): it would take a keyspace
+    # scan per scrape, and a counter kept beside the keys would miss every session Redis expires
+    countable = False
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("DEEPSHIELD_CHALLENGE_STORE is a Redis URL but the redis package is not installed")
+        self._client = redis.Redis.from_url(url)
+
+    def put(self, challenge: Challenge, ttl: float):
+        self._client.set(self.KEY_PREFIX + challenge.id, json.dumps(challenge.to_dict()), px=max(1, int(ttl * 1000)))
+
+    def take(self, challenge_id: str):
+        data = self._client.getdel(self.KEY_PREFIX + challenge_id)
+        if data is None:
+            return None
+        return Challenge.from_dict(json.loads(data))
+
+
+def create_store(spec: str = None) -> ChallengeStore:
+    spec = spec or config.CHALLENGE_STORE
+    if spec == "memory":
+        return MemoryChallengeStore()
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisChallengeStore(spec)
+    raise ValueError(f"Unknown challenge store '{spec}' (use 'memory' or a redis:// URL)")
@@ -0,0 +1,146 @@
+import base64
+import binascii
+
+import cv2
+import numpy as np
+
+import config
+from detectors import get_detector
+from signals import CENTER_ROI_SIZE, ROI_STRATEGIES, Trace, center_box, face_box, forehead_box
+from tracking import DETECT_MIN_NEIGHBORS, MIN_FACE_SIZE, _largest_face
+
+# Client-extracted traces.
+# In trace mode deepshield.js samples the ROI channel means in the browser while it flashes
+# and sends only those (a few KB of JSON) instead of the recording. parse_client_trace() turns
+# the JSON into the same Trace the server would build from a video, so the engine scores it
+# unchanged and no video decoder runs. A few downscaled JPEG keyframes can come with it. They
+# are checked in the engine pool, where the detector is already loaded: each one must show a
+# face, and its ROI mean must agree with the value the client reported for that frame.
+#
+# Request body (JSON):
+#   {"roi": "center"|"forehead"|"face", "width": 640, "height": 480,
+#    "timestamps": [ms since recording start, ...], "rgb": [[r, g, b] or null, ...],
+#    "flash_offset" / "flash_schedule" / "challenge_id" as for /api/verify_liveness,
+#    "keyframes": [{"timestamp": ms, "image": base64 JPEG or data URL}, ...]}
+
+
+def parse_client_trace(payload) -> Trace:
+    """Validates a client trace into a single-ROI Trace; raises ValueError when it is malformed."""
+    if not isinstance(payload, dict):
+        raise ValueError("expected a JSON object")
+    roi = payload.get("roi", "center")
+    if roi not in ROI_STRATEGIES:
+        raise ValueError(f"unknown roi '{roi}' (choose from {', '.join(ROI_STRATEGIES)})")
+
+    timestamps, rgb = payload.get("timestamps"), payload.get("rgb")
+    if not isinstance(timestamps, list) or not isinstance(rgb, list):
+        raise ValueError("timestamps and rgb must be lists")
+    if len(timestamps) != len(rgb):
+        raise ValueError(f"{len(timestamps)} timestamps but {len(rgb)} rgb samples")
+    if not 0 < len(timestamps) <= config.TRACE_MAX_FRAMES:
+        raise ValueError(f"a trace needs 1 to {config.TRACE_MAX_FRAMES} frames")
+
+    times = np.asarray(timestamps, dtype=np.float64)
+    if times.ndim != 1 or not np.isfinite(times).all():
+        raise ValueError("timestamps must be finite numbers")
+    if np.any(np.diff(times) < 0):
+        raise ValueError("timestamps must not decrease")
+
+    # null marks a frame the client could not sample (no face), like NaN in a server-side trace
+    nan = (float("nan"),) * 3
+    means = np.asarray([nan if sample is None else sample for sample in rgb], dtype=np.float64)
+    if means.shape != (len(rgb), 3):
+        raise ValueError("every rgb sample must be [r, g, b] or null")
+    sampled = means[~np.isnan(means).any(axis=1)]
+    if np.any(sampled < 0) or np.any(sampled > 255):
+        raise ValueError("rgb values must lie in 0-255")
+
+    intervals = np.diff(times)
+    fps = 1000.0 / float(np.median(intervals)) if len(intervals) and np.median(intervals) > 0 else None
+    return Trace.from_arrays(times, means[:, ::-1], roi=roi, fps=fps)
+
+
+def parse_keyframes(payload) -> list:
+    """[(timestamp_ms, jpeg bytes), ...] from the request; raises ValueError when malformed."""
+    keyframes = payload.get("keyframes") or []
+    if not isinstance(keyframes, list):
+        raise ValueError("keyframes must be a list")
+    if len(keyframes) > config.TRACE_MAX_KEYFRAMES:
+        raise ValueError(f"at most {config.TRACE_MAX_KEYFRAMES} keyframes")
+    parsed = []
+    for keyframe in keyframes:
+        try:
+            image = keyframe["image"]
+            # Accept canvas.toDataURL() output as is
+            if image.startswith("data:"):
+                image = image.partition(",")[2]
+            parsed.append((float(keyframe["timestamp"]), base64.b64decode(image, validate=True)))
+        except (KeyError, TypeError, AttributeError, binascii.Error) as e:
+            raise ValueError(f"keyframes need a timestamp and a base64 image ({e})")
+    return parsed
+
+
+def check_keyframes(keyframes, roi: str, frame_width: int = None) -> list:
+    """
+    Runs in the engine pool. For every keyframe: the face box found in it (None without one) and
+    the B/G/R mean of the ROI measured the way the engine would, in keyframe pixels.
+    """
+    detector = get_detector()
+    checked = []
+    for timestamp_ms, data in keyframes:
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            checked.append({"timestamp_ms": timestamp_ms, "face": None, "bgr": None, "error": "undecodable"})
+            continue
+        # Keyframes are downscaled copies: scale the engine's pixel sizes with them
+        scale = image.shape[1] / frame_width if frame_width else 1.0
+        min_size = (max(12, int(MIN_FACE_SIZE[0] * scale)), max(12, int(MIN_FACE_SIZE[1] * scale)))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if detector.needs_gray else image
+        faces = detector.detect(gray, scale_factor=config.DETECT_SCALE_FACTOR, min_neighbors=DETECT_MIN_NEIGHBORS,
+                                min_size=min_size)
+        face = _largest_face(faces) if len(faces) else None
+
+        if roi == "center":
+            box = center_box(image.shape, max(2, round(CENTER_ROI_SIZE * scale)))
+        elif face is not None:
+            box = forehead_box(face) if roi == "forehead" else face_box(face)
+        else:
+            box = None
+        bgr = None
+        if box is not None and box[2] > box[0] and box[3] > box[1]:
+            bgr = [float(v) for v in cv2.mean(image[box[1]:box[3], box[0]:box[2]])[:3]]
+        checked.append({"timestamp_ms": timestamp_ms, "face": list(face) if face else None, "bgr": bgr})
+    return checked
+
+
+def review_keyframes(result: dict, trace: Trace, checked: list) -> dict:
+    """
+    Adds the keyframe summary to a verdict and fails it when too few keyframes show a face or one
+    disagrees with the trace by more than DEEPSHIELD_TRACE_KEYFRAME_TOLERANCE.
+    """
+    roi = trace.rois[0]
+    times = trace.timestamps
+    deviations = []
+    for keyframe in checked:
+        if keyframe["bgr"] is None:
+            continue
+        # The client samples keyframes from frames it also put in the trace: take the closest one
+        i = int(np.clip(np.searchsorted(times, keyframe["timestamp_ms"]), 0, len(times) - 1))
+        if i > 0 and abs(times[i - 1] - keyframe["timestamp_ms"]) < abs(times[i] - keyframe["timestamp_ms"]):
+            i -= 1
+        reported = trace.means(roi)[i]
+        if not np.isnan(reported).any():
+            deviations.append(float(np.abs(reported - np.asarray(keyframe["bgr"])).max()))
+
+    with_face = sum(1 for keyframe in checked if keyframe["face"] is not None)
+    max_deviation = max(deviations) if deviations else None
+    result["keyframes"] = {"count": len(checked), "with_face": with_face, "max_deviation": max_deviation}
+
+    tolerance = config.TRACE_KEYFRAME_TOLERANCE
+    if with_face < config.TRACE_MIN_KEYFRAMES:
+        result["is_liveness_verified"] = False
+        result["message"] = f"Spoof Detected: {with_face} of {config.TRACE_MIN_KEYFRAMES} required keyframes show a face"
+    elif tolerance > 0 and max_deviation is not None and max_deviation > tolerance:
+        result["is_liveness_verified"] = False
+        result["message"] = "Spoof Detected: keyframes do not match the trace"
+    return result
@@ -0,0 +1,322 @@
+import os
+
+# Deployment settings for the DeepShield backend.
+# Every value can be overridden with a DEEPSHIELD_* environment variable so the
+# same build can be tuned per node without code changes.
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return int(value)
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return float(value)
+
+
+def _env_str(name: str, default: str) -> str:
+    value = os.environ.get(name)
+    if value is None or value.strip() == "":
+        return default
+    return value.strip()
+
+
+# --- Engine execution ---
+# Number of worker processes running the physics engine. 0 runs the engine in a
+# background thread of the API process instead (useful for local debugging).
+ENGINE_WORKERS = _env_int("DEEPSHIELD_ENGINE_WORKERS", os.cpu_count() or 1)
+
+# OpenCV threads per worker. Each worker already owns a core, so letting OpenCV
+# spawn its own thread pool per process only oversubscribes the CPU.
+ENGINE_CV_THREADS = _env_int("DEEPSHIELD_ENGINE_CV_THREADS", 1)
+
+# Maximum number of verifications admitted at once (running + waiting).
+# Requests beyond this are answered with 503 and a Retry-After header.
+ENGINE_MAX_PENDING = _env_int("DEEPSHIELD_ENGINE_MAX_PENDING", max(1, ENGINE_WORKERS) * 4)
+
+# Retry-After (seconds) used until the pool has measured real job durations.
+ENGINE_DEFAULT_RETRY_AFTER = _env_float("DEEPSHIELD_ENGINE_DEFAULT_RETRY_AFTER", 2.0)
+
+# How long startup waits for every worker to load its detector and run the warm-up clip.
+ENGINE_WARMUP_TIMEOUT = _env_float("DEEPSHIELD_ENGINE_WARMUP_TIMEOUT", 120.0)
+
+# --- Face detection ---
+# Which detector the engine uses: "haar" (default), "lbp" (cheaper, less accurate)
+# or "dnn" (OpenCV ResNet-10 SSD on CPU, most robust, most expensive).
+FACE_DETECTOR = _env_str("DEEPSHIELD_FACE_DETECTOR", "haar")
+
+# Directory holding detector model files not bundled with opencv-python
+# (lbpcascade_frontalface_improved.xml, deploy.prototxt, res10_300x300_ssd_iter_140000.caffemodel).
+FACE_DETECTOR_MODEL_DIR = _env_str("DEEPSHIELD_FACE_DETECTOR_MODEL_DIR", "models")
+
+# Minimum SSD confidence for the DNN detector.
+DNN_CONFIDENCE = _env_float("DEEPSHIELD_DNN_CONFIDENCE", 0.6)
+
+# Width (px) of the image face detection runs on; frames wider than this are downscaled
+# for detection only (the forehead ROI is still sampled at native resolution). 0 = native.
+DETECT_WIDTH = _env_int("DEEPSHIELD_DETECT_WIDTH", 0)
+
+# Cascade image-pyramid step. Larger is faster but may miss faces between scales.
+DETECT_SCALE_FACTOR = _env_float("DEEPSHIELD_DETECT_SCALE_FACTOR", 1.1)
+
+# --- Face ROI tracking ---
+# "detect" runs full face detection on every frame; "track" detects on keyframes and
+# re-detects only in a small window around the last face box in between.
+ROI_MODE = _env_str("DEEPSHIELD_ROI_MODE", "detect")
+
+# Frames between forced full detections in "track" mode.
+TRACK_KEYFRAME_INTERVAL = _env_int("DEEPSHIELD_TRACK_KEYFRAME_INTERVAL", 15)
+
+# Search window around the last face box, as a fraction of the box size on each side.
+TRACK_SEARCH_MARGIN = _env_float("DEEPSHIELD_TRACK_SEARCH_MARGIN", 0.25)
+
+# Tracking confidence halves on every windowed miss; below this a full detection runs.
+TRACK_MIN_CONFIDENCE = _env_float("DEEPSHIELD_TRACK_MIN_CONFIDENCE", 0.3)
+
+# A windowed hit only confirms the face; the box stays that of the last full detection.
+# When the hit's center has moved more than this fraction of the box size, a full detection runs.
+TRACK_MAX_DRIFT = _env_float("DEEPSHIELD_TRACK_MAX_DRIFT", 0.1)
+
+# --- Verification thresholds ---
+# Minimum rise of the flashed channel over the baseline, and the longest accepted delay from
+# flash to peak. rescore.py picks operating points for these from a trace store.
+DELTA_THRESHOLD = _env_float("DEEPSHIELD_DELTA_THRESHOLD", 3.0)
+MAX_LATENCY_MS = _env_float("DEEPSHIELD_MAX_LATENCY_MS", 1200.0)
+
+# --- Decode window ---
+# Baseline uses only frames this many ms before the flash; earlier frames are skipped
+# with grab() (no retrieve, no face detection). 0 = use every pre-flash frame (default).
+# Both settings save decoding but can change verdicts, so they are opt-in.
+BASELINE_WINDOW_MS = _env_float("DEEPSHIELD_BASELINE_WINDOW_MS", 0.0)
+
+# Stop decoding once the latency window after the flash has passed. The peak is then the
+# highest frame within the window; by default it is the highest frame after the flash and
+# a peak later than the max latency rejects the clip.
+STOP_AFTER_LATENCY_WINDOW = _env_str("DEEPSHIELD_STOP_AFTER_LATENCY_WINDOW", "0") == "1"
+
+# Stop as soon as a post-flash frame clears the delta threshold (reports that frame, not the peak).
+EARLY_EXIT = _env_str("DEEPSHIELD_EARLY_EXIT", "0") == "1"
+
+# --- Pipelined engine ---
+# Overlap decoding with face detection inside one analysis: a decoder thread fills a ring of
+# reusable frame buffers that analysis threads consume (pipeline.py). Each engine worker then
+# keeps more than one core busy, so leave cores free for it (DEEPSHIELD_ENGINE_WORKERS).
+# Off by default: it can only hide the decode share of engine time, which is small next to
+# detection (see the README for measurements).
+PIPELINE = _env_str("DEEPSHIELD_PIPELINE", "0") == "1"
+
+# Frame buffers in flight per analysis (memory: this many decoded frames).
+PIPELINE_DEPTH = _env_int("DEEPSHIELD_PIPELINE_DEPTH", 4)
+
+# Analysis threads per worker; "track" ROI mode always uses one (it follows the face frame to frame).
+PIPELINE_THREADS = _env_int("DEEPSHIELD_PIPELINE_THREADS", 1)
+
+# --- Segment-parallel decoding ---
+# Large or long uploads are split at keyframes into time segments that idle engine workers decode
+# and sample side by side; the partial traces are merged in timestamp order before scoring.
+# Most segments per upload (0 = one per engine worker, 1 = never split).
+SEGMENT_MAX = _env_int("DEEPSHIELD_SEGMENT_MAX", 0)
+
+# Split only when the engine would decode at least this many seconds of video
+# (up to the end of the flash window), or when frames have at least this many pixels.
+SEGMENT_MIN_DURATION_S = _env_float("DEEPSHIELD_SEGMENT_MIN_DURATION_S", 10.0)
+SEGMENT_MIN_PIXELS = _env_int("DEEPSHIELD_SEGMENT_MIN_PIXELS", 1280 * 720)
+
+# Shortest segment (ms of analyzed video); shorter ones cost more in start-up than they save.
+SEGMENT_MIN_MS = _env_float("DEEPSHIELD_SEGMENT_MIN_MS", 1000.0)
+
+# --- Upload ingest ---
+# How uploads reach the decoder: "auto" tries buffer -> memfd -> tmpfs -> disk,
+# or force one of "buffer", "memfd", "tmpfs", "disk".
+INGEST_MODE = _env_str("DEEPSHIELD_INGEST_MODE", "auto")
+
+# Uploads larger than this are spooled to a temp file on disk instead of held in memory.
+INGEST_MAX_MEMORY_MB = _env_float("DEEPSHIELD_INGEST_MAX_MEMORY_MB", 64.0)
+
+# --- Streaming verification (WebSocket) ---
+# Concurrent streaming sessions per API process: the size of the pool of stream decode threads,
+# each with its face detector loaded at startup. Aborted sessions count until their decoder stops.
+STREAM_MAX_SESSIONS = _env_int("DEEPSHIELD_STREAM_MAX_SESSIONS", max(1, os.cpu_count() or 1))
+
+# Seconds without a message before a stream is dropped.
+STREAM_IDLE_TIMEOUT = _env_float("DEEPSHIELD_STREAM_IDLE_TIMEOUT", 10.0)
+
+# Seconds to wait for the decoder to drain the last chunk after "end".
+STREAM_FINISH_TIMEOUT = _env_float("DEEPSHIELD_STREAM_FINISH_TIMEOUT", 15.0)
+
+# --- Batch verification ---
+# Items of one batch analyzed at once (clients may ask for less, never more than the max).
+BATCH_DEFAULT_CONCURRENCY = _env_int("DEEPSHIELD_BATCH_DEFAULT_CONCURRENCY", max(1, ENGINE_WORKERS))
+BATCH_MAX_CONCURRENCY = _env_int("DEEPSHIELD_BATCH_MAX_CONCURRENCY", max(1, ENGINE_WORKERS) * 2)
+
+# Upper bounds on a single batch request.
+BATCH_MAX_ITEMS = _env_int("DEEPSHIELD_BATCH_MAX_ITEMS", 1000)
+BATCH_MAX_ARCHIVE_MB = _env_float("DEEPSHIELD_BATCH_MAX_ARCHIVE_MB", 1024.0)
+
+# --- Instrumentation ---
+# Per-request cProfile of the engine: "off", "header" (only requests sending
+# X-DeepShield-Profile: 1) or "always". Profiling slows the profiled request down.
+PROFILE_MODE = _env_str("DEEPSHIELD_PROFILE", "off")
+
+# Directory for .prof dumps of profiled requests ("" = no files).
+PROFILE_DIR = _env_str("DEEPSHIELD_PROFILE_DIR", "")
+
+# Functions listed in the profile summary returned to clients that asked for it.
+PROFILE_TOP = _env_int("DEEPSHIELD_PROFILE_TOP", 25)
+
+# --- Server-issued challenges ---
+# Where issued challenge sessions live: "memory" (this API process only) or a redis:// URL
+# (shared by every API process; needs the redis package).
+CHALLENGE_STORE = _env_str("DEEPSHIELD_CHALLENGE_STORE", "memory")
+
+# Seconds a challenge can be answered after it was issued (each one is single use).
+CHALLENGE_TTL = _env_float("DEEPSHIELD_CHALLENGE_TTL", 120.0)
+
+# Live challenges kept by the in-memory store; the oldest are evicted beyond this.
+CHALLENGE_MAX_SESSIONS = _env_int("DEEPSHIELD_CHALLENGE_MAX_SESSIONS", 50000)
+
+# Flashes per challenge (colors and timings are drawn at random in this range).
+CHALLENGE_MIN_FLASHES = _env_int("DEEPSHIELD_CHALLENGE_MIN_FLASHES", 3)
+CHALLENGE_MAX_FLASHES = _env_int("DEEPSHIELD_CHALLENGE_MAX_FLASHES", 5)
+
+# How far the flash timings a client reports may drift from the issued schedule (ms).
+CHALLENGE_TIMING_TOLERANCE_MS = _env_float("DEEPSHIELD_CHALLENGE_TIMING_TOLERANCE_MS", 250.0)
+
+# Minimum correlation between the recording and the challenge's reference waveform
+# (0 = report it only).
+CHALLENGE_MIN_CORRELATION = _env_float("DEEPSHIELD_CHALLENGE_MIN_CORRELATION", 0.0)
+
+# Reject /api/verify_liveness uploads that do not answer an issued challenge.
+CHALLENGE_REQUIRED = _env_str("DEEPSHIELD_CHALLENGE_REQUIRED", "0") == "1"
+
+# --- Result cache ---
+# Verdicts kept for retried / duplicate uploads, keyed by upload hash + flash parameters
+# (0 disables the cache, the single-flighting of identical requests and repeat detection).
+RESULT_CACHE_SIZE = _env_int("DEEPSHIELD_RESULT_CACHE_SIZE", 1024)
+
+# Seconds a cached verdict (and the memory of an upload's hash) is kept.
+RESULT_CACHE_TTL = _env_float("DEEPSHIELD_RESULT_CACHE_TTL", 600.0)
+
+# --- Admission limits (checked from container metadata before any decode) ---
+# Largest accepted upload.
+MAX_UPLOAD_MB = _env_float("DEEPSHIELD_MAX_UPLOAD_MB", 100.0)
+
+# Longest accepted video (when the container reports its length).
+MAX_DURATION_S = _env_float("DEEPSHIELD_MAX_DURATION_S", 120.0)
+
+# Frames above this many pixels (default 1080p) are "downscale"d for face detection or "reject"ed.
+MAX_PIXELS = _env_int("DEEPSHIELD_MAX_PIXELS", 1920 * 1080)
+MAX_PIXELS_ACTION = _env_str("DEEPSHIELD_MAX_PIXELS_ACTION", "downscale")
+
+# Uploads whose estimated engine time exceeds this are rejected (0 = no limit).
+MAX_COST_S = _env_float("DEEPSHIELD_MAX_COST_S", 30.0)
+
+# Cost model: engine milliseconds per megapixel of every decoded frame, and per face-detected
+# frame plus per megapixel of it (defaults measured with the Haar detector on one core).
+COST_DECODE_MS_PER_MPX = _env_float("DEEPSHIELD_COST_DECODE_MS_PER_MPX", 4.0)
+COST_DETECT_MS_PER_FRAME = _env_float("DEEPSHIELD_COST_DETECT_MS_PER_FRAME", 20.0)
+COST_DETECT_MS_PER_MPX = _env_float("DEEPSHIELD_COST_DETECT_MS_PER_MPX", 55.0)
+
+# Seconds from arrival until a verification is abandoned, queue wait included. The engine
+# checks it between frames and stops cleanly with a "Timed out" result (0 = no deadline).
+REQUEST_DEADLINE_S = _env_float("DEEPSHIELD_REQUEST_DEADLINE_S", 45.0)
+
+# --- Client-side traces (/api/verify_trace) ---
+# Largest accepted trace request body (JSON, keyframes included).
+TRACE_MAX_KB = _env_float("DEEPSHIELD_TRACE_MAX_KB", 2048.0)
+
+# Most frames a trace may have (60 s at 30 fps).
+TRACE_MAX_FRAMES = _env_int("DEEPSHIELD_TRACE_MAX_FRAMES", 1800)
+
+# Most keyframes checked per trace, and how many must show a face for the trace to verify
+# (keyframes are optional at 0). Traces are reported by the client, so production setups
+# should require keyframes and an issued challenge.
+TRACE_MAX_KEYFRAMES = _env_int("DEEPSHIELD_TRACE_MAX_KEYFRAMES", 8)
+TRACE_MIN_KEYFRAMES = _env_int("DEEPSHIELD_TRACE_MIN_KEYFRAMES", 0)
+
+# Largest difference (0-255, any channel) between a keyframe's ROI mean as measured here and the
+# trace value the client reported for the same frame (0 = do not compare).
+TRACE_KEYFRAME_TOLERANCE = _env_float("DEEPSHIELD_TRACE_KEYFRAME_TOLERANCE", 30.0)
+
+# --- Asynchronous jobs (/api/jobs) ---
+# Where jobs wait for a worker: "memory" (this API process only, lost on restart; no file),
+# sqlite:///<path> (survives restarts; shared with job_worker.py processes on this node) or a
+# redis:// URL (shared by API and worker nodes; needs the redis package).
+JOB_QUEUE = _env_str("DEEPSHIELD_JOB_QUEUE", "memory")
+
+# Run queued jobs in this API process's engine pool. Set to 0 on API nodes when job_worker.py
+# processes on other nodes do the analysis.
+JOB_INLINE = _env_str("DEEPSHIELD_JOB_INLINE", "1") == "1"
+
+# Seconds a worker holds a claimed job; if it has not finished by then (crashed, killed) the job
+# is claimed again. Keep it above DEEPSHIELD_REQUEST_DEADLINE_S.
+JOB_LEASE_S = _env_float("DEEPSHIELD_JOB_LEASE_S", 120.0)
+
+# Claims per job before it is failed as abandoned.
+JOB_MAX_ATTEMPTS = _env_int("DEEPSHIELD_JOB_MAX_ATTEMPTS", 3)
+
+# Seconds a finished job's verdict can still be fetched.
+JOB_TTL = _env_float("DEEPSHIELD_JOB_TTL", 3600.0)
+
+# Queued jobs beyond which new submissions get 503.
+JOB_MAX_QUEUED = _env_int("DEEPSHIELD_JOB_MAX_QUEUED", 1000)
+
+# Longest long-poll (GET /api/jobs/{id}?wait=...) and how often waiting requests and idle
+# workers look at the queue (seconds).
+JOB_MAX_WAIT_S = _env_float("DEEPSHIELD_JOB_MAX_WAIT_S", 30.0)
+JOB_POLL_INTERVAL = _env_float("DEEPSHIELD_JOB_POLL_INTERVAL", 0.2)
+
+# Idle workers wait twice as long after every empty check, up to this many seconds. Jobs submitted
+# to this API process wake its own runners at once; the backoff only delays jobs from other nodes.
+JOB_IDLE_POLL_MAX_S = _env_float("DEEPSHIELD_JOB_IDLE_POLL_MAX_S", 5.0)
+
+# --- Dataset capture ("Blackbox") ---
+# Fraction of verified uploads saved with their verdict for the dataset (0 = capture off).
+# Captured videos are biometric data: only enable this with the users' consent.
+CAPTURE_RATE = _env_float("DEEPSHIELD_CAPTURE_RATE", 0.0)
+
+# Where capture batches go: a local directory, or firebase://<bucket> (Firebase Storage with
+# serviceAccountKey.json; needs the firebase-admin package).
+CAPTURE_BACKEND = _env_str("DEEPSHIELD_CAPTURE_BACKEND", os.path.join("dataset", "collected_videos"))
+
+# Capture queue bounds (records and MB held in memory). When full, "drop_newest" refuses new
+# records and "drop_oldest" makes room by discarding the oldest ones; either way it is counted.
+CAPTURE_QUEUE_SIZE = _env_int("DEEPSHIELD_CAPTURE_QUEUE_SIZE", 64)
+CAPTURE_QUEUE_MB = _env_float("DEEPSHIELD_CAPTURE_QUEUE_MB", 256.0)
+CAPTURE_OVERFLOW = _env_str("DEEPSHIELD_CAPTURE_OVERFLOW", "drop_newest")
+
+# Records per written batch, and seconds a partial batch waits for more before it is written.
+CAPTURE_BATCH_SIZE = _env_int("DEEPSHIELD_CAPTURE_BATCH_SIZE", 16)
+CAPTURE_FLUSH_S = _env_float("DEEPSHIELD_CAPTURE_FLUSH_S", 5.0)
+
+# Zip compression of the batches: stored, deflated, bzip2 or lzma.
+CAPTURE_COMPRESSION = _env_str("DEEPSHIELD_CAPTURE_COMPRESSION", "deflated")
+
+# --- Audit log ---
+# JSONL file with one record per /api/verify_liveness call (request id, upload size, frames, stage
+# timings, delta, latency, verdict, failure category), written by a background thread.
+# "off" = no audit log.
+AUDIT_LOG = _env_str("DEEPSHIELD_AUDIT_LOG", os.path.join("logs", "audit.jsonl"))
+
+# Records held in memory while the writer catches up; beyond this, new records are dropped (and counted).
+AUDIT_LOG_QUEUE_SIZE = _env_int("DEEPSHIELD_AUDIT_LOG_QUEUE_SIZE", 10000)
+AUDIT_LOG_BATCH_SIZE = _env_int("DEEPSHIELD_AUDIT_LOG_BATCH_SIZE", 256)
+
+# Written records are fsynced together at most this often (seconds; 0 = after every batch).
+AUDIT_LOG_FSYNC_S = _env_float("DEEPSHIELD_AUDIT_LOG_FSYNC_S", 1.0)
+
+# Rotation: when the file would exceed this size (MB), or this many seconds after it was opened
+# (0 = never). Rotated files get a timestamp suffix; only the newest AUDIT_LOG_BACKUPS are kept.
+AUDIT_LOG_MAX_MB = _env_float("DEEPSHIELD_AUDIT_LOG_MAX_MB", 64.0)
+AUDIT_LOG_ROTATE_S = _env_float("DEEPSHIELD_AUDIT_LOG_ROTATE_S", 86400.0)
+AUDIT_LOG_BACKUPS = _env_int("DEEPSHIELD_AUDIT_LOG_BACKUPS", 7)
+
+# --- Trace store ---
+# Directory where the engine keeps every analyzed trace (append-only, memory-mappable; one
+# shard per worker process) for offline re-scoring with rescore.py. Empty = off.
+TRACE_STORE = _env_str("DEEPSHIELD_TRACE_STORE", "")
@@ -0,0 +1,118 @@
+from functools import lru_cache
+
+import numpy as np
+
+# Matched-filter correlation.
+# Normalized cross-correlation of a per-frame intensity trace against reference waveforms, computed
+# by FFT in O(n log n) instead of np.correlate's O(n^2). A ReferenceBank holds any number of
+# candidate references (square waves over several periods and phases, or waveforms built from a
+# flash schedule) and caches their spectra per FFT length, so scoring a signal against the whole
+# bank is one rfft of the signal plus one batched irfft. Headless and numpy-only; monitor.py is a
+# CLI on top of it.
+
+
+def fft_length(n: int) -> int:
+    """Smallest power of two >= n (FFT size for a linear, non-circular correlation)."""
+    return 1 << max(0, int(n) - 1).bit_length()
+
+
+def square_wave(length: int, period: float, phase: float = 0.0) -> np.ndarray:
+    """
+    0/1 square wave (50% duty) of `period` frames, starting `phase` periods in; same waveform
+    as 0.5 * (scipy.signal.square(2 * pi * t / period) + 1).
+    """
+    cycles = np.arange(length) / float(period) + phase
+    return (np.mod(cycles, 1.0) < 0.5).astype(np.float64)
+
+
+def schedule_waveform(timestamps, offsets, hold_ms: float = 500.0) -> np.ndarray:
+    """0/1 waveform on the frame timestamps: 1 while any flash of the schedule is on screen."""
+    times = np.asarray(timestamps, dtype=np.float64)
+    starts = np.asarray(offsets, dtype=np.float64)
+    on = (times[None, :] >= starts[:, None]) & (times[None, :] < starts[:, None] + hold_ms)
+    return on.any(axis=0).astype(np.float64)
+
+
+class ReferenceBank:
+    """
+    Candidate reference waveforms of equal length, mean-centered once. Their conjugate spectra
+    are computed the first time a given FFT length is needed and reused for every later signal.
+    """
+
+    def __init__(self, references, labels=None):
+        references = np.atleast_2d(np.asarray(references, dtype=np.float64))
+        if references.shape[1] == 0:
+            raise ValueError("Reference waveforms are empty")
+        self.labels = list(labels) if labels is not None else list(range(len(references)))
+        if len(self.labels) != len(references):
+            raise ValueError(f"Got {len(references)} references but {len(self.labels)} labels")
+        self.references = references
+        self.length = references.shape[1]
+        self._centered = references - references.mean(axis=1, keepdims=True)
+        self._norms = np.sqrt(np.sum(self._centered ** 2, axis=1))
+        self._spectra = {}
+
+    def __len__(self):
+        return len(self.references)
+
+    def _spectra_for(self, nfft: int):
+        spectra = self._spectra.get(nfft)
+        if spectra is None:
+            spectra = self._spectra[nfft] = np.conj(np.fft.rfft(self._centered, nfft, axis=1))
+        return spectra
+
+    def warm(self, signal_length: int):
+        """Computes the spectra needed for signals of this length ahead of time."""
+        self._spectra_for(fft_length(signal_length + self.length - 1))
+        return self
+
+    def _correlate(self, signals) -> np.ndarray:
+        # signals: (1 or references, n), correlated row-wise against the references
+        signals = np.atleast_2d(np.asarray(signals, dtype=np.float64))
+        n, m = signals.shape[1], self.length
+        centered = signals - signals.mean(axis=1, keepdims=True)
+        nfft = fft_length(n + m - 1)
+        circular = np.fft.irfft(np.fft.rfft(centered, nfft, axis=1) * self._spectra_for(nfft), nfft, axis=1)
+        # Negative lags wrap to the end of the circular result
+        full = np.concatenate((circular[:, nfft - (m - 1):], circular[:, :n]), axis=1)
+
+        norms = np.sqrt(np.sum(centered ** 2, axis=1)) * self._norms
+        with np.errstate(divide="ignore", invalid="ignore"):
+            full = np.where(norms[:, None] > 0, full / norms[:, None], 0.0)
+        return full
+
+    def correlate(self, signal) -> np.ndarray:
+        """
+        Normalized cross-correlation of `signal` with every reference: shape
+        (references, len(signal) + length - 1), in np.correlate(signal, ref, "full") lag order,
+        divided by the product of both centered norms (so values lie in [-1, 1]).
+        """
+        return self._correlate(np.asarray(signal, dtype=np.float64)[None, :])
+
+    def correlate_each(self, signals) -> np.ndarray:
+        """Like correlate(), but row i of `signals` is only matched against reference i."""
+        signals = np.asarray(signals, dtype=np.float64)
+        if signals.ndim != 2 or len(signals) != len(self):
+            raise ValueError(f"Expected {len(self)} signals, one per reference")
+        return self._correlate(signals)
+
+    def score(self, signal) -> dict:
+        """Best-matching reference and lag (frames the reference is shifted by) for one signal."""
+        correlation = self.correlate(signal)
+        lags = np.argmax(correlation, axis=1)
+        coefficients = correlation[np.arange(len(correlation)), lags]
+        best = int(np.argmax(coefficients))
+        return {
+            "coefficient": float(coefficients[best]),
+            "lag_frames": int(lags[best]) - (self.length - 1),
+            "reference": self.labels[best],
+            "coefficients": coefficients.tolist(),
+        }
+
+
+@lru_cache(maxsize=32)
+def square_wave_bank(length: int, periods: tuple, phases: tuple = (0.0,)) -> ReferenceBank:
+    """Square-wave bank over periods x phases, shared by all signals of the same length."""
+    grid = [(float(period), float(phase)) for period in periods for phase in phases]
+    return ReferenceBank([square_wave(length, period, phase) for period, phase in grid],
+                         labels=[{"period": period, "phase": phase} for period, phase in grid])
@@ -1,3 +1,152 @@
+// Trace mode: samples per-frame ROI channel means from the preview video while the flashes run,
+// so only a few KB of numbers are uploaded instead of the recording. The "center" ROI is the
+// server's: a 50x50 px box in the middle of the frame, in native video pixels. "forehead" needs
+// the browser's FaceDetector and falls back to "center" without it.
+class TraceSampler {
+    constructor(videoElement, options = {}) {
+        this.video = videoElement;
+        this.faceDetector = (options.roi === 'forehead' && 'FaceDetector' in window)
+            ? new FaceDetector({ fastMode: true, maxDetectedFaces: 1 })
+            : null;
+        this.roi = this.faceDetector ? 'forehead' : 'center';
+        this.maxKeyframes = options.keyframes === undefined ? 3 : options.keyframes;
+        this.keyframeWidth = options.keyframeWidth || 320;
+
+        this.timestamps = [];
+        this.rgb = [];
+        this.keyframes = [];
+        this.keyframeTimes = []; // pending capture times (ms since start), ascending
+        this.face = null;
+        this.detecting = false;
+        this.lastMediaTime = null;
+        this.running = false;
+
+        this.canvas = document.createElement('canvas');
+        this.context = this.canvas.getContext('2d', { willReadFrequently: true });
+        this.keyframeCanvas = document.createElement('canvas');
+    }
+
+    // Starts sampling; timestamps are ms since startTime (the flash offsets' time base)
+    start(startTime, leadInKeyframeMs) {
+        this.startTime = startTime;
+        this.running = true;
+        if (leadInKeyframeMs !== undefined) {
+            this.captureKeyframeAt(leadInKeyframeMs);
+        }
+        this._next();
+    }
+
+    stop() {
+        this.running = false;
+    }
+
+    // Keyframes are taken from sampled frames, so the server can compare them with the trace
+    captureKeyframeAt(offsetMs) {
+        if (this.keyframes.length + this.keyframeTimes.length < this.maxKeyframes) {
+            this.keyframeTimes.push(offsetMs);
+        }
+    }
+
+    _next() {
+        if (!this.running) {
+            return;
+        }
+        if (this.video.requestVideoFrameCallback) {
+            // One callback per decoded camera frame; captureTime is when the camera took it
+            this.video.requestVideoFrameCallback((now, metadata) => {
+                this._sample(metadata.captureTime || now);
+                this._next();
+            });
+        } else {
+            requestAnimationFrame((now) => {
+                // Display-rate fallback: skip repaints that show the same frame again
+                if (this.video.currentTime !== this.lastMediaTime) {
+                    this.lastMediaTime = this.video.currentTime;
+                    this._sample(now);
+                }
+                this._next();
+            });
+        }
+    }
+
+    _roiBox(width, height) {
+        if (this.roi === 'center') {
+            const x = Math.max(0, Math.floor(width / 2) - 25);
+            const y = Math.max(0, Math.floor(height / 2) - 25);
+            return [x, y, Math.min(width, Math.floor(width / 2) + 25) - x, Math.min(height, Math.floor(height / 2) + 25) - y];
+        }
+        if (!this.face) {
+            return null;
+        }
+        // Forehead: top 30% of the face box, center 60% horizontally (as in the engine)
+        const { x, y, width: w, height: h } = this.face;
+        return [Math.round(x + w * 0.2), Math.round(y), Math.round(w * 0.6), Math.round(h * 0.3)];
+    }
+
+    _sample(time) {
+        const width = this.video.videoWidth;
+        const height = this.video.videoHeight;
+        if (!width || !height) {
+            return;
+        }
+        if (this.faceDetector && !this.detecting) {
+            // Detection is asynchronous: the latest box is used until the next one arrives
+            this.detecting = true;
+            this.faceDetector.detect(this.video)
+                .then(faces => { this.face = faces.length ? faces[0].boundingBox : null; })
+                .catch(() => { this.face = null; })
+                .finally(() => { this.detecting = false; });
+        }
+
+        const timestamp = time - this.startTime;
+        const box = this._roiBox(width, height);
+        let sample = null;
+        if (box && box[2] > 0 && box[3] > 0) {
+            // Large ROIs are averaged from a copy at most 64 px wide
+            const scale = Math.min(1, 64 / box[2]);
+            const w = Math.max(1, Math.round(box[2] * scale));
+            const h = Math.max(1, Math.round(box[3] * scale));
+            this.canvas.width = w;
+            this.canvas.height = h;
+            this.context.drawImage(this.video, box[0], box[1], box[2], box[3], 0, 0, w, h);
+            const pixels = this.context.getImageData(0, 0, w, h).data;
+            let r = 0, g = 0, b = 0;
+            for (let i = 0; i < pixels.length; i += 4) {
+                r += pixels[i];
+                g += pixels[i + 1];
+                b += pixels[i + 2];
+            }
+            const n = pixels.length / 4;
+            sample = [r / n, g / n, b / n].map(v => Math.round(v * 100) / 100);
+        }
+        this.timestamps.push(Math.round(timestamp * 100) / 100);
+        this.rgb.push(sample);
+
+        if (this.keyframeTimes.length && timestamp >= this.keyframeTimes[0]) {
+            this.keyframeTimes.shift();
+            this.keyframeCanvas.width = this.keyframeWidth;
+            this.keyframeCanvas.height = Math.round(height * this.keyframeWidth / width);
+            this.keyframeCanvas.getContext('2d').drawImage(this.video, 0, 0, this.keyframeCanvas.width, this.keyframeCanvas.height);
+            this.keyframes.push({
+                timestamp: this.timestamps[this.timestamps.length - 1],
+                image: this.keyframeCanvas.toDataURL('image/jpeg', 0.8)
+            });
+        }
+    }
+
+    // Request body for /api/verify_trace (flash parameters are added by the caller)
+    toJSON() {
+        return {
+            roi: this.roi,
+            width: this.video.videoWidth,
+            height: this.video.videoHeight,
+            timestamps: this.timestamps,
+            rgb: this.rgb,
+            keyframes: this.keyframes
+        };
+    }
+}
+
 class DeepShield {
     constructor() {
         this.stream = null;
@@ -5,9 +154,113 @@ class DeepShield {
         this.recordedChunks = [];
     }
 
-    async startChallenge(apiUrl) {
+    // Derives the streaming WebSocket URL from the one-shot endpoint URL
+    static streamUrl(apiUrl) {
+        return apiUrl.replace(/^http/, 'ws') + '/stream';
+    }
+
+    // Derives the challenge endpoint URL from the one-shot endpoint URL
+    static challengeUrl(apiUrl) {
+        return apiUrl.replace(/\/verify_liveness\/?$/, '/challenge');
+    }
+
+    // Derives the trace-only endpoint URL from the one-shot endpoint URL
+    static traceUrl(apiUrl) {
+        return apiUrl.replace(/\/verify_liveness\/?$/, '/verify_trace');
+    }
+
+    // Derives the asynchronous job endpoint URL from the one-shot endpoint URL
+    static jobsUrl(apiUrl) {
+        return apiUrl.replace(/\/verify_liveness\/?$/, '/jobs');
+    }
+
+    // Long-polls an asynchronous job until it has a verdict; a dropped poll is simply retried
+    async awaitJob(apiUrl, jobId, timeoutMs) {
+        const url = `${DeepShield.jobsUrl(apiUrl)}/${encodeURIComponent(jobId)}?wait=25`;
+        const deadline = performance.now() + timeoutMs;
+        while (performance.now() < deadline) {
+            let job = null;
+            try {
+                const response = await fetch(url);
+                if (response.status === 404) {
+                    throw new Error("Verification job expired on the server");
+                }
+                job = response.ok ? await response.json() : null;
+            } catch (error) {
+                if (!(error instanceof TypeError)) {
+                    throw error;
+                }
+            }
+            if (job && (job.status === 'done' || job.status === 'failed')) {
+                return job.result;
+            }
+            if (!job) {
+                await new Promise(r => setTimeout(r, 1000));
+            }
+        }
+        const error = new Error("Connection timed out. Server took too long.");
+        error.name = 'AbortError';
+        throw error;
+    }
+
+    // Asks the server for a random single-use flash schedule
+    async fetchChallenge(apiUrl) {
+        const response = await fetch(DeepShield.challengeUrl(apiUrl), { method: 'POST' });
+        if (!response.ok) {
+            throw new TypeError(`Challenge request failed (${response.status})`);
+        }
+        return await response.json();
+    }
+
+    // Opens the streaming socket and resolves once it is ready to send
+    openStream(apiUrl) {
+        return new Promise((resolve, reject) => {
+            const socket = new WebSocket(DeepShield.streamUrl(apiUrl));
+            socket.binaryType = 'arraybuffer';
+            socket.onopen = () => resolve(socket);
+            socket.onerror = () => reject(new TypeError("WebSocket connection failed"));
+        });
+    }
+
+    // Resolves with the server verdict (first JSON message on the socket)
+    awaitStreamResult(socket, timeoutMs) {
+        return new Promise((resolve, reject) => {
+            const timeoutId = setTimeout(() => {
+                socket.close();
+                const error = new Error("Connection timed out. Server took too long.");
+                error.name = 'AbortError';
+                reject(error);
+            }, timeoutMs);
+            socket.onmessage = (event) => {
+                clearTimeout(timeoutId);
+                resolve(JSON.parse(event.data));
+                socket.close();
+            };
+            socket.onclose = () => {
+                clearTimeout(timeoutId);
+                reject(new TypeError("Stream closed before a verdict was received"));
+            };
+        });
+    }
+
+    // options.streaming: send timesliced chunks over a WebSocket while recording,
+    // so the verdict is ready right after the last chunk instead of after upload + analysis.
+    // options.challenge: flash a random schedule issued by the server (/api/challenge) instead of
+    // the fixed red-green-blue sequence (upload mode only).
+    // options.trace: nothing is recorded; the ROI means are sampled in the browser and only that
+    // trace (plus options.keyframes small JPEG frames, default 3) goes to /api/verify_trace.
+    // options.roi picks the ROI in trace mode: "center" (default) or "forehead".
+    // options.async: upload to /api/jobs, which answers at once, then long-poll for the verdict
+    // (up to options.jobTimeoutMs, default 5 minutes) instead of holding one request open.
+    async startChallenge(apiUrl, options = {}) {
         let overlay = null;
         let styleSheet = null;
+        let socket = null;
+        let sampler = null;
+        const streaming = Boolean(options.streaming);
+        const traceMode = Boolean(options.trace) && !streaming;
+        const useChallenge = Boolean(options.challenge) && !streaming;
+        const useJobs = Boolean(options.async) && !streaming && !traceMode;
 
         try {
             // 1. Access Webcam
@@ -87,36 +340,85 @@ class DeepShield {
 
             document.body.appendChild(overlay);
 
-            // 2. Strategy: Deterministic Challenge
+            // 2. Strategy: server-issued random challenge, or the deterministic sequence
+            const challenge = useChallenge ? await this.fetchChallenge(apiUrl) : null;
             const sequence = ['red', 'green', 'blue'];
 
-            // 3. Start Recording
-            this.recordedChunks = [];
-            this.mediaRecorder = new MediaRecorder(this.stream, { mimeType: 'video/webm' });
+            // 3. Start Recording (trace mode samples the preview instead; nothing is encoded)
+            if (traceMode) {
+                sampler = new TraceSampler(videoElement, options);
+            } else {
+                this.recordedChunks = [];
+                this.mediaRecorder = new MediaRecorder(this.stream, { mimeType: 'video/webm' });
 
-            this.mediaRecorder.ondataavailable = (event) => {
-                if (event.data.size > 0) {
-                    this.recordedChunks.push(event.data);
+                if (streaming) {
+                    socket = await this.openStream(apiUrl);
                 }
-            };
+
+                this.mediaRecorder.ondataavailable = (event) => {
+                    if (event.data.size > 0) {
+                        if (streaming) {
+                            socket.send(event.data);
+                        } else {
+                            this.recordedChunks.push(event.data);
+                        }
+                    }
+                };
+            }
 
             const recordStartTime = performance.now();
-            this.mediaRecorder.start();
+            if (sampler) {
+                // First keyframe shortly before the first flash, for the baseline
+                sampler.start(recordStartTime, (challenge ? challenge.schedule[0].offset_ms : 500) - 100);
+            } else {
+                // Streaming mode emits a chunk every 250ms so the server can analyze while we flash
+                this.mediaRecorder.start(streaming ? 250 : undefined);
+            }
 
             // 4. Flash Sequence
             textContainer.innerText = "Look at the camera...";
 
-            // Initial Black (0.5s)
-            await new Promise(r => setTimeout(r, 500));
-
             let flashOffset = 0;
-
-            for (const color of sequence) {
-                overlay.style.backgroundColor = color;
-                if (color === 'red') {
-                    flashOffset = performance.now() - recordStartTime;
+            // Every flash's color and start, so the server scores the whole sequence
+            const flashSchedule = [];
+
+            if (challenge) {
+                // Each flash at its issued offset from the recording start (drift-corrected)
+                for (const flash of challenge.schedule) {
+                    const wait = flash.offset_ms - (performance.now() - recordStartTime);
+                    await new Promise(r => setTimeout(r, Math.max(0, wait)));
+                    overlay.style.backgroundColor = flash.color;
+                    const offset = performance.now() - recordStartTime;
+                    flashSchedule.push({ color: flash.color, offset: offset });
+                    if (sampler) {
+                        sampler.captureKeyframeAt(offset + 250);
+                    }
+                    if (flashSchedule.length === 1) {
+                        flashOffset = offset;
+                    }
                 }
+                const last = challenge.schedule[challenge.schedule.length - 1];
+                const remaining = last.offset_ms + last.duration_ms - (performance.now() - recordStartTime);
+                await new Promise(r => setTimeout(r, Math.max(0, remaining)));
+            } else {
+                // Initial Black (0.5s)
                 await new Promise(r => setTimeout(r, 500));
+
+                for (const color of sequence) {
+                    overlay.style.backgroundColor = color;
+                    const offset = performance.now() - recordStartTime;
+                    flashSchedule.push({ color: color, offset: offset });
+                    if (sampler) {
+                        sampler.captureKeyframeAt(offset + 250);
+                    }
+                    if (color === 'red') {
+                        flashOffset = offset;
+                    }
+                    if (streaming) {
+                        socket.send(JSON.stringify({ type: 'flash', color: color, flash_offset: offset }));
+                    }
+                    await new Promise(r => setTimeout(r, 500));
+                }
             }
 
             // End Black
@@ -124,21 +426,46 @@ class DeepShield {
             await new Promise(r => setTimeout(r, 200));
 
             // Stop Recording
-            this.mediaRecorder.stop();
-            const recordingFinished = new Promise(resolve => this.mediaRecorder.onstop = resolve);
-            await recordingFinished;
+            if (sampler) {
+                sampler.stop();
+            } else {
+                this.mediaRecorder.stop();
+                const recordingFinished = new Promise(resolve => this.mediaRecorder.onstop = resolve);
+                await recordingFinished;
+            }
 
             // Cleanup
             this.stream.getTracks().forEach(track => track.stop());
             document.body.removeChild(overlay);
             document.head.removeChild(styleSheet); // Cleanup styles
 
-            // 5. Create Blob and Send
-            const blob = new Blob(this.recordedChunks, { type: 'video/webm' });
-            const file = new File([blob], "challenge.webm", { type: 'video/webm' });
-            const formData = new FormData();
-            formData.append('video_file', file);
-            formData.append('flash_offset', flashOffset.toString());
+            if (streaming) {
+                // Everything is already on the server; only the last chunk is left to analyze
+                socket.send(JSON.stringify({ type: 'end' }));
+                return await this.awaitStreamResult(socket, 60000);
+            }
+
+            // 5. Create Blob (or the trace) and Send
+            let formData = null;
+            let traceBody = null;
+            if (sampler) {
+                traceBody = sampler.toJSON();
+                traceBody.flash_offset = flashOffset;
+                traceBody.flash_schedule = flashSchedule;
+                if (challenge) {
+                    traceBody.challenge_id = challenge.challenge_id;
+                }
+            } else {
+                const blob = new Blob(this.recordedChunks, { type: 'video/webm' });
+                const file = new File([blob], "challenge.webm", { type: 'video/webm' });
+                formData = new FormData();
+                formData.append('video_file', file);
+                formData.append('flash_offset', flashOffset.toString());
+                formData.append('flash_schedule', JSON.stringify(flashSchedule));
+                if (challenge) {
+                    formData.append('challenge_id', challenge.challenge_id);
+                }
+            }
 
 
             // Re-use overlay for "Verifying" state but remove video
@@ -152,16 +479,36 @@ class DeepShield {
             const controller = new AbortController();
             const timeoutId = setTimeout(() => controller.abort(), 60000);
 
-            const response = await fetch(apiUrl, {
-                method: 'POST',
-                body: formData,
-                signal: controller.signal
-            });
+            // One key per recording: if this upload is resent, the server answers it from its
+            // result cache instead of flagging a repeated upload
+            const idempotencyKey = (window.crypto && crypto.randomUUID)
+                ? crypto.randomUUID()
+                : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+
+            const response = traceBody
+                ? await fetch(DeepShield.traceUrl(apiUrl), {
+                    method: 'POST',
+                    body: JSON.stringify(traceBody),
+                    headers: { 'Content-Type': 'application/json' },
+                    signal: controller.signal
+                })
+                : await fetch(useJobs ? DeepShield.jobsUrl(apiUrl) : apiUrl, {
+                    method: 'POST',
+                    body: formData,
+                    headers: { 'Idempotency-Key': idempotencyKey },
+                    signal: controller.signal
+                });
 
             clearTimeout(timeoutId);
 
             const result = await response.json();
 
+            if (useJobs && result.job_id) {
+                // Accepted: the upload is stored server-side, the verdict follows when a worker is done
+                textContainer.innerText = "Queued for analysis...";
+                return await this.awaitJob(apiUrl, result.job_id, options.jobTimeoutMs || 300000);
+            }
+
             return result;
 
         } catch (error) {
@@ -177,6 +524,13 @@ class DeepShield {
             // Return error to UI instead of alerting
             return { is_liveness_verified: false, delta: 0, latency_ms: 0, message: errorMsg, error: "Client-Side Error" };
         } finally {
+            if (sampler) {
+                sampler.stop();
+            }
+            // Release the stream socket on every exit path (no-op once the verdict closed it)
+            if (socket && socket.readyState !== WebSocket.CLOSED) {
+                socket.close();
+            }
             if (overlay) {
                 overlay.classList.add('hidden');
                 overlay.style.display = 'none';
@@ -0,0 +1,162 @@
+import os
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+
+import config
+
+# Face detector registry.
+# Detectors are expensive to build (XML/model parsing) but cheap to call, so each one is
+# loaded once per worker thread and reused for every request that thread serves.
+# OpenCV's CascadeClassifier and dnn.Net are not safe to share between threads, hence
+# thread-local instances instead of one global object.
+
+LBP_CASCADE_FILE = "lbpcascade_frontalface_improved.xml"
+HAAR_CASCADE_FILE = "haarcascade_frontalface_default.xml"
+DNN_PROTOTXT_FILE = "deploy.prototxt"
+DNN_MODEL_FILE = "res10_300x300_ssd_iter_140000.caffemodel"
+
+
+class DetectorUnavailable(Exception):
+    """Raised when a detector's model files are missing or fail to load."""
+
+
+def _find_model_file(filename: str) -> str:
+    search_dirs = [config.FACE_DETECTOR_MODEL_DIR]
+    try:
+        search_dirs.append(cv2.data.haarcascades)
+    except AttributeError:
+        pass
+    search_dirs.append(os.getcwd())
+
+    for directory in search_dirs:
+        if not directory:
+            continue
+        path = os.path.join(directory, filename)
+        if os.path.exists(path):
+            return path
+    raise DetectorUnavailable(f"Model file '{filename}' not found (searched: {', '.join(d for d in search_dirs if d)})")
+
+
+class CascadeDetector:
+    """Haar or LBP cascade. Works on grayscale input."""
+
+    needs_gray = True
+
+    def __init__(self, name: str, filename: str):
+        self.name = name
+        self.path = _find_model_file(filename)
+        self._cascade = cv2.CascadeClassifier(self.path)
+        if self._cascade.empty():
+            raise DetectorUnavailable(f"Failed to load cascade '{self.path}'")
+
+    def detect(self, image, scale_factor=1.1, min_neighbors=5, min_size=(50, 50), max_size=None):
+        return self._cascade.detectMultiScale(
+            image, scaleFactor=scale_factor, minNeighbors=min_neighbors, minSize=min_size,
+            maxSize=max_size or (0, 0)
+        )
+
+
+class DnnDetector:
+    """OpenCV DNN (ResNet-10 SSD) face detector on the CPU backend. Works on BGR input."""
+
+    needs_gray = False
+    input_size = (300, 300)
+    mean = (104.0, 177.0, 123.0)
+
+    def __init__(self):
+        self.name = "dnn"
+        prototxt = _find_model_file(DNN_PROTOTXT_FILE)
+        model = _find_model_file(DNN_MODEL_FILE)
+        try:
+            self._net = cv2.dnn.readNetFromCaffe(prototxt, model)
+        except cv2.error as e:
+            raise DetectorUnavailable(f"Failed to load DNN face model: {e}")
+        self._net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self._net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+        self.confidence = config.DNN_CONFIDENCE
+
+    def detect(self, image, scale_factor=1.1, min_neighbors=5, min_size=(50, 50), max_size=None):
+        # scale_factor / min_neighbors are cascade parameters; the SSD scans a fixed input size
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, self.input_size), 1.0, self.input_size, self.mean)
+        self._net.setInput(blob)
+        detections = self._net.forward()[0, 0]
+
+        faces = []
+        for det in detections[detections[:, 2] >= self.confidence]:
+            x1 = int(max(0.0, det[3]) * w)
+            y1 = int(max(0.0, det[4]) * h)
+            x2 = int(min(1.0, det[5]) * w)
+            y2 = int(min(1.0, det[6]) * h)
+            fw, fh = x2 - x1, y2 - y1
+            if fw < min_size[0] or fh < min_size[1]:
+                continue
+            if max_size and (fw > max_size[0] or fh > max_size[1]):
+                continue
+            faces.append((x1, y1, fw, fh))
+        return np.array(faces, dtype=np.int32).reshape(-1, 4)
+
+
+_FACTORIES = {
+    "haar": lambda: CascadeDetector("haar", HAAR_CASCADE_FILE),
+    "lbp": lambda: CascadeDetector("lbp", LBP_CASCADE_FILE),
+    "dnn": DnnDetector,
+}
+
+DETECTOR_NAMES = tuple(_FACTORIES)
+
+_local = threading.local()
+
+
+def get_detector(name: str = None):
+    """Returns this thread's instance of the named detector (config default), loading it on first use."""
+    name = (name or config.FACE_DETECTOR).lower()
+    if name not in _FACTORIES:
+        raise DetectorUnavailable(f"Unknown face detector '{name}' (choose from {', '.join(DETECTOR_NAMES)})")
+
+    cache = getattr(_local, "detectors", None)
+    if cache is None:
+        cache = _local.detectors = {}
+    detector = cache.get(name)
+    if detector is None:
+        detector = cache[name] = _FACTORIES[name]()
+    return detector
+
+
+def _write_warmup_clip(path: str, frames: int = 8, size=(160, 120)) -> bool:
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 30.0, size)
+    if not writer.isOpened():
+        return False
+    w, h = size
+    for i in range(frames):
+        frame = np.full((h, w, 3), 60, dtype=np.uint8)
+        # Rough face-like blob so the detector does real work, brightening halfway like a flash
+        cv2.ellipse(frame, (w // 2, h // 2), (w // 5, h // 3), 0, 0, 360, (120, 140, 180), -1)
+        if i >= frames // 2:
+            frame[:, :, 2] = cv2.add(frame[:, :, 2], 40)
+        writer.write(frame)
+    writer.release()
+    return True
+
+
+def warm_up(name: str = None):
+    """
+    Loads the configured detector and pushes a tiny synthetic clip through the whole engine,
+    so the first real request does not pay for model loading, codec init and lazy allocations.
+    """
+    from physics_engine import analyze_video_challenge
+
+    get_detector(name)
+
+    fd, clip_path = tempfile.mkstemp(suffix=".avi")
+    os.close(fd)
+    try:
+        if _write_warmup_clip(clip_path):
+            # Not a session: keep the synthetic clip out of the trace store
+            analyze_video_challenge(clip_path, 100.0, record=False)
+    finally:
+        if os.path.exists(clip_path):
+            os.remove(clip_path)
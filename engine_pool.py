@@ -0,0 +1,241 @@
+import asyncio
+import heapq
+import itertools
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+
+
+class EngineBusy(Exception):
+    """Raised when the pending queue is full. Carries a Retry-After hint in seconds."""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Engine busy, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+# Per-process warm-up outcome, reported back by _worker_status()
+_warmup_error = None
+
+
+def _init_worker(cv_threads: int, warmup=None):
+    # Pin native thread pools before any heavy work happens in this process.
+    # Each worker owns one core's worth of work; nested OpenCV/BLAS threads would oversubscribe.
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(cv_threads)
+
+    import cv2
+    cv2.setNumThreads(cv_threads)
+    try:
+        cv2.ocl.setUseOpenCL(False)
+    except AttributeError:
+        pass
+
+    if warmup is not None:
+        # Never let a failed warm-up kill the worker; it is reported through readiness instead
+        global _warmup_error
+        try:
+            warmup()
+            _warmup_error = None
+        except Exception as e:
+            _warmup_error = str(e) or type(e).__name__
+
+
+def _worker_status(hold: float = 0.0):
+    # Runs only after the initializer (and its warm-up) has finished in this worker.
+    # `hold` keeps the worker busy briefly so concurrent probes land on different workers.
+    if hold:
+        time.sleep(hold)
+    return os.getpid(), _warmup_error
+
+
+def _timed_call(fn, *args):
+    # Measures service time inside the worker so queue wait does not inflate Retry-After.
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class EnginePool:
+    """
+    Runs CPU-bound engine calls off the event loop.
+    Workers are separate processes (one Haar decode per core); admission is bounded so a
+    burst queues up to `max_pending` jobs and everything beyond that is rejected fast.
+    Only as many jobs as there are workers are handed to the executor; the rest wait here,
+    ordered by arrival time + estimated cost (seconds), so short clips overtake long ones
+    while a long one waits at most about its own cost extra.
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None, cv_threads: int = None, warmup=None):
+        self.workers = config.ENGINE_WORKERS if workers is None else workers
+        self.max_pending = config.ENGINE_MAX_PENDING if max_pending is None else max_pending
+        self.cv_threads = config.ENGINE_CV_THREADS if cv_threads is None else cv_threads
+        # Module-level callable run once in every worker before it accepts jobs
+        self.warmup = warmup
+
+        self.ready = False
+        self.warmup_error = None
+
+        self._executor = None
+        # Warm-up of the workers that replaced a broken pool
+        self._rewarm = None
+        self._pending = 0
+        self._avg_duration = None  # EWMA of job wall time in seconds
+
+        # Jobs handed to the executor, and the ones waiting for a slot: (priority, seq, waiter)
+        self._running = 0
+        self._queue = []
+        self._seq = itertools.count()
+
+    @property
+    def mode(self) -> str:
+        return "process" if self.workers > 0 else "thread"
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def slots(self) -> int:
+        return max(1, self.workers)
+
+    @property
+    def idle_slots(self) -> int:
+        """Slots a job submitted now would start on without waiting."""
+        return 0 if self._queue else max(0, self.slots - self._running)
+
+    async def _acquire(self, cost: float):
+        if self._running < self.slots and not self._queue:
+            self._running += 1
+            return
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        heapq.heappush(self._queue, (loop.time() + cost, next(self._seq), waiter))
+        try:
+            # The releasing job hands its slot over (the running count stays the same)
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        while self._queue:
+            _, _, waiter = heapq.heappop(self._queue)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._running -= 1
+
+    def start(self):
+        if self._executor is not None:
+            return
+        if self.workers > 0:
+            # spawn: never fork a process that is already running an event loop and threads
+            ctx = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=ctx,
+                initializer=_init_worker,
+                initargs=(self.cv_threads, self.warmup),
+            )
+        else:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="deepshield-engine",
+                initializer=_init_worker,
+                initargs=(self.cv_threads, self.warmup),
+            )
+
+    async def wait_ready(self, timeout: float = None):
+        """
+        Starts every worker and waits until each has finished its warm-up, then sets `ready`.
+        Workers are spawned on demand, so probes are sent in rounds until all pids have answered.
+        """
+        if self._executor is None:
+            self.start()
+        timeout = config.ENGINE_WARMUP_TIMEOUT if timeout is None else timeout
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        expected = max(1, self.workers)
+        seen = {}
+        while len(seen) < expected:
+            if loop.time() > deadline:
+                self.warmup_error = f"Only {len(seen)}/{expected} workers warmed up within {timeout:.0f}s"
+                return False
+            probes = [loop.run_in_executor(self._executor, _worker_status, 0.05) for _ in range(expected)]
+            for pid, error in await asyncio.gather(*probes):
+                seen[pid] = error
+
+        errors = [e for e in seen.values() if e]
+        self.warmup_error = errors[0] if errors else None
+        self.ready = not errors
+        return self.ready
+
+    def _replace_broken(self):
+        # Not ready until every replacement worker has warmed up (GET /api/ready)
+        self.ready = False
+        self.warmup_error = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self.start()
+        self._rewarm = asyncio.ensure_future(self.wait_ready())
+
+    def shutdown(self):
+        self.ready = False
+        if self._rewarm is not None:
+            self._rewarm.cancel()
+            self._rewarm = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely to free up, based on measured job durations."""
+        if self._avg_duration is None:
+            return max(1, math.ceil(config.ENGINE_DEFAULT_RETRY_AFTER))
+        slots = max(1, self.workers)
+        return max(1, math.ceil(self._avg_duration * self._pending / slots))
+
+    async def run(self, fn, *args, cost: float = 0.0):
+        """
+        Admits and runs fn(*args) in the pool. Raises EngineBusy when the pending queue is full.
+        cost is the job's estimated engine seconds (probe.estimate_cost), used for queue order.
+        Must be called from the event loop thread (the pending counter is not locked).
+        """
+        if self._executor is None:
+            self.start()
+
+        if self._pending >= self.max_pending:
+            raise EngineBusy(self.retry_after())
+
+        self._pending += 1
+        try:
+            await self._acquire(cost or 0.0)
+            # The pool this job runs on: it may be replaced while the job waited or ran
+            executor = self._executor
+            try:
+                loop = asyncio.get_running_loop()
+                result, elapsed = await loop.run_in_executor(executor, _timed_call, fn, *args)
+            finally:
+                self._release()
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault in a codec). Replace the pool so later requests recover.
+            # Every job in flight on the broken pool lands here; only the first one replaces it.
+            if self._executor is executor:
+                self._replace_broken()
+            raise
+        finally:
+            self._pending -= 1
+
+        if self._avg_duration is None:
+            self._avg_duration = elapsed
+        else:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * elapsed
+        return result
@@ -0,0 +1,141 @@
+import io
+import os
+import shutil
+import tempfile
+
+import cv2
+
+import config
+
+# Upload ingest.
+# Uploads are handed to the decoder from memory whenever possible instead of being copied into
+# a temp file and read back. The decoder side tries, in order:
+#   buffer - cv2.VideoCapture over an in-memory stream (OpenCV >= 4.10 with FFmpeg)
+#   memfd  - anonymous in-memory file (Linux), opened through /proc/self/fd
+#   tmpfs  - file in /dev/shm (RAM-backed)
+#   disk   - regular temp file (always works, and used for oversize uploads)
+
+INGEST_PATHS = ("buffer", "memfd", "tmpfs", "disk")
+
+
+def _noop():
+    pass
+
+
+def _open_buffer(data: bytes):
+    # The capture does not own a reference to the Python stream; it must outlive cap.release(),
+    # so the cleanup closure holds it (a collected stream segfaults the FFmpeg reader).
+    stream = io.BytesIO(data)
+    try:
+        cap = cv2.VideoCapture(stream, cv2.CAP_FFMPEG, [])
+    except (TypeError, cv2.error):
+        # OpenCV build without stream-reader support
+        return None
+    if not cap.isOpened():
+        cap.release()
+        return None
+    return cap, stream.close
+
+
+def _open_memfd(data: bytes):
+    if not hasattr(os, "memfd_create"):
+        return None
+    fd = os.memfd_create("deepshield-upload")
+    with os.fdopen(os.dup(fd), "wb") as f:
+        f.write(data)
+    cap = cv2.VideoCapture(f"/proc/self/fd/{fd}")
+    if not cap.isOpened():
+        cap.release()
+        os.close(fd)
+        return None
+    return cap, lambda: os.close(fd)
+
+
+def _open_temp_file(data: bytes, directory: str = None):
+    if directory is not None and not os.path.isdir(directory):
+        return None
+    fd, path = tempfile.mkstemp(suffix=".webm", dir=directory)
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+
+    def cleanup():
+        if os.path.exists(path):
+            os.remove(path)
+
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        cap.release()
+        cleanup()
+        return None
+    return cap, cleanup
+
+
+_OPENERS = {
+    "buffer": _open_buffer,
+    "memfd": _open_memfd,
+    "tmpfs": lambda data: _open_temp_file(data, "/dev/shm"),
+    "disk": _open_temp_file,
+}
+
+
+def open_video(video):
+    """
+    Opens a capture for a file path or raw upload bytes.
+    Returns (cap, ingest_path, cleanup); cap is None if no path could open the video.
+    cleanup() must be called after cap.release().
+    """
+    if isinstance(video, str):
+        return cv2.VideoCapture(video), "disk", _noop
+
+    data = bytes(video)
+    mode = config.INGEST_MODE
+    order = INGEST_PATHS if mode == "auto" else (mode,)
+    for name in order:
+        opened = _OPENERS[name](data)
+        if opened is not None:
+            cap, cleanup = opened
+            return cap, name, cleanup
+    return None, order[-1], _noop
+
+
+class UploadSource:
+    """What the API hands to the engine: upload bytes, or a temp-file path for oversize uploads."""
+
+    def __init__(self, video, size: int, temp_path: str = None):
+        self.video = video
+        self.size = size
+        self._temp_path = temp_path
+
+    def cleanup(self):
+        if self._temp_path and os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
+        self._temp_path = None
+        self.video = None
+
+
+async def read_upload(upload) -> UploadSource:
+    """
+    Takes the video out of a Starlette UploadFile (already spooled by Starlette).
+    Small uploads are read straight into memory; uploads above DEEPSHIELD_INGEST_MAX_MEMORY_MB
+    fall back to a single copy on disk so a huge upload cannot blow up worker memory.
+    """
+    size = upload.size
+    if size is None:
+        upload.file.seek(0, os.SEEK_END)
+        size = upload.file.tell()
+        upload.file.seek(0)
+
+    if size <= config.INGEST_MAX_MEMORY_MB * 1024 * 1024:
+        data = await upload.read()
+        return UploadSource(data, len(data))
+
+    from starlette.concurrency import run_in_threadpool
+
+    def copy_to_disk():
+        fd, temp_path = tempfile.mkstemp(suffix=".webm")
+        with os.fdopen(fd, "wb") as buffer:
+            shutil.copyfileobj(upload.file, buffer)
+        return temp_path
+
+    temp_path = await run_in_threadpool(copy_to_disk)
+    return UploadSource(temp_path, size, temp_path=temp_path)
@@ -0,0 +1,74 @@
+import argparse
+import signal
+import time
+
+import cv2
+
+import config
+from detectors import warm_up
+from jobs import analyze_job, create_queue, worker_name
+
+# Standalone job worker.
+# Claims jobs from DEEPSHIELD_JOB_QUEUE (see jobs.py) and runs the engine in this process, so
+# analysis can scale on its own nodes while API nodes only take uploads (DEEPSHIELD_JOB_INLINE=0).
+# Run one per core. SIGTERM / Ctrl+C finishes the current job before exiting; a worker that is
+# killed outright leaves its job to be claimed again once the lease runs out.
+
+
+def run_one(queue, worker: str) -> bool:
+    """Claims and runs one job; False when the queue is empty."""
+    claimed = queue.claim(worker)
+    if claimed is None:
+        return False
+    job, video = claimed
+    try:
+        result = analyze_job(video, job["params"])
+    except Exception as e:
+        queue.finish(job["id"], {
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": f"Internal Server Error: {str(e)}"
+        }, failed=True)
+    else:
+        result.pop("timings", None)
+        queue.finish(job["id"], result)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepShield job worker")
+    parser.add_argument("--queue", default=config.JOB_QUEUE, help="Job queue (memory is useless here)")
+    parser.add_argument("--poll", type=float, default=config.JOB_POLL_INTERVAL,
+                        help="Seconds between queue checks while idle (doubling up to DEEPSHIELD_JOB_IDLE_POLL_MAX_S)")
+    parser.add_argument("--max-jobs", type=int, default=0, help="Exit after this many jobs (0 = run forever)")
+    args = parser.parse_args()
+    if args.queue == "memory":
+        parser.error("a memory queue lives inside the API process; use sqlite:///<path> or a redis:// URL")
+
+    cv2.setNumThreads(config.ENGINE_CV_THREADS)
+    queue = create_queue(args.queue)
+    worker = worker_name()
+    warm_up()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+    print(f"🛠️  Worker {worker} waiting for jobs on {args.queue}")
+    done = 0
+    idle = args.poll
+    try:
+        while not stopping and (not args.max_jobs or done < args.max_jobs):
+            if run_one(queue, worker):
+                done += 1
+                idle = args.poll
+            else:
+                # Back off while the queue stays empty (each check is a write transaction)
+                time.sleep(idle)
+                idle = min(idle * 2, max(config.JOB_IDLE_POLL_MAX_S, args.poll))
+    except KeyboardInterrupt:
+        pass
+    print(f"👋 Worker {worker} stopped after {done} job(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+import json
+import os
+import secrets
+import socket
+import sqlite3
+import threading
+import time
+
+import config
+from challenges import Challenge
+from physics_engine import analyze_video_challenge
+
+# Asynchronous verification jobs.
+# POST /api/jobs stores the upload and its (already validated) flash parameters in a JobQueue
+# and answers with a job id at once; clients poll, long-poll or subscribe (SSE) for the result.
+# Workers claim jobs with a lease: a worker that dies mid-job simply lets its lease run out and
+# the job is claimed again (up to DEEPSHIELD_JOB_MAX_ATTEMPTS), so restarts lose nothing. The
+# upload is deleted as soon as the job finishes; the verdict is kept for DEEPSHIELD_JOB_TTL.
+# Claim order is arrival time + estimated engine cost, like the engine pool's own queue.
+#
+# Queues implement the JobQueue interface: SqliteJobQueue (a database file, or in-process
+# memory) for a single node, RedisJobQueue when API and worker nodes are separate machines.
+# Jobs run in the API's engine pool (DEEPSHIELD_JOB_INLINE) and/or in job_worker.py processes.
+
+STATUSES = ("queued", "running", "done", "failed")
+FINISHED = ("done", "failed")
+
+
+def new_job_id() -> str:
+    return secrets.token_urlsafe(16)
+
+
+def worker_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def analyze_job(video, params: dict) -> dict:
+    """
+    Runs one job's engine call (in an engine pool worker or a job_worker.py process).
+    params are the ones /api/jobs stored: flash_offset, flash_schedule, challenge, detect_width.
+    """
+    template = Challenge.from_dict(params["challenge"]).template if params.get("challenge") else None
+    deadline = time.time() + config.REQUEST_DEADLINE_S if config.REQUEST_DEADLINE_S > 0 else None
+    return analyze_video_challenge(video, params.get("flash_offset"), detect_width=params.get("detect_width"),
+                                   flash_schedule=params.get("flash_schedule"), template=template,
+                                   deadline=deadline)
+
+
+def _lost_result(attempts: int) -> dict:
+    return {
+        "is_liveness_verified": False,
+        "latency_ms": 0.0,
+        "delta": 0.0,
+        "message": f"Internal Server Error: job was abandoned by its worker {attempts} times"
+    }
+
+
+class JobQueue:
+    """
+    Job queue interface. A job is a dict: id, status, params, result (once finished), attempts,
+    created_at, updated_at. Videos are only handed out by claim().
+    """
+
+    def submit(self, job_id: str, video: bytes, params: dict, cost: float = 0.0):
+        raise NotImplementedError
+
+    def claim(self, worker: str, lease: float = None):
+        """Next job to run as (job, video bytes) with a lease of `lease` seconds, or None."""
+        raise NotImplementedError
+
+    def release(self, job_id: str):
+        """Gives a claimed job back without counting the attempt (e.g. the engine was busy)."""
+        raise NotImplementedError
+
+    def finish(self, job_id: str, result: dict, failed: bool = False):
+        """Stores the result and deletes the upload."""
+        raise NotImplementedError
+
+    def get(self, job_id: str):
+        """The job (without its video), or None if it is unknown or expired."""
+        raise NotImplementedError
+
+    def queued(self) -> int:
+        """Jobs waiting for a worker."""
+        raise NotImplementedError
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    video BLOB,
+    result TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    priority REAL NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    lease_until REAL,
+    worker TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_by_priority ON jobs (status, priority);
+CREATE INDEX IF NOT EXISTS jobs_by_update ON jobs (status, updated_at);
+"""
+
+_COLUMNS = "id, status, params, result, attempts, created_at, updated_at"
+
+
+class SqliteJobQueue(JobQueue):
+    """
+    Jobs in one SQLite database (WAL mode, so the API and local job_worker.py processes can share
+    the file). path=":memory:" keeps the queue inside this process only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        if path == ":memory:":
+            # A named shared-cache database lives as long as one connection to it is open
+            self._uri = f"file:deepshield-jobs-{id(self)}?mode=memory&cache=shared"
+        else:
+            self._uri = f"file:{path}"
+        self._local = threading.local()
+        self._keepalive = self._connect()
+        with self._keepalive:
+            if path != ":memory:":
+                self._keepalive.execute("PRAGMA journal_mode=WAL")
+            self._keepalive.executescript(_SCHEMA)
+
+    def _connect(self):
+        connection = sqlite3.connect(self._uri, uri=True, timeout=30.0, isolation_level=None,
+                                     check_same_thread=False)
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    @property
+    def _db(self):
+        # One connection per thread (the API calls in from its threadpool)
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+        return connection
+
+    def _job(self, row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def submit(self, job_id: str, video: bytes, params: dict, cost: float = 0.0):
+        now = time.time()
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Finished jobs past their TTL go on every submit, so the table stays small
+            db.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated_at < ?",
+                       (now - config.JOB_TTL,))
+            db.execute("INSERT INTO jobs (id, status, params, video, priority, created_at, updated_at) "
+                       "VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                       (job_id, json.dumps(params), sqlite3.Binary(video), now + cost, now, now))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def claim(self, worker: str, lease: float = None):
+        lease = config.JOB_LEASE_S if lease is None else lease
+        now = time.time()
+        db = self._db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                # Queued jobs, and running ones whose worker let the lease expire
+                row = db.execute(
+                    "SELECT id, attempts FROM jobs WHERE status = 'queued' "
+                    "OR (status = 'running' AND lease_until < ?) ORDER BY priority LIMIT 1", (now,)).fetchone()
+                if row is None:
+                    db.execute("COMMIT")
+                    return None
+                if row["attempts"] >= config.JOB_MAX_ATTEMPTS:
+                    db.execute("UPDATE jobs SET status = 'failed', result = ?, video = NULL, updated_at = ? "
+                               "WHERE id = ?", (json.dumps(_lost_result(row["attempts"])), now, row["id"]))
+                    continue
+                db.execute("UPDATE jobs SET status = 'running', attempts = attempts + 1, lease_until = ?, "
+                           "worker = ?, updated_at = ? WHERE id = ?", (now + lease, worker, now, row["id"]))
+                job = db.execute(f"SELECT {_COLUMNS}, video FROM jobs WHERE id = ?", (row["id"],)).fetchone()
+                db.execute("COMMIT")
+                video = bytes(job["video"])
+                return self._job({k: job[k] for k in job.keys() if k != "video"}), video
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def release(self, job_id: str):
+        self._db.execute("UPDATE jobs SET status = 'queued', attempts = MAX(0, attempts - 1), lease_until = NULL, "
+                         "worker = NULL, updated_at = ? WHERE id = ? AND status = 'running'", (time.time(), job_id))
+
+    def finish(self, job_id: str, result: dict, failed: bool = False):
+        self._db.execute("UPDATE jobs SET status = ?, result = ?, video = NULL, lease_until = NULL, updated_at = ? "
+                         "WHERE id = ?", ("failed" if failed else "done", json.dumps(result), time.time(), job_id))
+
+    def get(self, job_id: str):
+        row = self._db.execute(f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = self._job(row)
+        if job["status"] in FINISHED and job["updated_at"] < time.time() - config.JOB_TTL:
+            return None
+        return job
+
+    def queued(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+
+# Atomically re-queues expired leases, then pops the cheapest ready job and leases it.
+# Returns [id, attempts] or nil. KEYS: ready zset, running zset. ARGV: now, lease_until, key prefix.
+_REDIS_CLAIM = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+for _, id in ipairs(expired) do
+    redis.call('ZREM', KEYS[2], id)
+    redis.call('ZADD', KEYS[1], redis.call('HGET', ARGV[3] .. id, 'priority'), id)
+end
+local popped = redis.call('ZPOPMIN', KEYS[1])
+if #popped == 0 then
+    return nil
+end
+local id = popped[1]
+local attempts = redis.call('HINCRBY', ARGV[3] .. id, 'attempts', 1)
+redis.call('HSET', ARGV[3] .. id, 'status', 'running', 'updated_at', ARGV[1])
+redis.call('ZADD', KEYS[2], ARGV[2], id)
+return {id, attempts}
+"""
+
+
+class RedisJobQueue(JobQueue):
+    """
+    Jobs shared by API and worker nodes through Redis (or anything speaking its protocol and Lua):
+    a hash per job, the upload in its own key, and sorted sets for ready (by priority) and leased
+    (by lease expiry) jobs.
+    """
+
+    KEY_PREFIX = "deepshield:job:"
+    READY_KEY = "deepshield:jobs:ready"
+    RUNNING_KEY = "deepshield:jobs:running"
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("DEEPSHIELD_JOB_QUEUE is a Redis URL but the redis package is not installed")
+        self._client = redis.Redis.from_url(url)
+        self._claim = self._client.register_script(_REDIS_CLAIM)
+
+    def submit(self, job_id: str, video: bytes, params: dict, cost: float = 0.0):
+        now = time.time()
+        key = self.KEY_PREFIX + job_id
+        pipe = self._client.pipeline()
+        pipe.hset(key, mapping={"id": job_id, "status": "queued", "params": json.dumps(params), "attempts": 0,
+                                "priority": now + cost, "created_at": now, "updated_at": now})
+        pipe.set(key + ":video", video)
+        pipe.zadd(self.READY_KEY, {job_id: now + cost})
+        pipe.execute()
+
+    def claim(self, worker: str, lease: float = None):
+        lease = config.JOB_LEASE_S if lease is None else lease
+        while True:
+            now = time.time()
+            claimed = self._claim(keys=[self.READY_KEY, self.RUNNING_KEY], args=[now, now + lease, self.KEY_PREFIX])
+            if claimed is None:
+                return None
+            job_id, attempts = claimed[0].decode(), int(claimed[1])
+            if attempts > config.JOB_MAX_ATTEMPTS:
+                self._client.zrem(self.RUNNING_KEY, job_id)
+                self.finish(job_id, _lost_result(attempts - 1), failed=True)
+                continue
+            video = self._client.get(self.KEY_PREFIX + job_id + ":video")
+            job = self.get(job_id)
+            if video is None or job is None:
+                # Finished or expired underneath us
+                self._client.zrem(self.RUNNING_KEY, job_id)
+                continue
+            self._client.hset(self.KEY_PREFIX + job_id, "worker", worker)
+            return job, video
+
+    def release(self, job_id: str):
+        key = self.KEY_PREFIX + job_id
+        priority = self._client.hget(key, "priority")
+        pipe = self._client.pipeline()
+        pipe.zrem(self.RUNNING_KEY, job_id)
+        pipe.hincrby(key, "attempts", -1)
+        pipe.hset(key, mapping={"status": "queued", "updated_at": time.time()})
+        pipe.zadd(self.READY_KEY, {job_id: float(priority or 0)})
+        pipe.execute()
+
+    def finish(self, job_id: str, result: dict, failed: bool = False):
+        key = self.KEY_PREFIX + job_id
+        pipe = self._client.pipeline()
+        pipe.zrem(self.RUNNING_KEY, job_id)
+        pipe.delete(key + ":video")
+        pipe.hset(key, mapping={"status": "failed" if failed else "done", "result": json.dumps(result),
+                                "updated_at": time.time()})
+        pipe.expire(key, max(1, int(config.JOB_TTL)))
+        pipe.execute()
+
+    def get(self, job_id: str):
+        data = self._client.hgetall(self.KEY_PREFIX + job_id)
+        if not data:
+            return None
+        data = {k.decode(): v.decode() for k, v in data.items()}
+        return {
+            "id": data["id"],
+            "status": data["status"],
+            "params": json.loads(data["params"]),
+            "result": json.loads(data["result"]) if data.get("result") else None,
+            "attempts": int(data["attempts"]),
+            "created_at": float(data["created_at"]),
+            "updated_at": float(data["updated_at"]),
+        }
+
+    def queued(self) -> int:
+        return self._client.zcard(self.READY_KEY)
+
+
+def create_queue(spec: str = None) -> JobQueue:
+    spec = spec or config.JOB_QUEUE
+    if spec == "memory":
+        return SqliteJobQueue(":memory:")
+    if spec.startswith("sqlite:///"):
+        return SqliteJobQueue(spec[len("sqlite:///"):])
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisJobQueue(spec)
+    raise ValueError(f"Unknown job queue '{spec}' (use 'memory', sqlite:///<path> or a redis:// URL)")
@@ -1,11 +1,98 @@
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.middleware.cors import CORSMiddleware
-import shutil
+import asyncio
 import os
-import tempfile
-from physics_engine import analyze_video_challenge
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from time import perf_counter
+from typing import List, Optional
+import json
+from fastapi import FastAPI, File, UploadFile, Form, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from physics_engine import analyze_video_challenge, parse_flash_schedule, score_schedule, score_trace
+from engine_pool import EnginePool, EngineBusy
+from detectors import warm_up
+from ingest import read_upload
+from probe import UploadRejected, admit, probe_video
+import streaming
+from streaming import StreamingVerification, StreamTooLarge
+from batch import BatchError, items_from_archive, items_from_uploads, stream_batch
+from challenges import create_store, issue_challenge
+from client_trace import check_keyframes, parse_client_trace, parse_keyframes, review_keyframes
+from audit_log import AuditLog, new_request_id, verify_record
+from capture import CapturePipeline
+from jobs import FINISHED, analyze_job, create_queue, new_job_id, worker_name
+from segments import analyze_segmented, plan_upload
+from result_cache import IDEMPOTENCY_HEADER, IdempotencyConflict, ResultCache, cache_key, upload_digest
+import metrics
+import config
+
+# CPU-bound engine runs in worker processes so the event loop stays responsive.
+# Every worker loads its face detector and runs a warm-up clip before taking jobs.
+engine_pool = EnginePool(warmup=warm_up)
+
+# Issued challenges awaiting their answer (in-process, or Redis when DEEPSHIELD_CHALLENGE_STORE is a URL)
+challenge_store = create_store()
+
+# Verdicts of recent uploads, for retries and duplicates (also single-flights identical requests)
+result_cache = ResultCache()
+
+# Asynchronous jobs (SQLite by default, Redis when API and worker nodes are separate)
+job_queue = create_queue()
+# Finished uploads sampled for the dataset, written in the background (off unless DEEPSHIELD_CAPTURE_RATE > 0)
+capture = CapturePipeline()
+# One JSONL record per verification, written and rotated in the background (DEEPSHIELD_AUDIT_LOG)
+audit_log = AuditLog()
+
+# Job id -> event set when this process finishes the job, so long-polls return without waiting a poll interval
+job_waiters = {}
+# One token per job submitted here: wakes an idle job runner at once instead of on its next poll
+job_submitted = asyncio.Semaphore(0)
+
+metrics.ENGINE_PENDING.set_function(lambda: engine_pool.pending)
+metrics.ACTIVE_STREAMS.set_function(streaming.active_sessions)
+if challenge_store.countable:
+    metrics.CHALLENGE_SESSIONS.set_function(lambda: len(challenge_store))
+metrics.JOBS_QUEUED.set_function(lambda: job_queue.queued())
+metrics.CAPTURE_QUEUED.set_function(lambda: len(capture))
+metrics.AUDIT_LOG_QUEUED.set_function(lambda: len(audit_log))
 
-app = FastAPI(title="DeepShield Headless API")
+# Clients send this header (with DEEPSHIELD_PROFILE=header) to get a cProfile summary back
+PROFILE_HEADER = "X-DeepShield-Profile"
+# Every verification answers with the id of its audit log record
+REQUEST_ID_HEADER = "X-Request-ID"
+
+# Audit outcome of replies that never reached a verdict, by HTTP status
+_AUDIT_STATUS_OUTCOMES = {400: "bad_request", 409: "idempotency_conflict", 413: "too_large", 503: "busy"}
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    engine_pool.start()
+    capture.start()
+    audit_log.start()
+    # Warm up in the background so /api/ready can report progress while workers load
+    warmup_task = asyncio.create_task(engine_pool.wait_ready())
+    # Stream threads load their face detector once, before the first stream arrives
+    streams_task = asyncio.create_task(run_in_threadpool(streaming.warm_up_threads))
+    # One job runner per engine slot; without them only job_worker.py processes run jobs
+    job_runners = [asyncio.create_task(_run_jobs(worker_name())) for _ in range(engine_pool.slots)
+                   if config.JOB_INLINE]
+    yield
+    for runner in job_runners:
+        runner.cancel()
+    await asyncio.gather(*job_runners, return_exceptions=True)
+    warmup_task.cancel()
+    await asyncio.gather(streams_task, return_exceptions=True)
+    engine_pool.shutdown()
+    streaming.shutdown()
+    # Flush what is still queued for the dataset
+    await run_in_threadpool(capture.close)
+    await run_in_threadpool(audit_log.close)
+
+
+app = FastAPI(title="DeepShield Headless API", lifespan=lifespan)
 
 # Ensure FastAPI and CORSMiddleware are correctly set up with allow_origins=["*"]
 app.add_middleware(
@@ -14,37 +101,740 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "Server-Timing", IDEMPOTENCY_HEADER],
 )
 
+
+def _upload_extension(filename: str) -> str:
+    extension = os.path.splitext(filename or "")[1].lower()
+    return extension if 1 < len(extension) <= 6 and extension[1:].isalnum() else ".webm"
+
+
+def _profile_flags(request: Request):
+    """(profile this request, return the summary to the client)"""
+    asked = request.headers.get(PROFILE_HEADER) == "1"
+    mode = config.PROFILE_MODE
+    return mode == "always" or (mode == "header" and asked), asked and mode != "off"
+
+
+@app.post("/api/challenge")
+async def challenge():
+    """
+    Issues a single-use random challenge: the client flashes each color at offset_ms (from the start
+    of its recording) for duration_ms, then uploads with the challenge_id.
+    """
+    issued = issue_challenge()
+    await run_in_threadpool(challenge_store.put, issued, config.CHALLENGE_TTL)
+    return {"challenge_id": issued.id, "schedule": issued.schedule, "expires_in": config.CHALLENGE_TTL}
+
+
+async def _answer_challenge(challenge_id: str, schedule, flash_offset):
+    """(schedule to score, issued challenge) for an answer to a challenge; ValueError if it does not fit."""
+    # Single use: the session is gone after this lookup whatever the verdict
+    issued = await run_in_threadpool(challenge_store.take, challenge_id)
+    if issued is None:
+        raise ValueError("unknown, used or expired challenge")
+    return issued.flash_schedule(schedule, flash_offset), issued
+
+
+async def _probe_upload(source, schedule, flash_offset):
+    """(container info, admission) for an upload, or (None, None) if it cannot be opened; raises UploadRejected."""
+    info = await run_in_threadpool(probe_video, source.video)
+    if info is None:
+        return None, None
+    offsets = [offset for _, offset in schedule] if schedule else [flash_offset]
+    return info, admit(info, source.size, offsets[0], offsets[-1])
+
+
+async def _read_body(request: Request, limit: int):
+    """The request body, or None as soon as it is known to exceed limit bytes (never buffers more)."""
+    declared = request.headers.get("content-length")
+    if declared is not None and declared.isdigit() and int(declared) > limit:
+        return None
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > limit:
+            return None
+    return bytes(body)
+
+
+async def _segment_plan(source, info, schedule, flash_offset):
+    """Segments for analyzing the upload on several idle workers at once, or None (segments.py)."""
+    if engine_pool.idle_slots < 2:
+        return None
+    offsets = [offset for _, offset in schedule] if schedule else [flash_offset]
+    plan = await run_in_threadpool(plan_upload, source.video, info, offsets[0], offsets[-1], engine_pool.slots)
+    # Every segment is admitted like a request; never let a split upload run into EngineBusy halfway
+    if plan and engine_pool.pending + len(plan) > engine_pool.max_pending:
+        return None
+    return plan
+
+
+def _probe_summary(info: dict, admission: dict) -> dict:
+    return dict(info, estimated_cost_s=round(admission["cost_s"], 3), detect_width=admission["detect_width"],
+                downscaled=admission["downscaled"])
+
+
+def _challenge_rejected(challenge_id: str, error: Exception) -> dict:
+    return {
+        "is_liveness_verified": False,
+        "latency_ms": 0.0,
+        "delta": 0.0,
+        "message": f"Challenge rejected: {error}",
+        "challenge_id": challenge_id
+    }
+
+
 @app.post("/api/verify_liveness")
 async def verify_liveness(
-    video_file: UploadFile = File(...), 
-    flash_offset: float = Form(...)
+    request: Request,
+    response: Response,
+    video_file: UploadFile = File(...),
+    flash_offset: Optional[float] = Form(None),
+    flash_schedule: Optional[str] = Form(None),
+    challenge_id: Optional[str] = Form(None)
 ):
-    temp_file_path = None
-    try:
-        # 1. Save the uploaded video_file to a temporary local file
-        fd, temp_file_path = tempfile.mkstemp(suffix=".webm")
-        with os.fdopen(fd, 'wb') as buffer:
-            shutil.copyfileobj(video_file.file, buffer)
-            
-        # 2. Pass this temporary file path and the flash_offset to physics_engine
-        result = analyze_video_challenge(temp_file_path, flash_offset)
-        
+    """
+    flash_offset is the red flash start (ms into the recording). flash_schedule, a JSON list of
+    {"color": "red"|"green"|"blue", "offset": <ms>}, scores every flash of the challenge instead
+    (per-color results under "flashes", verified only if all are).
+    challenge_id answers a challenge from /api/challenge: the reported flash_schedule must follow
+    the issued one (or flash_offset gives the first flash start and the issued timings are used).
+    Identical uploads with identical parameters are answered from the result cache ("cache": "hit"),
+    or share one engine run when they arrive together ("shared"); a retry should resend its
+    Idempotency-Key, any other byte-identical upload is flagged "repeated_upload".
+    The container is probed first: uploads over the DEEPSHIELD_MAX_* limits get 413 before any
+    decode, and the analysis stops with "Timed out" at DEEPSHIELD_REQUEST_DEADLINE_S.
+    Large or long uploads are decoded in keyframe segments on idle workers ("segments", see segments.py).
+    """
+    request_id = new_request_id()
+    started = perf_counter()
+    reply = None
+    try:
+        reply = await _verify_liveness(request, response, video_file, flash_offset, flash_schedule, challenge_id)
+        return reply
+    finally:
+        # Queued for the background writer: no file I/O here
+        if audit_log.enabled:
+            _audit_verify(request, request_id, reply, perf_counter() - started)
+        if isinstance(reply, Response):
+            reply.headers[REQUEST_ID_HEADER] = request_id
+        else:
+            response.headers[REQUEST_ID_HEADER] = request_id
+
+
+def _audit_verify(request: Request, request_id: str, reply, elapsed: float):
+    try:
+        record = _audit_record(request, request_id, reply, elapsed)
+    except Exception:
+        # Auditing must not turn a verification into an error
+        metrics.AUDIT_LOG.inc(outcome="dropped_error")
+        return
+    audit_log.write(record)
+
+
+def _audit_record(request: Request, request_id: str, reply, elapsed: float) -> dict:
+    state = getattr(request.state, "audit", {})
+    if isinstance(reply, JSONResponse):
+        status, result = reply.status_code, json.loads(reply.body)
+    elif reply is None:
+        # Cancelled (client went away) or raised past the endpoint
+        status, result = 500, {}
+    else:
+        status, result = 200, reply
+    frames = state.get("frames") or {}
+    category = metrics.failure_category(result, frames) if result else None
+    if status in _AUDIT_STATUS_OUTCOMES:
+        outcome = _AUDIT_STATUS_OUTCOMES[status]
+    elif status != 200 or category is not None:
+        outcome = "failed"
+    else:
+        outcome = "verified" if result.get("is_liveness_verified") else "rejected"
+    stages_ms = state.get("stages_ms") or {"total": elapsed * 1000.0}
+    return verify_record(request_id, status, outcome, state.get("upload_bytes"), result, stages_ms, frames, category)
+
+
+async def _verify_liveness(request: Request, response: Response, video_file: UploadFile, flash_offset: Optional[float],
+                           flash_schedule: Optional[str], challenge_id: Optional[str]):
+    started = perf_counter()
+    stages_ms = {}
+    source = None
+    try:
+        schedule = parse_flash_schedule(flash_schedule) if flash_schedule else None
+    except (ValueError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"message": f"Invalid flash_schedule: {e}"})
+    if challenge_id is None and config.CHALLENGE_REQUIRED:
+        return JSONResponse(status_code=400, content={"message": "Send challenge_id (request one from /api/challenge)"})
+    if schedule is None and flash_offset is None:
+        return JSONResponse(status_code=400, content={"message": "Send flash_offset or flash_schedule"})
+
+    profile, return_profile = _profile_flags(request)
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+    deadline = time.time() + config.REQUEST_DEADLINE_S if config.REQUEST_DEADLINE_S > 0 else None
+
+    # Probe and challenge outcome, filled in by prepare()
+    prepared = {}
+
+    async def prepare():
+        """Probes the upload and takes its challenge; returns the result to answer with if it goes no further."""
+        # Container metadata only: over-limit uploads are turned away before a worker decodes anything
+        # (and before a challenge is used up)
+        probed = perf_counter()
+        info, admission = await _probe_upload(source, schedule, flash_offset)
+        if info is None:
+            return {
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": "Error opening video file."
+            }
+        stages_ms["probe"] = (perf_counter() - probed) * 1000.0
+
+        schedule_to_score, template = schedule, None
+        if challenge_id is not None:
+            try:
+                schedule_to_score, issued = await _answer_challenge(challenge_id, schedule, flash_offset)
+            except ValueError as e:
+                return _challenge_rejected(challenge_id, e)
+            template = issued.template
+        prepared.update(info=info, admission=admission, schedule=schedule_to_score, template=template)
+        return None
+
+    async def verify():
+        if not prepared:
+            answer = await prepare()
+            if answer is not None:
+                return answer
+        info, admission = prepared["info"], prepared["admission"]
+        schedule_to_score, template = prepared["schedule"], prepared["template"]
+
+        engine = partial(analyze_video_challenge, detect_width=admission["detect_width"],
+                         flash_schedule=schedule_to_score or None, template=template, deadline=deadline)
+
+        # 2. Pass the video and the flash_offset / schedule to physics_engine (in the worker pool,
+        #    queued by estimated cost)
+        #    Large / long uploads are split at keyframes over idle workers instead
+        submitted = perf_counter()
+        plan = None if profile else await _segment_plan(source, info, schedule_to_score, flash_offset)
+        if profile:
+            result = await engine_pool.run(metrics.profiled_call, config.PROFILE_TOP, config.PROFILE_DIR,
+                                           engine, source.video, flash_offset, cost=admission["cost_s"])
+        elif plan:
+            result = await analyze_segmented(engine_pool, source.video, plan, flash_offset, schedule_to_score or None,
+                                             template, admission["detect_width"], deadline, admission["cost_s"],
+                                             fallback=engine)
+        else:
+            result = await engine_pool.run(engine, source.video, flash_offset, cost=admission["cost_s"])
+        if challenge_id is not None:
+            result["challenge_id"] = challenge_id
+        result["probe"] = _probe_summary(info, admission)
+
+        # Time in the pool that was not spent in the engine itself (waiting for a worker + IPC)
+        pool_ms = (perf_counter() - submitted) * 1000.0
+        engine_ms = result.get("timings", {}).get("stages_ms", {}).get("engine", pool_ms)
+        stages_ms["queue"] = max(0.0, pool_ms - engine_ms)
+        return result
+
+    try:
+        # 1. Take the upload bytes straight from Starlette's spool (oversize uploads go to one temp file)
+        source = await read_upload(video_file)
+        stages_ms["upload"] = (perf_counter() - started) * 1000.0
+        request.state.audit = {"upload_bytes": source.size}
+
+        if result_cache.enabled and not profile:
+            hashed = perf_counter()
+            digest = await run_in_threadpool(upload_digest, source.video)
+            key = cache_key(digest, flash_offset=flash_offset, flash_schedule=schedule, challenge_id=challenge_id)
+            retry = result_cache.claim_idempotency_key(idempotency_key, key)
+            repeated = result_cache.note_upload(digest, idempotency_key)
+            stages_ms["hash"] = (perf_counter() - hashed) * 1000.0
+
+            # A challenge is single use: unless this is a retry with the same Idempotency-Key, take it
+            # before the cache is consulted, so a used or expired id is rejected, never answered from it
+            result = None
+            if challenge_id is not None and not retry:
+                result = await prepare()
+            if result is None:
+                result, outcome = await result_cache.run(key, verify)
+            else:
+                outcome = "miss"
+            metrics.RESULT_CACHE.inc(outcome=outcome)
+            if repeated:
+                metrics.REPEATED_UPLOADS.inc()
+            result["cache"] = outcome
+            result["repeated_upload"] = repeated
+        else:
+            result = await verify()
+        if not return_profile:
+            result.pop("profile", None)
+
+        # Dataset capture (cached answers were captured when they were computed). Never blocks or raises.
+        if result.get("cache") not in ("hit", "shared"):
+            capture.offer(source.video, result, {"flash_offset": flash_offset, "flash_schedule": schedule,
+                                                 "challenge_id": challenge_id}, _upload_extension(video_file.filename))
+
+        stages_ms["total"] = (perf_counter() - started) * 1000.0
+        frames = dict((result.get("timings") or {}).get("frames", {}))
+        stages = metrics.record_result("verify", result, stages_ms, perf_counter() - started)
+        response.headers["Server-Timing"] = metrics.server_timing(stages)
+        request.state.audit.update(stages_ms=stages, frames=frames)
+
         # 4. Return the JSON result from the physics engine back to the client
         return result
-        
+
+    except IdempotencyConflict as e:
+        return JSONResponse(status_code=409, content={"message": str(e)})
+    except UploadRejected as e:
+        metrics.REQUESTS.inc(endpoint="verify", outcome="too_large")
+        return JSONResponse(
+            status_code=413,
+            content={
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": str(e)
+            },
+        )
+    except EngineBusy as e:
+        metrics.REQUESTS.inc(endpoint="verify", outcome="busy")
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": "Server busy, please retry shortly."
+            },
+        )
     except Exception as e:
-        return {
+        result = {
             "is_liveness_verified": False,
             "latency_ms": 0.0,
             "delta": 0.0,
             "message": f"Internal Server Error: {str(e)}"
         }
+        metrics.record_result("verify", result, elapsed=perf_counter() - started)
+        return result
     finally:
-        # 3. Delete the temporary video file from the server immediately after processing
-        if temp_file_path and os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        # 3. Drop the upload (and any temp file) from the server immediately after processing
+        if source is not None:
+            source.cleanup()
+
+def _job_view(job: dict) -> dict:
+    view = {"job_id": job["id"], "status": job["status"], "attempts": job["attempts"],
+            "created_at": job["created_at"], "updated_at": job["updated_at"]}
+    if job["status"] in FINISHED:
+        view["result"] = job["result"]
+    return view
+
+
+async def _wait_for_job(job_id: str, timeout: float, seen_status: str = None):
+    """
+    The job once it has finished (or, with seen_status, once its status differs from it), or as it
+    is after `timeout` seconds. None if it is unknown or expired.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max(0.0, timeout)
+    event = job_waiters.setdefault(job_id, asyncio.Event())
+    while True:
+        job = await run_in_threadpool(job_queue.get, job_id)
+        if job is None or job["status"] in FINISHED:
+            job_waiters.pop(job_id, None)
+            return job
+        remaining = deadline - loop.time()
+        if remaining <= 0 or (seen_status is not None and job["status"] != seen_status):
+            return job
+        # Woken early when this process finishes the job; other workers' results are polled for
+        try:
+            await asyncio.wait_for(event.wait(), timeout=min(remaining, config.JOB_POLL_INTERVAL))
+        except asyncio.TimeoutError:
+            pass
+
+
+async def _run_jobs(worker: str):
+    """Claims queued jobs and runs them in the engine pool until cancelled (one loop per engine slot)."""
+    idle = config.JOB_POLL_INTERVAL
+    while True:
+        claimed = await run_in_threadpool(job_queue.claim, worker)
+        if claimed is None:
+            # Woken by a submission to this process; otherwise poll (for other nodes' jobs) ever less often
+            try:
+                await asyncio.wait_for(job_submitted.acquire(), idle)
+            except asyncio.TimeoutError:
+                idle = min(idle * 2, max(config.JOB_IDLE_POLL_MAX_S, config.JOB_POLL_INTERVAL))
+            continue
+        idle = config.JOB_POLL_INTERVAL
+        job, video = claimed
+        params = job["params"]
+        started = perf_counter()
+        failed = False
+        try:
+            result = await engine_pool.run(analyze_job, video, params, cost=params.get("cost_s", 0.0))
+        except EngineBusy as e:
+            # Synchronous requests filled the pool: hand the job back and retry later
+            await run_in_threadpool(job_queue.release, job["id"])
+            await asyncio.sleep(e.retry_after)
+            continue
+        except asyncio.CancelledError:
+            # Off the event loop, and carried through even if the shutdown cancels again
+            await asyncio.shield(run_in_threadpool(job_queue.release, job["id"]))
+            raise
+        except Exception as e:
+            failed = True
+            result = {
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": f"Internal Server Error: {str(e)}"
+            }
+        if params.get("challenge_id") is not None:
+            result["challenge_id"] = params["challenge_id"]
+        if params.get("probe"):
+            result["probe"] = params["probe"]
+        metrics.record_result("jobs", result, elapsed=perf_counter() - started)
+        capture.offer(video, result, {key: params.get(key) for key in ("flash_offset", "flash_schedule", "challenge_id")})
+        await run_in_threadpool(job_queue.finish, job["id"], result, failed)
+        event = job_waiters.pop(job["id"], None)
+        if event is not None:
+            event.set()
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(
+    video_file: UploadFile = File(...),
+    flash_offset: Optional[float] = Form(None),
+    flash_schedule: Optional[str] = Form(None),
+    challenge_id: Optional[str] = Form(None)
+):
+    """
+    Asynchronous /api/verify_liveness (same form fields): validates, probes and stores the upload,
+    then answers 202 with a job id at once. The verdict comes from GET /api/jobs/{job_id}
+    (?wait=<s> long-polls) or as server-sent events from /api/jobs/{job_id}/events.
+    Uploads that are rejected before analysis (unreadable video, challenge mismatch) are answered
+    directly with the verdict, as /api/verify_liveness would.
+    """
+    source = None
+    try:
+        schedule = parse_flash_schedule(flash_schedule) if flash_schedule else None
+    except (ValueError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"message": f"Invalid flash_schedule: {e}"})
+    if challenge_id is None and config.CHALLENGE_REQUIRED:
+        return JSONResponse(status_code=400, content={"message": "Send challenge_id (request one from /api/challenge)"})
+    if schedule is None and flash_offset is None:
+        return JSONResponse(status_code=400, content={"message": "Send flash_offset or flash_schedule"})
+
+    try:
+        if await run_in_threadpool(job_queue.queued) >= config.JOB_MAX_QUEUED:
+            metrics.REQUESTS.inc(endpoint="jobs", outcome="busy")
+            return JSONResponse(status_code=503, headers={"Retry-After": "5"},
+                                content={"message": "Server busy, please retry shortly."})
+
+        source = await read_upload(video_file)
+        info, admission = await _probe_upload(source, schedule, flash_offset)
+        if info is None:
+            return {
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": "Error opening video file."
+            }
+
+        schedule_to_score, issued = schedule, None
+        if challenge_id is not None:
+            try:
+                schedule_to_score, issued = await _answer_challenge(challenge_id, schedule, flash_offset)
+            except ValueError as e:
+                return _challenge_rejected(challenge_id, e)
+
+        params = {
+            "flash_offset": flash_offset,
+            "flash_schedule": schedule_to_score or None,
+            "challenge_id": challenge_id,
+            "challenge": issued.to_dict() if issued is not None else None,
+            "detect_width": admission["detect_width"],
+            "cost_s": admission["cost_s"],
+            "probe": _probe_summary(info, admission),
+        }
+        video = source.video
+        if isinstance(video, str):
+            video = await run_in_threadpool(_read_file, video)
+        job_id = new_job_id()
+        await run_in_threadpool(job_queue.submit, job_id, video, params, admission["cost_s"])
+        job_submitted.release()
+        return {"job_id": job_id, "status": "queued", "status_url": f"/api/jobs/{job_id}",
+                "events_url": f"/api/jobs/{job_id}/events"}
+
+    except UploadRejected as e:
+        metrics.REQUESTS.inc(endpoint="jobs", outcome="too_large")
+        return JSONResponse(
+            status_code=413,
+            content={
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": str(e)
+            },
+        )
+    finally:
+        if source is not None:
+            source.cleanup()
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str, wait: float = 0.0):
+    """Job status, with "result" once it is done. wait=<seconds> holds the request until then (long-poll)."""
+    job = await _wait_for_job(job_id, min(wait, config.JOB_MAX_WAIT_S))
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Unknown or expired job"})
+    return _job_view(job)
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events: a "status" event per status change, the last one carrying the result."""
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"message": "Unknown or expired job"})
+
+    async def events():
+        current, seen = job, None
+        while True:
+            if current is None:
+                yield f"event: error\ndata: {json.dumps({'message': 'Unknown or expired job'})}\n\n"
+                return
+            if current["status"] != seen:
+                seen = current["status"]
+                yield f"event: status\ndata: {json.dumps(_job_view(current))}\n\n"
+                if seen in FINISHED:
+                    return
+            else:
+                # Comment line: keeps proxies from closing an idle connection
+                yield ": waiting\n\n"
+            current = await _wait_for_job(job_id, config.JOB_MAX_WAIT_S, seen_status=seen)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/verify_trace")
+async def verify_trace(request: Request, response: Response):
+    """
+    Verdict from a trace the browser extracted itself (deepshield.js with {trace: true}): per-frame
+    ROI means and timestamps as JSON (format in client_trace.py), with flash_offset / flash_schedule /
+    challenge_id as for /api/verify_liveness. Scoring runs right here, without a video decoder;
+    only the optional keyframes go to the engine pool for a face and consistency check.
+    """
+    started = perf_counter()
+    stages_ms = {}
+    body = await _read_body(request, int(config.TRACE_MAX_KB * 1024))
+    if body is None:
+        metrics.REQUESTS.inc(endpoint="verify_trace", outcome="too_large")
+        return JSONResponse(status_code=413, content={"message": f"Trace exceeds {config.TRACE_MAX_KB:g} KB"})
+    try:
+        payload = json.loads(body)
+        trace = parse_client_trace(payload)
+        keyframes = parse_keyframes(payload)
+        schedule = parse_flash_schedule(payload["flash_schedule"]) if payload.get("flash_schedule") else None
+        flash_offset = float(payload["flash_offset"]) if payload.get("flash_offset") is not None else None
+        challenge_id = payload.get("challenge_id")
+        frame_width = int(payload["width"]) if payload.get("width") else None
+    except (ValueError, TypeError) as e:
+        return JSONResponse(status_code=400, content={"message": f"Invalid trace: {e}"})
+    if challenge_id is None and config.CHALLENGE_REQUIRED:
+        return JSONResponse(status_code=400, content={"message": "Send challenge_id (request one from /api/challenge)"})
+    if schedule is None and flash_offset is None:
+        return JSONResponse(status_code=400, content={"message": "Send flash_offset or flash_schedule"})
+    stages_ms["parse"] = (perf_counter() - started) * 1000.0
+
+    try:
+        schedule_to_score, template = schedule, None
+        if challenge_id is not None:
+            try:
+                schedule_to_score, issued = await _answer_challenge(challenge_id, schedule, flash_offset)
+            except ValueError as e:
+                result = _challenge_rejected(challenge_id, e)
+                metrics.record_result("verify_trace", result, stages_ms, perf_counter() - started)
+                return result
+            template = issued.template
+
+        # Same scoring as the engine's last step, on the client's trace (sub-millisecond)
+        scored = perf_counter()
+        roi = trace.rois[0]
+        if schedule_to_score:
+            result = score_schedule(trace, schedule_to_score, roi=roi, template=template)
+        else:
+            result = score_trace(trace, flash_offset, roi=roi)
+        stages_ms["score"] = (perf_counter() - scored) * 1000.0
+        if challenge_id is not None:
+            result["challenge_id"] = challenge_id
+        result["trace"] = {"frames": len(trace), "roi": roi, "fps": trace.fps}
+
+        if keyframes or config.TRACE_MIN_KEYFRAMES > 0:
+            checked_at = perf_counter()
+            checked = await engine_pool.run(check_keyframes, keyframes, roi, frame_width,
+                                            cost=len(keyframes) * config.COST_DETECT_MS_PER_FRAME / 1000.0)
+            review_keyframes(result, trace, checked)
+            stages_ms["keyframes"] = (perf_counter() - checked_at) * 1000.0
+
+        stages_ms["total"] = (perf_counter() - started) * 1000.0
+        stages = metrics.record_result("verify_trace", result, stages_ms, perf_counter() - started)
+        response.headers["Server-Timing"] = metrics.server_timing(stages)
+        return result
+
+    except EngineBusy as e:
+        metrics.REQUESTS.inc(endpoint="verify_trace", outcome="busy")
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(e.retry_after)},
+            content={
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": "Server busy, please retry shortly."
+            },
+        )
+    except Exception as e:
+        result = {
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": f"Internal Server Error: {str(e)}"
+        }
+        metrics.record_result("verify_trace", result, elapsed=perf_counter() - started)
+        return result
+
+
+@app.post("/api/verify_batch")
+async def verify_batch(
+    video_files: Optional[List[UploadFile]] = File(None),
+    flash_offsets: Optional[List[float]] = Form(None),
+    archive: Optional[UploadFile] = File(None),
+    flash_offset: Optional[float] = Form(None),
+    concurrency: Optional[int] = Form(None)
+):
+    """
+    Verifies many recorded challenges in one request, streaming one NDJSON line per item as it completes.
+    Send either repeated video_files (+ flash_offsets in the same order) or a zip archive
+    (offsets from its manifest.json); flash_offset is the default for items without one.
+    """
+    try:
+        if archive is not None:
+            if archive.size is not None and archive.size > config.BATCH_MAX_ARCHIVE_MB * 1024 * 1024:
+                raise BatchError(f"Archive exceeds {config.BATCH_MAX_ARCHIVE_MB:g} MB")
+            # Read from Starlette's spooled file: members are extracted one at a time as they run
+            items = await run_in_threadpool(items_from_archive, archive.file, flash_offset)
+        elif video_files:
+            items = items_from_uploads(video_files, flash_offsets, flash_offset)
+        else:
+            raise BatchError("Send video_files or an archive")
+        if not items:
+            raise BatchError("Batch contains no videos")
+        if len(items) > config.BATCH_MAX_ITEMS:
+            raise BatchError(f"Batch exceeds {config.BATCH_MAX_ITEMS} items")
+    except BatchError as e:
+        return JSONResponse(status_code=400, content={"message": str(e)})
+
+    concurrency = min(concurrency or config.BATCH_DEFAULT_CONCURRENCY, config.BATCH_MAX_CONCURRENCY)
+    return StreamingResponse(stream_batch(items, engine_pool, concurrency, _probe_upload),
+                             media_type="application/x-ndjson")
+
+@app.websocket("/api/verify_liveness/stream")
+async def verify_liveness_stream(websocket: WebSocket):
+    """
+    Streaming verification for clients that send MediaRecorder chunks while recording.
+    Protocol: binary messages are WebM chunks; text messages are JSON control messages:
+      {"type": "flash", "flash_offset": <ms>}  once the red flash starts
+                                              (add "color": "green"/"blue" for the other flashes
+                                              to score the whole sequence)
+      {"type": "end"}                          after the last chunk
+    The server answers with one JSON verdict (same shape as /api/verify_liveness) and closes.
+    """
+    await websocket.accept()
+
+    # Counts sessions until their decode loop has returned, aborted ones included
+    if streaming.active_sessions() >= config.STREAM_MAX_SESSIONS:
+        metrics.REQUESTS.inc(endpoint="stream", outcome="busy")
+        await websocket.send_json({
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": "Server busy, please retry shortly."
+        })
+        await websocket.close(code=1013)  # Try Again Later
+        return
+
+    started = perf_counter()
+    verification = StreamingVerification()
+    try:
+        while True:
+            message = await asyncio.wait_for(websocket.receive(), timeout=config.STREAM_IDLE_TIMEOUT)
+            if message["type"] == "websocket.disconnect":
+                verification.abort()
+                return
+            if message.get("bytes"):
+                verification.feed(message["bytes"])
+                continue
+
+            control = json.loads(message.get("text") or "{}")
+            if control.get("type") == "flash":
+                verification.set_flash_offset(float(control["flash_offset"]), control.get("color", "red"))
+            elif control.get("type") == "end":
+                break
+
+        # Only the tail of the last chunk is left to analyze at this point
+        result = await run_in_threadpool(verification.finish, config.STREAM_FINISH_TIMEOUT)
+        metrics.record_result("stream", result, elapsed=perf_counter() - started)
+        await websocket.send_json(result)
+        await websocket.close()
+
+    except WebSocketDisconnect:
+        verification.abort()
+    except (asyncio.TimeoutError, StreamTooLarge, ValueError, KeyError) as e:
+        verification.abort()
+        message = "Stream timed out." if isinstance(e, asyncio.TimeoutError) else f"Invalid stream: {e}"
+        result = {
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": message
+        }
+        metrics.record_result("stream", result, elapsed=perf_counter() - started)
+        await websocket.send_json(result)
+        await websocket.close(code=1008)
+    finally:
+        # Whatever ended the handler, never leave the decoder waiting for chunks (no-op once finished)
+        verification.abort()
+
+@app.get("/api/health")
+async def health():
+    return {
+        "status": "ok",
+        "engine_mode": engine_pool.mode,
+        "engine_workers": engine_pool.workers,
+        "engine_pending": engine_pool.pending,
+        "engine_max_pending": engine_pool.max_pending,
+        "active_streams": streaming.active_sessions(),
+    }
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/ready")
+async def ready():
+    # Readiness probe: only route traffic here once every engine worker has warmed up
+    body = {"ready": engine_pool.ready, "engine_workers": engine_pool.workers}
+    if engine_pool.warmup_error:
+        body["error"] = engine_pool.warmup_error
+    return JSONResponse(status_code=200 if engine_pool.ready else 503, content=body)
 
 if __name__ == "__main__":
     import uvicorn
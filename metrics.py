@@ -0,0 +1,237 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+
+# Instrumentation.
+# StageTimer accumulates per-stage wall time and frame counts for one verification; the engine
+# fills it in the worker process and ships it back inside the result ("timings"), where the API
+# turns it into Prometheus metrics and a Server-Timing header. The registry below is a minimal
+# Prometheus text-format implementation, so no client library is needed.
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Result message prefix -> failure category. Verdicts that are simply negative are not failures.
+_FAILURE_MESSAGES = (
+    ("Video file not found", "file_not_found"),
+    ("Error opening video", "decode_error"),
+    ("Stream decode error", "decode_error"),
+    ("Face Detector Initialization Failed", "detector_unavailable"),
+    ("No frames processed", "no_frames"),
+    ("No frames found after flash offset", "no_post_flash_frames"),
+    ("Flash offset was never provided", "no_flash_offset"),
+    ("Timed out", "timeout"),
+    ("Stream timed out", "timeout"),
+    ("Invalid stream", "invalid_stream"),
+    ("Internal Server Error", "internal"),
+    ("Challenge rejected", "challenge_rejected"),
+)
+
+
+class StageTimer:
+    """Per-verification stage durations (seconds) and frame counters."""
+
+    def __init__(self):
+        self.stages = {}
+        self.frames = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, kind: str, n: int = 1):
+        self.frames[kind] = self.frames.get(kind, 0) + n
+
+    def merge(self, other: "StageTimer"):
+        """Adds the stages and counters of another timer (one a helper thread kept to itself)."""
+        for stage, seconds in other.stages.items():
+            self.add(stage, seconds)
+        for kind, n in other.frames.items():
+            self.count(kind, n)
+
+    def to_dict(self) -> dict:
+        return {
+            "stages_ms": {stage: round(seconds * 1000.0, 3) for stage, seconds in self.stages.items()},
+            "frames": dict(self.frames),
+        }
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value:g}" for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """Gauge read from a callback at scrape time (e.g. current queue depth)."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self._function = None
+
+    def set_function(self, function):
+        self._function = function
+
+    def _samples(self):
+        if self._function is None:
+            return []
+        return [f"{self.name} {float(self._function()):g}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts = entry[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _samples(self):
+        lines = []
+        for key, (counts, total, count) in self._values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', f'{bound:g}')])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total:g}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+REGISTRY = []
+
+REQUESTS = Counter("deepshield_requests_total", "Verifications by endpoint and outcome (verified/rejected/failed/busy)",
+                   ("endpoint", "outcome"))
+REQUEST_SECONDS = Histogram("deepshield_request_duration_seconds", "End-to-end verification time", ("endpoint",))
+STAGE_SECONDS = Histogram("deepshield_stage_duration_seconds", "Time per pipeline stage per verification", ("stage",))
+FRAMES = Counter("deepshield_frames_total", "Frames by what happened to them (decoded/analyzed/skipped/face_missed)",
+                 ("kind",))
+FAILURES = Counter("deepshield_failures_total", "Failed verifications by category", ("category",))
+ENGINE_PENDING = Gauge("deepshield_engine_pending", "Verifications admitted to the engine pool (running + queued)")
+ACTIVE_STREAMS = Gauge("deepshield_active_streams", "Open streaming verifications")
+RESULT_CACHE = Counter("deepshield_result_cache_total", "Result cache lookups by outcome (hit/miss/shared)",
+                       ("outcome",))
+REPEATED_UPLOADS = Counter("deepshield_repeated_uploads_total",
+                           "Byte-identical re-uploads that were not retries of the same Idempotency-Key")
+CHALLENGE_SESSIONS = Gauge("deepshield_challenge_sessions", "Issued challenges not yet answered or expired")
+JOBS_QUEUED = Gauge("deepshield_jobs_queued", "Asynchronous jobs waiting for a worker")
+CAPTURE = Counter("deepshield_capture_total",
+                  "Dataset capture records by outcome (queued/written/skipped/dropped_queue_full/dropped_error)",
+                  ("outcome",))
+CAPTURE_QUEUED = Gauge("deepshield_capture_queued", "Dataset capture records waiting to be written")
+AUDIT_LOG = Counter("deepshield_audit_log_total",
+                    "Audit log records by outcome (queued/written/dropped_queue_full/dropped_error), and rotations",
+                    ("outcome",))
+AUDIT_LOG_QUEUED = Gauge("deepshield_audit_log_queued", "Audit log records waiting to be written")
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def failure_category(result: dict, frames: dict = None):
+    """Failure category for a result, or None for a normal (verified or rejected) verdict."""
+    message = result.get("message", "")
+    for prefix, category in _FAILURE_MESSAGES:
+        if message.startswith(prefix):
+            return category
+    frames = frames or {}
+    analyzed = frames.get("analyzed", 0)
+    if analyzed and frames.get("face_missed", 0) >= analyzed:
+        return "face_not_found"
+    return None
+
+
+def record_result(endpoint: str, result: dict, stages_ms: dict = None, elapsed: float = None) -> dict:
+    """
+    Pops the engine timings off a result and records them. Extra API-side stages (upload,
+    queue, ...) are merged in. Returns all stage durations in ms, for Server-Timing.
+    """
+    timings = result.pop("timings", None) or {}
+    stages = dict(timings.get("stages_ms", {}))
+    stages.update(stages_ms or {})
+    frames = timings.get("frames", {})
+
+    for stage, ms in stages.items():
+        STAGE_SECONDS.observe(ms / 1000.0, stage=stage)
+    for kind, n in frames.items():
+        FRAMES.inc(n, kind=kind)
+
+    category = failure_category(result, frames)
+    if category is not None:
+        FAILURES.inc(category=category)
+        outcome = "failed"
+    else:
+        outcome = "verified" if result.get("is_liveness_verified") else "rejected"
+    REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    if elapsed is not None:
+        REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    return stages
+
+
+def server_timing(stages_ms: dict) -> str:
+    return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in stages_ms.items())
+
+
+def profiled_call(top: int, dump_dir: str, fn, *args):
+    """Runs fn(*args) under cProfile (in the engine worker) and attaches the hottest functions."""
+    profiler = cProfile.Profile()
+    result = profiler.runcall(fn, *args)
+    if dump_dir:
+        os.makedirs(dump_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(dump_dir, f"verify-{time.time_ns()}-{os.getpid()}.prof"))
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(top)
+    result["profile"] = stream.getvalue()
+    return result
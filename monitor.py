@@ -1,148 +1,117 @@
-import cv2
-import numpy as np
-import matplotlib
-matplotlib.use('TkAgg') # Use TkAgg for window display if possible, or swap to Agg if needed
-import matplotlib.pyplot as plt
-from scipy.signal import find_peaks, square
 import sys
 
-# Redirect stdout and stderr to file with UTF-8 encoding and line buffering
-log_file = open("monitor_log.txt", "w", encoding="utf-8", buffering=1)
-sys.stdout = log_file
-sys.stderr = log_file
-
-def analyze_liveness(video_path):
-    print("DEBUG: Analysis started (Cross-Correlation Method)")
-    
-    # 1. Signal Extraction
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error: Could not open video file {video_path}")
-        return
-
-    raw_intensities = []
-    frame_count = 0
+import numpy as np
+from scipy.signal import find_peaks
 
-    print("Processing video frames...")
-    while True:
-        ret, frame = cap.read()
-        if not ret: break
+from correlation import ReferenceBank, square_wave
+from signals import extract_trace
 
-        height, width, _ = frame.shape
-        cx, cy = width // 2, height // 2
-        # 50x50 ROI
-        roi = frame[cy-25:cy+25, cx-25:cx+25]
-        
-        if roi.size == 0: continue
+# Cross-correlation liveness check.
+# The screen flashes a periodic pattern; a live face's green channel (50x50 center ROI) follows it.
+# The flash period is estimated from the signal's peaks and the normalized signal is correlated
+# (by FFT, see correlation.py) with a square wave of that period. Headless: analyze_liveness()
+# returns the verdict as a dict, plot_liveness() draws it on a matplotlib Figure when asked.
+# Run it over files and folders with analyze.py (--analyses correlation).
 
-        # Green channel average
-        avg_green = np.mean(roi[:, :, 1])
-        raw_intensities.append(avg_green)
-        frame_count += 1
+MIN_CORRELATION = 0.5
 
-    cap.release()
-    print(f"Finished processing {frame_count} frames.")
 
-    if not raw_intensities:
-        print("No frames processed.")
-        return
+def _correlate(trace) -> dict:
+    """Verdict plus the signals behind it (for plotting); the verdict alone is analyze_liveness()."""
+    if len(trace) == 0:
+        return {"is_live": False, "message": "No frames processed."}
 
-    # Convert to array
-    signal = np.array(raw_intensities)
+    # Green channel average per frame
+    signal = trace.channel("center", "g").astype(np.float64)
 
     # Normalize Signal (0 to 1)
     if np.max(signal) - np.min(signal) == 0:
-        print("Error: Signal is flat (no variation).")
-        return
-    
+        return {"is_live": False, "message": "Signal is flat (no variation)."}
     norm_signal = (signal - np.min(signal)) / (np.max(signal) - np.min(signal))
 
     # 2. Frequency Estimation (The "Ground Truth" Period)
     # Find peaks to estimate period
-    peaks, _ = find_peaks(norm_signal, prominence=0.2, distance=10) # Prominence 0.2 on normalized signal
-    
+    peaks, _ = find_peaks(norm_signal, prominence=0.2, distance=10)  # Prominence 0.2 on normalized signal
     if len(peaks) < 2:
-        print("❌ FAILED: Not enough peaks to estimate frequency. (Static or erratic lighting)")
-        return
+        return {"is_live": False, "peaks": int(len(peaks)),
+                "message": "Not enough peaks to estimate frequency (static or erratic lighting)."}
 
     # Average distance between peaks = Period (in frames)
-    peak_diffs = np.diff(peaks)
-    avg_period = np.mean(peak_diffs)
-    print(f"Estimated Flash Period: {avg_period:.2f} frames")
+    avg_period = float(np.mean(np.diff(peaks)))
 
     # 3. Reference Signal Creation
-    # Create a synthetic square wave with the estimated period
-    # We create it for the same duration as the video
-    t = np.arange(len(norm_signal))
-    # 2*pi*f*t -> f = 1/period
-    ref_signal = 0.5 * (square(2 * np.pi * (1/avg_period) * t) + 1) # Shift to 0-1 range
-
-    # 4. The Physics Test (Cross-Correlation)
-    # Center signals around 0 for correlation
-    sig_centered = norm_signal - np.mean(norm_signal)
-    ref_centered = ref_signal - np.mean(ref_signal)
-
-    # Compute Cross-Correlation
-    correlation = np.correlate(sig_centered, ref_centered, mode='full')
-    
-    # Normalize Correlation Coefficient (-1 to 1)
-    # Coeff = dot(a,b) / (norm(a) * norm(b))
-    norm_factor = np.sqrt(np.sum(sig_centered**2) * np.sum(ref_centered**2))
-    if norm_factor == 0:
-        max_corr = 0
-    else:
-        max_corr = np.max(correlation) / norm_factor
+    # Create a synthetic square wave with the estimated period, for the same duration as the video
+    ref_signal = square_wave(len(norm_signal), avg_period)  # 0-1 range
 
-    # Lag/Shift calculation (Index of max correlation)
-    lag_index = np.argmax(correlation) - (len(norm_signal) - 1)
-    
-    # Create Aligned Reference for Plotting
-    # We shift the reference signal by 'lag_index' to visually match the face signal
-    aligned_ref = np.roll(ref_signal, lag_index)
+    # 4. The Physics Test (Cross-Correlation, by FFT; see correlation.py)
+    # Normalized Correlation Coefficient (-1 to 1) at every lag: dot(a,b) / (norm(a) * norm(b))
+    correlation = ReferenceBank([ref_signal]).correlate(norm_signal)[0]
+    max_corr = float(np.max(correlation))
 
-    print("-" * 30)
-    print(f"Max Correlation Coefficient: {max_corr:.4f}")
-    print(f"Optimal Lag: {lag_index} frames")
-    print("-" * 30)
+    # Lag/Shift calculation (Index of max correlation)
+    lag_index = int(np.argmax(correlation) - (len(norm_signal) - 1))
 
     # 5. Final Verdict
-    if max_corr > 0.5:
-        print(f"✅ LIVENESS CONFIRMED: High Correlation Detected (Score: {max_corr:.2f})")
-    else:
-        print("❌ SPOOF DETECTED: Signal does not match Screen Pattern")
-
-    # 6. Plotting
-    try:
-        plt.figure(figsize=(12, 6))
-        
-        plt.subplot(2, 1, 1)
-        plt.plot(t, norm_signal, 'b-', label='Normalized Face Signal (Green Ch)')
-        plt.plot(t, aligned_ref, 'orange', linestyle='--', label='Aligned Synthetic Reference')
-        plt.title(f'Liveness Check: Correlation Score {max_corr:.2f}')
-        plt.legend(loc='upper right')
-        plt.grid(True)
-        
-        plt.subplot(2, 1, 2)
-        lags = np.arange(-len(norm_signal) + 1, len(norm_signal))
-        plt.plot(lags, correlation / norm_factor, 'k-', label='Cross-Correlation')
-        plt.title('Cross-Correlation vs Lag')
-        plt.xlabel('Lag (Frames)')
-        plt.ylabel('Correlation Coeff')
-        plt.grid(True)
-        plt.tight_layout()
-
-        print("Saving plot to 'result_plot.png'...")
-        plt.savefig('result_plot.png')
-        print("Attempting to show plot...")
-        plt.show()
-        print("Plot window closed.")
-    except Exception as e:
-        print(f"Plotting failed: {e}")
+    is_live = max_corr > MIN_CORRELATION
+    return {
+        "is_live": is_live,
+        "max_correlation": max_corr,
+        "lag_frames": lag_index,
+        "period_frames": avg_period,
+        "peaks": int(len(peaks)),
+        "message": "Liveness confirmed: signal follows the screen pattern" if is_live
+        else "Spoof detected: signal does not match the screen pattern",
+        "signal": norm_signal,
+        "reference": ref_signal,
+        "correlation": correlation,
+    }
+
+
+def analyze_liveness(video_path=None, trace=None) -> dict:
+    """
+    trace: an already-extracted signals.Trace with the "center" ROI (e.g. shared with
+    secure_monitor / physics_engine.score_trace); the video is only decoded when it is None.
+    """
+    if trace is None:
+        # 1. Signal Extraction (50x50 center ROI, one decode, float32 trace)
+        trace = extract_trace(video_path, rois=("center",))
+        if trace is None:
+            return {"is_live": False, "message": f"Could not open video file {video_path}"}
+    result = _correlate(trace)
+    result["frames"] = len(trace)
+    for key in ("signal", "reference", "correlation"):
+        result.pop(key, None)
+    return result
+
+
+def plot_liveness(figure, trace):
+    """Draws the face signal against the aligned reference, and correlation vs lag, on a Figure."""
+    result = _correlate(trace)
+    if "correlation" not in result:
+        figure.suptitle(f"Correlation check: {result['message']}")
+        return
+    signal = result["signal"]
+    # Shift the reference by the best lag to visually match the face signal
+    aligned_ref = np.roll(result["reference"], result["lag_frames"])
+
+    top = figure.add_subplot(2, 1, 1)
+    top.plot(np.arange(len(signal)), signal, 'b-', label='Normalized Face Signal (Green Ch)')
+    top.plot(np.arange(len(signal)), aligned_ref, 'orange', linestyle='--', label='Aligned Synthetic Reference')
+    top.set_title(f"Liveness Check: Correlation Score {result['max_correlation']:.2f}")
+    top.legend(loc='upper right')
+    top.grid(True)
+
+    bottom = figure.add_subplot(2, 1, 2)
+    lags = np.arange(-len(signal) + 1, len(signal))
+    bottom.plot(lags, result["correlation"], 'k-', label='Cross-Correlation')
+    bottom.set_title('Cross-Correlation vs Lag')
+    bottom.set_xlabel('Lag (Frames)')
+    bottom.set_ylabel('Correlation Coeff')
+    bottom.grid(True)
+    figure.tight_layout()
+
 
 if __name__ == "__main__":
-    try:
-        analyze_liveness('experiment.mp4')
-    except Exception as e:
-        print(f"CRITICAL ERROR: {e}")
-    finally:
-        log_file.close() # Ensure file is saved
+    # Former standalone script; same as: python analyze.py --analyses correlation <videos>
+    import analyze
+    sys.exit(analyze.main(["--analyses", "correlation"] + (sys.argv[1:] or ["experiment.mp4"])))
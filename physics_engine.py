@@ -1,13 +1,83 @@
 import cv2
+import json
 import numpy as np
 import os
+import time
+from time import perf_counter
+import config
+from detectors import get_detector, DetectorUnavailable
+from ingest import open_video
+from metrics import StageTimer
+from pipeline import run_pipeline
+from signals import CHANNELS, RoiSampler, Trace
+from trace_store import record_session
+from tracking import FaceTracker, FrameClock
 
-def analyze_video_challenge(video_path: str, flash_start_time_offset: float) -> dict:
+# Verification conditions (Robust defaults for living tissue response to flash)
+DELTA_THRESHOLD = config.DELTA_THRESHOLD  # Minimum recognizable increase in red intensity (default 3.0)
+MAX_LATENCY_MS = config.MAX_LATENCY_MS  # Maximum acceptable physiological and network delay in ms (default 1200)
+
+# Challenge colors -> trace channel scored for them (the client flashes pure red / green / blue)
+FLASH_COLORS = {"red": "r", "green": "g", "blue": "b"}
+MAX_FLASHES = 16
+
+
+def parse_flash_schedule(schedule) -> list:
+    """
+    Normalizes a flash schedule to [(color, offset_ms), ...] in flash order. Accepts JSON text or a
+    list of {"color": ..., "offset": ...} objects or [color, offset] pairs. Raises ValueError.
+    """
+    if isinstance(schedule, (str, bytes)):
+        schedule = json.loads(schedule)
+    if not isinstance(schedule, (list, tuple)):
+        raise ValueError("Flash schedule must be a list of flashes")
+    if not schedule:
+        raise ValueError("Flash schedule is empty")
+    if len(schedule) > MAX_FLASHES:
+        raise ValueError(f"Flash schedule exceeds {MAX_FLASHES} flashes")
+
+    flashes = []
+    for entry in schedule:
+        if isinstance(entry, dict):
+            color, offset = entry.get("color"), entry.get("offset", entry.get("flash_offset"))
+        else:
+            color, offset = entry
+        color = str(color).lower()
+        if color not in FLASH_COLORS:
+            raise ValueError(f"Unknown flash color '{color}' (choose from {', '.join(FLASH_COLORS)})")
+        if offset is None:
+            raise ValueError(f"Flash '{color}' has no offset")
+        flashes.append((color, float(offset)))
+    return sorted(flashes, key=lambda flash: flash[1])
+
+
+def analyze_video_challenge(video, flash_start_time_offset: float = None, roi_mode: str = None,
+                            detect_width: int = None, scale_factor: float = None,
+                            early_exit: bool = None, flash_schedule=None, template=None,
+                            deadline: float = None, record: bool = True) -> dict:
     """
     Headless Physics Engine for Liveness Detection (Phase 3).
-    Extracts Forehead ROI using Haar Cascades, calculates the Dynamic Baseline, Red Peak, Delta, and Latency.
+    Extracts Forehead ROI using the configured face detector (Haar / LBP / DNN), calculates the Dynamic Baseline, Red Peak, Delta, and Latency.
+    video is a file path or the raw upload bytes (decoded from memory, see ingest.py).
+    roi_mode selects per-frame detection ("detect") or detect-once-then-track ("track");
+    detect_width / scale_factor set the detection resolution and pyramid step. All default to config.
+
+    With DEEPSHIELD_BASELINE_WINDOW_MS set, frames before the baseline window are only grabbed (never
+    retrieved or searched); with DEEPSHIELD_STOP_AFTER_LATENCY_WINDOW decoding stops once max_latency
+    after the flash has passed. Both are off by default as they can change verdicts. early_exit stops
+    at the first frame that clears the delta threshold (delta / latency then describe that frame
+    rather than the true peak).
+
+    flash_schedule ([(color, offset_ms), ...], see parse_flash_schedule) scores every flash of the
+    challenge from the same decode instead of only the red one; flash_start_time_offset is then unused.
+    template (challenges.ChallengeTemplate of a server-issued challenge) also correlates the recording
+    with the challenge's reference waveform.
+    deadline (time.time() epoch seconds) stops the analysis between frames once passed and returns a
+    "Timed out" result instead of a verdict.
+    record=False keeps the run out of DEEPSHIELD_TRACE_STORE (warm-ups and other runs that are not
+    real sessions, which would otherwise end up in rescore.py's ROC/DET numbers).
     """
-    if not os.path.exists(video_path):
+    if isinstance(video, str) and not os.path.exists(video):
         return {
             "is_liveness_verified": False,
             "latency_ms": 0.0,
@@ -15,77 +85,307 @@ def analyze_video_challenge(video_path: str, flash_start_time_offset: float) ->
             "message": "Video file not found."
         }
 
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        return {
-            "is_liveness_verified": False,
-            "latency_ms": 0.0,
-            "delta": 0.0,
-            "message": "Error opening video file."
-        }
-        
-    # Get FPS to calculate accurate timestamps if CAP_PROP_POS_MSEC fails
-    fps = cap.get(cv2.CAP_PROP_FPS)
-    if fps == 0 or np.isnan(fps):
-        fps = 30.0
-
-    # Load Haar cascade for frontal face
+    timer = StageTimer()
+    start = perf_counter()
+    cap, ingest_path, cleanup = open_video(video)
+    timer.add("open", perf_counter() - start)
     try:
-        cascade_path = cv2.data.haarcascades + 'haarcascade_frontalface_default.xml'
-        face_cascade = cv2.CascadeClassifier(cascade_path)
-    except AttributeError:
-        face_cascade = cv2.CascadeClassifier('haarcascade_frontalface_default.xml')
+        if cap is None or not cap.isOpened():
+            result = {
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": "Error opening video file.",
+            }
+        else:
+            result = _analyze_capture(cap, flash_start_time_offset, roi_mode, detect_width, scale_factor,
+                                      early_exit, timer, flash_schedule, template, deadline,
+                                      source=video if isinstance(video, str) else None, record=record)
+    finally:
+        if cap is not None:
+            cap.release()
+        cleanup()
+
+    result["ingest"] = ingest_path
+    timer.add("engine", perf_counter() - start)
+    result["timings"] = timer.to_dict()
+    return result
+
+
+class LivenessSession:
+    """
+    Incremental physics engine: push decoded frames one at a time and read the verdict at any point.
+    Keeps a running baseline (frames in the baseline window before the flash) and a running red peak
+    (frames within max latency after it). The flash offset may arrive after the first frames
+    (streaming clients only learn it once the red flash starts).
+    With a flash schedule every flash is scored on its own channel at result() time (no early exit).
+    Used by the one-shot path (_analyze_capture) and by streaming verification.
+    """
+
+    def __init__(self, flash_start_time_offset: float = None, roi_mode: str = None, detect_width: int = None,
+                 scale_factor: float = None, early_exit: bool = None, detector=None, timer: StageTimer = None,
+                 flash_schedule=None, template=None):
+        # Face detector is loaded once per worker thread by the registry (Haar / LBP / DNN per config)
+        detector = detector or get_detector()
+        # Per-stage durations and frame counts, reported with the result as "timings"
+        self.timer = timer or StageTimer()
+        self.tracker = FaceTracker(detector, mode=roi_mode or config.ROI_MODE,
+                                   detect_width=detect_width, scale_factor=scale_factor, timer=self.timer)
+        self.early_exit = config.EARLY_EXIT if early_exit is None else early_exit
+
+        # Forehead B/G/R means per analyzed frame (float32, see signals.py)
+        self.trace = Trace(("forehead",))
+        self.sampler = RoiSampler(self.trace.rois, self.tracker, self.timer)
+        self.skipped_frames = 0
+        self.early_exit_hit = False
+
+        self.flash_offset = None
+        self.schedule = None
+        self.template = template
+        self.window_start_ms = float("-inf")
+        self.window_end_ms = float("inf")
+        if flash_schedule is not None:
+            self.set_flash_schedule(flash_schedule)
+        elif flash_start_time_offset is not None:
+            self.set_flash_offset(flash_start_time_offset)
 
-    if face_cascade.empty():
-        cap.release()
+    def set_flash_schedule(self, flash_schedule):
+        """Scores every flash of [(color, offset_ms), ...]; the window spans first flash to last."""
+        self.schedule = parse_flash_schedule(flash_schedule)
+        offsets = [offset for _, offset in self.schedule]
+        self.set_flash_offset(offsets[0])
+        self.window_start_ms, self.window_end_ms = _analysis_window(offsets[0], offsets[-1])
+
+    def set_flash_offset(self, flash_start_time_offset: float):
+        self.flash_offset = float(flash_start_time_offset)
+        self.window_start_ms, self.window_end_ms = _analysis_window(self.flash_offset)
+
+        self._baseline_sum = 0.0
+        self._baseline_count = 0
+        self.peak_red = None
+        self.peak_timestamp_ms = None
+        for red_val, timestamp in zip(self.red_values().tolist(), self.trace.timestamps.tolist()):
+            self._update_running(red_val, timestamp)
+
+    def red_values(self):
+        # Frames without a face count as 0 red, as the engine always has
+        return np.nan_to_num(self.trace.channel("forehead", "r"), nan=0.0)
+
+    @property
+    def baseline(self):
+        if self.flash_offset is None or self._baseline_count == 0:
+            return None
+        return self._baseline_sum / self._baseline_count
+
+    def wants(self, timestamp_ms: float) -> bool:
+        """False for frames before the baseline window: grab them, but don't retrieve or analyze."""
+        return timestamp_ms >= self.window_start_ms
+
+    def past_window(self, timestamp_ms: float) -> bool:
+        return timestamp_ms > self.window_end_ms
+
+    @property
+    def done(self) -> bool:
+        return self.early_exit_hit or bool(len(self.trace) and self.past_window(self.trace.timestamps[-1]))
+
+    def skip_frame(self, n: int = 1):
+        self.skipped_frames += n
+        self.timer.count("skipped", n)
+
+    def push_frame(self, frame, timestamp_ms: float):
+        # Face Detection (full or tracked, depending on roi_mode) and forehead means via cv2.mean
+        index = self.trace.append(timestamp_ms)
+        face = self.sampler.sample(frame, self.trace, index)
+        self._sampled(index, timestamp_ms, face)
+
+    def push_sample(self, timestamp_ms: float, means, face):
+        """Adds a frame sampled elsewhere (pipeline.py): means is its (rois, 3) B/G/R row."""
+        index = self.trace.append(timestamp_ms)
+        self.trace.row(index)[:] = means
+        self._sampled(index, timestamp_ms, face)
+
+    def _sampled(self, index: int, timestamp_ms: float, face):
+        self.timer.count("analyzed")
+        if face is None:
+            self.timer.count("face_missed")
+
+        # Mean red intensity (OpenCV uses BGR format, so Red is index 2)
+        red_val = float(self.trace.row(index)[0, 2])
+        if np.isnan(red_val):
+            red_val = 0.0
+        if self.flash_offset is not None:
+            self._update_running(red_val, timestamp_ms)
+
+    def _update_running(self, red_val: float, timestamp_ms: float):
+        if timestamp_ms < self.flash_offset:
+            if timestamp_ms >= self.window_start_ms:
+                self._baseline_sum += red_val
+                self._baseline_count += 1
+            return
+
+        latency = timestamp_ms - self.flash_offset
+        if latency > MAX_LATENCY_MS:
+            return
+        if self.peak_red is None or red_val > self.peak_red:
+            self.peak_red = red_val
+            self.peak_timestamp_ms = timestamp_ms
+
+        # Early exit: the verdict is settled once a post-flash frame clears the threshold
+        # (single red flash only; a schedule needs every window)
+        baseline = self.baseline
+        if self.early_exit and self.schedule is None and baseline is not None and red_val - baseline > DELTA_THRESHOLD:
+            self.early_exit_hit = True
+
+    def result(self) -> dict:
+        start = perf_counter()
+        if self.flash_offset is None:
+            result = {
+                "is_liveness_verified": False,
+                "latency_ms": 0.0,
+                "delta": 0.0,
+                "message": "Flash offset was never provided."
+            }
+        elif self.schedule is not None:
+            result = _score_schedule(np.nan_to_num(self.trace.means("forehead"), nan=0.0), self.trace.timestamps,
+                                     self.schedule, self.window_start_ms, self.template)
+        else:
+            result = _score(self.red_values(), self.trace.timestamps,
+                            self.flash_offset, self.window_start_ms, self.window_end_ms)
+        result.update({
+            "roi_mode": self.tracker.mode,
+            "full_detection_frames": self.tracker.full_detection_frames,
+            "tracked_frames": self.tracker.tracked_frames,
+            "analyzed_frames": len(self.trace),
+            "skipped_frames": self.skipped_frames,
+            "early_exit": self.early_exit_hit
+        })
+        self.timer.add("score", perf_counter() - start)
+        return result
+
+
+def _analysis_window(flash_offset: float, last_flash_offset: float = None):
+    # Only frames inside [flash - baseline window, (last) flash + max latency] can affect the verdict
+    baseline_window = config.BASELINE_WINDOW_MS
+    last_flash_offset = flash_offset if last_flash_offset is None else last_flash_offset
+    window_start_ms = flash_offset - baseline_window if baseline_window > 0 else float("-inf")
+    window_end_ms = last_flash_offset + MAX_LATENCY_MS if config.STOP_AFTER_LATENCY_WINDOW else float("inf")
+    return window_start_ms, window_end_ms
+
+
+def score_trace(trace, flash_start_time_offset: float, roi: str = "forehead") -> dict:
+    """
+    Verdict from an already-extracted trace (signals.extract_trace) without decoding again,
+    e.g. when the same recording also goes through monitor.py / secure_monitor.py.
+    """
+    offset = float(flash_start_time_offset)
+    window_start_ms, window_end_ms = _analysis_window(offset)
+    red_arr = np.nan_to_num(trace.channel(roi, "r"), nan=0.0)
+    return _score(red_arr, trace.timestamps, offset, window_start_ms, window_end_ms)
+
+
+def score_schedule(trace, flash_schedule, roi: str = "forehead", template=None) -> dict:
+    """Per-flash and combined verdict for a whole flash schedule from an already-extracted trace."""
+    schedule = parse_flash_schedule(flash_schedule)
+    window_start_ms, _ = _analysis_window(schedule[0][1])
+    return _score_schedule(np.nan_to_num(trace.means(roi), nan=0.0), trace.timestamps, schedule, window_start_ms,
+                           template)
+
+
+def _score_schedule(bgr_arr, time_arr, schedule, window_start_ms: float = float("-inf"), template=None) -> dict:
+    """
+    Baseline / peak / delta / latency for every flash of a schedule, each on its own color channel,
+    in one vectorized pass over a (frames, 3) B/G/R trace. Timestamps are increasing (FrameClock),
+    so every flash window is a pair of searchsorted indices rather than a scan of the trace.
+    The combined verdict needs every flash verified; delta / latency_ms report the weakest flash.
+    With a challenge template the recording's correlation with the reference waveform is added
+    (and must reach DEEPSHIELD_CHALLENGE_MIN_CORRELATION when that is set).
+    """
+    frame_count = len(time_arr)
+    if frame_count == 0:
         return {
             "is_liveness_verified": False,
             "latency_ms": 0.0,
             "delta": 0.0,
-            "message": "Face Detector Initialization Failed"
+            "message": "No frames processed."
         }
 
-    red_intensities = []
-    timestamps_ms = []
-    frame_count = 0
+    colors = [color for color, _ in schedule]
+    offsets = np.array([offset for _, offset in schedule], dtype=np.float64)
+    channels = [CHANNELS[FLASH_COLORS[color]] for color in colors]
+    times = np.asarray(time_arr, dtype=np.float64)
+    # (flashes, frames): the channel each flash is scored on
+    values = np.asarray(bgr_arr, dtype=np.float64)[:, channels].T
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-            
-        current_time_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
-        if current_time_ms == 0 and frame_count > 0:
-            current_time_ms = (frame_count / fps) * 1000.0
-
-        # Face Detection
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(50, 50))
-        
-        red_val = 0.0
-        if len(faces) > 0:
-            # Sort by area to get the largest face
-            faces = sorted(faces, key=lambda f: f[2]*f[3], reverse=True)
-            x, y, w, h = faces[0]
-            
-            # Extract Forehead ROI (top 30% of the face box, center 60% horizontally to avoid hair/background)
-            fh_y = y
-            fh_h = int(h * 0.3)
-            fh_x = x + int(w * 0.2)
-            fh_w = int(w * 0.6)
-            
-            roi = frame[fh_y:fh_y+fh_h, fh_x:fh_x+fh_w]
-            if roi.size > 0:
-                # Mean red intensity (OpenCV uses BGR format, so Red is index 2)
-                red_val = np.mean(roi[:, :, 2])
-        
-        red_intensities.append(red_val)
-        timestamps_ms.append(current_time_ms)
-        frame_count += 1
-        
-    cap.release()
-    
-    if len(red_intensities) == 0:
+    # 1. Dynamic Baseline per channel, from the frames before the first flash (later flashes would
+    #    otherwise count the earlier colors' responses into their baseline)
+    pre_start = np.searchsorted(times, window_start_ms, side="left")
+    pre_end = np.searchsorted(times, offsets[0], side="left")
+    if pre_end > pre_start:
+        baselines = values[:, pre_start:pre_end].mean(axis=1)
+    else:
+        baselines = values[:, :max(1, frame_count // 10)].mean(axis=1)
+
+    # 2. Peak per flash within [flash, flash + max latency]
+    starts = np.searchsorted(times, offsets, side="left")
+    if config.STOP_AFTER_LATENCY_WINDOW:
+        ends = np.searchsorted(times, offsets + MAX_LATENCY_MS, side="right")
+    else:
+        ends = np.full(len(offsets), frame_count)
+    index = np.arange(frame_count)
+    in_window = (index >= starts[:, None]) & (index < ends[:, None])
+    peak_idx = np.argmax(np.where(in_window, values, -np.inf), axis=1)
+    has_frames = ends > starts
+
+    # 3. Delta and 4. Latency per flash
+    rows = np.arange(len(offsets))
+    peaks = values[rows, peak_idx]
+    deltas = np.where(has_frames, peaks - baselines, 0.0)
+    latencies = np.where(has_frames, times[peak_idx] - offsets, 0.0)
+    verified = has_frames & (deltas > DELTA_THRESHOLD) & (latencies >= 0) & (latencies <= MAX_LATENCY_MS)
+
+    flashes = [{
+        "color": colors[i],
+        "offset_ms": float(offsets[i]),
+        "baseline": float(baselines[i]),
+        "peak": float(peaks[i]) if has_frames[i] else None,
+        "delta": float(deltas[i]),
+        "latency_ms": float(latencies[i]),
+        "is_verified": bool(verified[i]),
+    } for i in range(len(offsets))]
+
+    weakest = int(np.argmin(np.where(has_frames, deltas, -np.inf)))
+    is_liveness_verified = bool(verified.all())
+    if not has_frames.all():
+        missing = ", ".join(colors[i] for i in np.flatnonzero(~has_frames))
+        message = f"No frames found after flash offset ({missing})."
+    elif is_liveness_verified:
+        message = "Liveness Verified"
+    else:
+        failed = ", ".join(colors[i] for i in np.flatnonzero(~verified))
+        message = f"Spoof Detected or No Flash Response ({failed})"
+
+    result = {
+        "is_liveness_verified": is_liveness_verified,
+        "latency_ms": float(latencies[weakest]),
+        "delta": float(deltas[weakest]),
+        "message": message,
+        "flashes": flashes
+    }
+
+    if template is not None:
+        match = template.match(bgr_arr, times, offsets[0])
+        result["template_correlation"] = match
+        min_correlation = config.CHALLENGE_MIN_CORRELATION
+        if is_liveness_verified and min_correlation > 0 and match["coefficient"] < min_correlation:
+            result["is_liveness_verified"] = False
+            result["message"] = "Spoof Detected: recording does not follow the challenge"
+    return result
+
+
+def _score(red_arr, time_arr, flash_start_time_offset: float, window_start_ms: float = float("-inf"),
+           window_end_ms: float = float("inf")) -> dict:
+    """Baseline / peak / delta / latency verdict over an extracted red trace."""
+    if len(red_arr) == 0:
         return {
             "is_liveness_verified": False,
             "latency_ms": 0.0,
@@ -93,11 +393,8 @@ def analyze_video_challenge(video_path: str, flash_start_time_offset: float) ->
             "message": "No frames processed."
         }
 
-    red_arr = np.array(red_intensities)
-    time_arr = np.array(timestamps_ms)
-    
     # 1. Dynamic Baseline Calculation (Average red intensity BEFORE flash)
-    pre_flash_mask = time_arr < flash_start_time_offset
+    pre_flash_mask = (time_arr < flash_start_time_offset) & (time_arr >= window_start_ms)
     if np.any(pre_flash_mask):
         dynamic_baseline = np.mean(red_arr[pre_flash_mask])
     else:
@@ -105,7 +402,7 @@ def analyze_video_challenge(video_path: str, flash_start_time_offset: float) ->
         dynamic_baseline = np.mean(red_arr[:max(1, len(red_arr)//10)])
         
     # 2. Red Peak Calculation (Max red intensity AFTER flash)
-    post_flash_mask = time_arr >= flash_start_time_offset
+    post_flash_mask = (time_arr >= flash_start_time_offset) & (time_arr <= window_end_ms)
     if not np.any(post_flash_mask):
         return {
             "is_liveness_verified": False,
@@ -127,11 +424,7 @@ def analyze_video_challenge(video_path: str, flash_start_time_offset: float) ->
     # 4. Latency Calculation (Time between flash start and peak response)
     latency_ms = peak_timestamp - flash_start_time_offset
     
-    # Verification conditions (Robust defaults for living tissue response to flash)
-    delta_threshold = 3.0 # Minimum recognizable increase in red intensity
-    max_latency = 1200.0  # Maximum acceptable physiological and network delay in milliseconds
-    
-    is_liveness_verified = bool((delta > delta_threshold) and (0 <= latency_ms <= max_latency))
+    is_liveness_verified = bool((delta > DELTA_THRESHOLD) and (0 <= latency_ms <= MAX_LATENCY_MS))
     
     message = "Liveness Verified" if is_liveness_verified else "Spoof Detected or No Flash Response"
 
@@ -142,6 +435,85 @@ def analyze_video_challenge(video_path: str, flash_start_time_offset: float) ->
         "message": message
     }
 
+
+def _analyze_capture(cap, flash_start_time_offset: float, roi_mode: str = None, detect_width: int = None,
+                     scale_factor: float = None, early_exit: bool = None, timer: StageTimer = None,
+                     flash_schedule=None, template=None, deadline: float = None, source: str = None,
+                     record: bool = True) -> dict:
+    """
+    Runs the engine over an opened capture. The caller owns (and releases) cap.
+    source (the video path, if any) is only recorded with the trace (DEEPSHIELD_TRACE_STORE, unless
+    record is False).
+    """
+    # Get FPS to calculate accurate timestamps if CAP_PROP_POS_MSEC fails
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    if fps == 0 or np.isnan(fps):
+        fps = 30.0
+
+    try:
+        session = LivenessSession(flash_start_time_offset, roi_mode=roi_mode, detect_width=detect_width,
+                                  scale_factor=scale_factor, early_exit=early_exit, timer=timer,
+                                  flash_schedule=flash_schedule, template=template)
+    except DetectorUnavailable:
+        return {
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": "Face Detector Initialization Failed"
+        }
+
+    clock = FrameClock(fps)
+    timed_out = run_pipeline(cap, session, clock, deadline) if config.PIPELINE else None
+    if timed_out is None:
+        timed_out = _decode_frames(cap, session, clock, deadline)
+    cap.release()
+
+    result = session.result()
+    if timed_out:
+        result.update({
+            "is_liveness_verified": False,
+            "message": "Timed out: analysis deadline exceeded."
+        })
+        return result
+    result["repaired_timestamps"] = clock.repaired
+    if record:
+        record_session(session, result, source)
+    return result
+
+
+def _decode_frames(cap, session: LivenessSession, clock: FrameClock, deadline: float = None) -> bool:
+    """Sequential decode loop (see pipeline.py for the overlapped one). True if the deadline passed."""
+    timer = session.timer
+    while True:
+        if deadline is not None and time.time() > deadline:
+            return True
+
+        # grab() demuxes/decodes without the costly retrieve (colour conversion + copy)
+        start = perf_counter()
+        grabbed = cap.grab()
+        timer.add("decode", perf_counter() - start)
+        if not grabbed:
+            break
+        timer.count("decoded")
+
+        current_time_ms = clock.next(cap)
+        if session.past_window(current_time_ms):
+            break
+        if not session.wants(current_time_ms):
+            session.skip_frame()
+            continue
+
+        start = perf_counter()
+        ret, frame = cap.retrieve()
+        timer.add("decode", perf_counter() - start)
+        if not ret:
+            break
+
+        session.push_frame(frame, current_time_ms)
+        if session.early_exit_hit:
+            break
+    return False
+
 if __name__ == "__main__":
     # For local debugging
     pass
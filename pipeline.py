@@ -0,0 +1,205 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import config
+from metrics import StageTimer
+from signals import RoiSampler, Trace
+
+# Pipelined engine (DEEPSHIELD_PIPELINE=1).
+# The sequential loop decodes a frame, then detects the face in it, then decodes the next one, so
+# the decoder idles while the detector runs and the other way round. Here a decoder thread
+# retrieves frames into a bounded ring of preallocated buffers (cap.retrieve(buffer) decodes in
+# place) and analysis threads detect faces and sample the ROI while the next frames are decoded.
+# OpenCV releases the GIL in both stages, so they really overlap. The calling thread takes the
+# samples back in frame order and feeds the LivenessSession, so baseline, peak, early exit and the
+# verdict are exactly those of the sequential loop.
+#
+#   decoder --(seq, slot)--> analysis thread(s) --(seq, slot, face)--> caller (reorders, scores)
+#      ^                                                                  |
+#      +------------------------------ free slots ------------------------+
+#
+# Memory is flat: DEEPSHIELD_PIPELINE_DEPTH frame buffers and one single-row Trace per slot,
+# allocated on the first frames and reused. The session is only touched from the calling thread:
+# the decoder and every analysis thread time into their own StageTimer, the decoder counts the
+# frames it skips, and all of it is merged into the session once the threads are done. Only "detect" mode can use several analysis threads;
+# "track" mode carries the face box from frame to frame and always uses one. The threads live for
+# the whole process so every one keeps its own loaded face detector.
+
+_executor = None
+# One pipelined analysis per process at a time (engine workers run one job each); a concurrent
+# caller gets None from run_pipeline and decodes sequentially instead
+_busy = threading.Lock()
+
+
+def _threads() -> int:
+    return max(1, config.PIPELINE_THREADS)
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1 + _threads(), thread_name_prefix="deepshield-pipeline")
+    return _executor
+
+
+class _Ring:
+    """Preallocated frame buffers and per-slot sample rows, handed around by slot index."""
+
+    def __init__(self, depth: int, rois):
+        self.frames = [None] * depth
+        self.samples = [Trace(rois, capacity=1) for _ in range(depth)]
+        self.free = queue.Queue()
+        for slot in range(depth):
+            self.free.put(slot)
+
+
+def run_pipeline(cap, session, clock, deadline: float = None, depth: int = None, threads: int = None):
+    """
+    Decodes cap into session with decode and analysis overlapped. Returns True when the deadline
+    passed, False when decoding finished, or None when another pipelined analysis holds this
+    process's threads (the caller then runs the sequential loop).
+    """
+    if not _busy.acquire(blocking=False):
+        return None
+    try:
+        return _run(cap, session, clock, deadline, depth, threads)
+    finally:
+        _busy.release()
+
+
+def _run(cap, session, clock, deadline, depth, threads):
+    depth = max(2, depth or config.PIPELINE_DEPTH)
+    threads = min(threads or _threads(), _threads())
+    if session.tracker.mode == "track":
+        threads = 1
+    ring = _Ring(depth, session.trace.rois)
+    work = queue.Queue()
+    done = queue.Queue()
+    stop = threading.Event()
+    state = {"timed_out": False, "errors": [], "skipped": 0}
+    decode_timer = StageTimer()
+
+    def decode():
+        seq = 0
+        try:
+            while not stop.is_set():
+                if deadline is not None and time.time() > deadline:
+                    state["timed_out"] = True
+                    break
+                start = perf_counter()
+                grabbed = cap.grab()
+                decode_timer.add("decode", perf_counter() - start)
+                if not grabbed:
+                    break
+                decode_timer.count("decoded")
+
+                timestamp = clock.next(cap)
+                if session.past_window(timestamp):
+                    break
+                if not session.wants(timestamp):
+                    state["skipped"] += 1
+                    continue
+
+                # Blocks while every buffer is in flight: this is what keeps memory flat
+                start = perf_counter()
+                slot = ring.free.get()
+                decode_timer.add("ring_wait", perf_counter() - start)
+                if stop.is_set():
+                    break
+                start = perf_counter()
+                ret, frame = cap.retrieve(ring.frames[slot])
+                decode_timer.add("decode", perf_counter() - start)
+                if not ret:
+                    break
+                # Same buffer unless this is the slot's first frame or the resolution changed
+                ring.frames[slot] = frame
+                sample = ring.samples[slot]
+                sample.length = 0
+                sample.append(timestamp)
+                work.put((seq, slot))
+                seq += 1
+        except Exception as e:
+            state["errors"].append(e)
+            stop.set()
+        finally:
+            for _ in range(threads):
+                work.put(None)
+
+    def analyze(sampler):
+        while True:
+            item = work.get()
+            if item is None:
+                done.put(None)
+                return
+            seq, slot = item
+            face = None
+            if not stop.is_set():
+                try:
+                    face = sampler.sample(ring.frames[slot], ring.samples[slot], 0)
+                except Exception as e:
+                    state["errors"].append(e)
+                    stop.set()
+            done.put((seq, slot, face))
+
+    executor = _get_executor()
+    # The first analysis thread uses the session's own tracker, so track mode keeps its state (timed
+    # into the thread's timer until the threads are done); extra ones load their thread's detector
+    # with the same settings
+    helpers = [(session.tracker, StageTimer())] + [(None, StageTimer()) for _ in range(threads - 1)]
+    session.tracker.timer = helpers[0][1]
+    samplers = []
+
+    def start_analysis(tracker, helper_timer):
+        sampler = None
+        try:
+            if tracker is None:
+                tracker = session.tracker.fork(helper_timer)
+            sampler = RoiSampler(session.trace.rois, tracker, helper_timer)
+            samplers.append(sampler)
+        except Exception as e:
+            state["errors"].append(e)
+            stop.set()
+        # Always drain the work queue, so the decoder and the caller can finish
+        analyze(sampler)
+
+    futures = [executor.submit(decode)] + [executor.submit(start_analysis, *helper) for helper in helpers]
+
+    # Collect in frame order; a slot goes back to the decoder once its sample is in the session
+    pending = {}
+    next_seq = 0
+    finished = 0
+    while finished < threads:
+        item = done.get()
+        if item is None:
+            finished += 1
+            continue
+        seq, slot, face = item
+        pending[seq] = (slot, face)
+        while next_seq in pending:
+            slot, face = pending.pop(next_seq)
+            if not stop.is_set():
+                sample = ring.samples[slot]
+                session.push_sample(float(sample.timestamps[0]), sample.row(0), face)
+                if session.early_exit_hit:
+                    stop.set()
+            ring.free.put(slot)
+            next_seq += 1
+    for future in futures:
+        future.result()
+
+    session.tracker.timer = session.timer
+    if state["skipped"]:
+        session.skip_frame(state["skipped"])
+    session.timer.merge(decode_timer)
+    for _, helper_timer in helpers:
+        session.timer.merge(helper_timer)
+    for sampler in samplers:
+        if sampler.tracker is not session.tracker:
+            session.tracker.full_detection_frames += sampler.tracker.full_detection_frames
+            session.tracker.tracked_frames += sampler.tracker.tracked_frames
+    if state["errors"]:
+        raise state["errors"][0]
+    return state["timed_out"]
@@ -0,0 +1,109 @@
+import math
+
+import cv2
+
+import config
+from ingest import open_video
+from physics_engine import _analysis_window
+
+# Pre-analysis probe and admission.
+# Opening the container gives resolution, frame rate, frame count and codec without decoding a
+# frame (well under a millisecond). From that and the flash window the engine will actually
+# analyze, estimate_cost() predicts engine seconds, and admit() rejects or downscales uploads that
+# exceed the DEEPSHIELD_MAX_* limits before any worker decodes them. The estimate also orders the
+# engine queue (EnginePool.run(cost=...)) so short clips do not wait behind huge ones.
+
+
+class UploadRejected(Exception):
+    """The upload exceeds a configured limit; nothing was decoded."""
+
+
+def _fourcc(value: float) -> str:
+    code = int(value)
+    return "".join(chr((code >> 8 * i) & 0xFF) for i in range(4)).strip("\x00").strip() or None
+
+
+def probe_video(video) -> dict:
+    """Container metadata for a path or upload bytes, or None if it cannot be opened."""
+    cap, _, cleanup = open_video(video)
+    try:
+        if cap is None or not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if math.isnan(fps) or fps <= 0 or fps > 1000:
+            fps = None
+        # MediaRecorder WebM often has no duration, which OpenCV reports as 0 or negative frames
+        if frame_count <= 0 or fps is None:
+            frame_count = None
+        return {
+            "width": int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": fps,
+            "frame_count": frame_count,
+            "duration_ms": 1000.0 * frame_count / fps if frame_count else None,
+            "codec": _fourcc(cap.get(cv2.CAP_PROP_FOURCC)),
+        }
+    finally:
+        if cap is not None:
+            cap.release()
+        cleanup()
+
+
+def estimate_cost(info: dict, window_start_ms: float, window_end_ms: float, detect_width: int = None) -> float:
+    """
+    Predicted engine seconds: every frame up to the end of the analysis window is decoded,
+    and frames inside the window also go through face detection (at detect_width).
+    """
+    fps = info["fps"] or 30.0
+    duration_ms = info["duration_ms"]
+    if not config.STOP_AFTER_LATENCY_WINDOW or math.isinf(window_end_ms):
+        window_end_ms = duration_ms if duration_ms is not None else window_end_ms
+    if duration_ms is not None:
+        window_end_ms = min(window_end_ms, duration_ms)
+    if math.isinf(window_end_ms):
+        # Unknown length and no window end: assume the longest clip the limits allow
+        window_end_ms = config.MAX_DURATION_S * 1000.0
+    window_start_ms = max(0.0, min(window_start_ms, window_end_ms))
+
+    megapixels = info["width"] * info["height"] / 1e6
+    detect_megapixels = megapixels
+    if detect_width and 0 < detect_width < info["width"]:
+        detect_megapixels *= (detect_width / info["width"]) ** 2
+
+    decoded_frames = window_end_ms * fps / 1000.0
+    analyzed_frames = (window_end_ms - window_start_ms) * fps / 1000.0
+    detect_ms = config.COST_DETECT_MS_PER_FRAME + detect_megapixels * config.COST_DETECT_MS_PER_MPX
+    return (decoded_frames * megapixels * config.COST_DECODE_MS_PER_MPX + analyzed_frames * detect_ms) / 1000.0
+
+
+def admit(info: dict, size_bytes: int, first_flash_ms: float, last_flash_ms: float = None) -> dict:
+    """
+    Applies the upload limits for a challenge whose flashes start at first_flash_ms .. last_flash_ms.
+    Returns {"detect_width", "cost_s", "downscaled"} for the engine, or raises UploadRejected.
+    Oversized frames are either rejected or detected at a lower width (DEEPSHIELD_MAX_PIXELS_ACTION);
+    the forehead ROI is still sampled at native resolution.
+    """
+    if size_bytes > config.MAX_UPLOAD_MB * 1024 * 1024:
+        raise UploadRejected(f"Upload exceeds {config.MAX_UPLOAD_MB:g} MB")
+    if info["duration_ms"] is not None and info["duration_ms"] > config.MAX_DURATION_S * 1000.0:
+        raise UploadRejected(f"Video is longer than {config.MAX_DURATION_S:g} s")
+
+    detect_width = config.DETECT_WIDTH or None
+    downscaled = False
+    pixels = info["width"] * info["height"]
+    if config.MAX_PIXELS > 0 and pixels > config.MAX_PIXELS:
+        if config.MAX_PIXELS_ACTION == "reject":
+            raise UploadRejected(f"Resolution {info['width']}x{info['height']} exceeds "
+                                 f"{config.MAX_PIXELS} pixels")
+        limit = int(info["width"] * math.sqrt(config.MAX_PIXELS / pixels))
+        if not detect_width or detect_width > limit:
+            detect_width = limit
+            downscaled = True
+
+    window_start_ms, window_end_ms = _analysis_window(first_flash_ms, last_flash_ms)
+    cost = estimate_cost(info, window_start_ms, window_end_ms, detect_width)
+    if config.MAX_COST_S > 0 and cost > config.MAX_COST_S:
+        raise UploadRejected(f"Video is too expensive to analyze (estimated {cost:.1f} s of engine time, "
+                             f"limit {config.MAX_COST_S:g} s)")
+    return {"detect_width": detect_width, "cost_s": cost, "downscaled": downscaled}
@@ -0,0 +1,336 @@
+import argparse
+import json
+import os
+from statistics import NormalDist
+
+import numpy as np
+
+import config
+from physics_engine import FLASH_COLORS
+from signals import CHANNELS
+from trace_store import TraceStore
+
+# Threshold re-scoring.
+# Re-runs the engine's verdict over every trace kept in a trace store (DEEPSHIELD_TRACE_STORE) for
+# a whole grid of DEEPSHIELD_DELTA_THRESHOLD x DEEPSHIELD_MAX_LATENCY_MS settings, without decoding
+# a video. For each max latency every session reduces to one score (its weakest flash's delta
+# within that latency), so a session is verified at (threshold, latency) iff score > threshold and
+# the whole grid is a few array operations per shard. With labels it reports ROC / DET curves,
+# AUC / EER per latency and the best setting for each target false accept rate.
+#
+#   python rescore.py STORE --corpus corpus_dir --target-far 0.01,0.001 --json out.json --plot roc.png
+
+_PROBIT = NormalDist().inv_cdf
+
+
+def _grid(spec: str) -> np.ndarray:
+    """'start:stop:step' (inclusive) or a comma-separated list."""
+    if ":" in spec:
+        start, stop, step = (float(x) for x in spec.split(":"))
+        return np.round(np.arange(start, stop + step / 2, step), 6)
+    return np.array(sorted(float(x) for x in spec.split(",")))
+
+
+def _segment_search(keys, segment_keys, span: float, values, side: str):
+    # searchsorted within each session's (increasing) timestamps: sessions are laid out one after
+    # the other on a single axis, `span` apart
+    return np.searchsorted(keys, segment_keys + np.clip(values, 0.0, span - 0.5), side=side)
+
+
+def recorded_latency(shards) -> float:
+    """
+    Highest max latency every session can be re-scored at. Latency-windowed sessions only kept frames
+    up to the (last) flash + the max latency in force at the time; the others kept the whole trace.
+    """
+    return min((meta["max_latency_ms"] for shard in shards for meta in shard.sessions
+                if meta["window_ms"][1] is not None), default=np.inf)
+
+
+def score_shard(shard, latencies: np.ndarray) -> np.ndarray:
+    """(sessions, latencies) scores of one shard: the weakest flash's delta, -inf without frames."""
+    count = len(shard)
+    starts = shard.index["offset"].astype(np.int64)
+    lengths = shard.index["length"].astype(np.int64)
+    first, end = int(starts[0]), int(starts[-1] + lengths[-1])
+    starts -= first
+    # Same inputs as the engine: frames without a face count as 0
+    times = np.asarray(shard.timestamps[first:end], dtype=np.float64)
+    values = np.nan_to_num(np.asarray(shard.bgr[first:end], dtype=np.float64), nan=0.0)
+
+    t_min = float(times.min())
+    span = float(times.max()) - t_min + float(latencies.max()) + 2.0
+    session_of_frame = np.repeat(np.arange(count), lengths)
+    keys = session_of_frame * span + (times - t_min)
+    base = np.arange(count) * span
+
+    metas = shard.sessions
+    window_start = np.array([m["window_ms"][0] if m["window_ms"][0] is not None else -np.inf for m in metas])
+    windowed = np.array([m["window_ms"][1] is not None for m in metas])
+    flash_session = np.repeat(np.arange(count), [len(m["flashes"]) for m in metas])
+    flash_offset = np.array([offset for m in metas for _, offset in m["flashes"]], dtype=np.float64)
+    flash_channel = np.array([CHANNELS[FLASH_COLORS[color]] for m in metas for color, _ in m["flashes"]])
+    first_flash = flash_offset[np.r_[0, np.cumsum([len(m["flashes"]) for m in metas])[:-1]]]
+
+    # 1. Baseline per session and channel: frames in [window start, first flash), else first 10%
+    sums = np.vstack([np.zeros((1, 3)), np.cumsum(values, axis=0)])
+    pre_start = _segment_search(keys, base, span, window_start - t_min, "left")
+    pre_end = _segment_search(keys, base, span, first_flash - t_min, "left")
+    fallback = pre_end <= pre_start
+    pre_start = np.where(fallback, starts, pre_start)
+    pre_end = np.where(fallback, starts + np.maximum(1, lengths // 10), pre_end)
+    baselines = (sums[pre_end] - sums[pre_start]) / (pre_end - pre_start)[:, None]
+    flash_baseline = baselines[flash_session, flash_channel]
+
+    # 2. Running peak of every flash's channel from the flash onwards (segment-wise cummax)
+    session_end = (starts + lengths)[flash_session]
+    flash_start = _segment_search(keys, base[flash_session], span, flash_offset - t_min, "left")
+    flash_stop = np.where(windowed[flash_session],
+                          _segment_search(keys, base[flash_session], span,
+                                          flash_offset + latencies.max() - t_min, "right"),
+                          session_end)
+    sizes = flash_stop - flash_start
+    has_frames = sizes > 0
+    sizes = np.maximum(sizes, 1)
+    segment = np.repeat(np.arange(len(flash_offset)), sizes)
+    segment_first = np.r_[0, np.cumsum(sizes)[:-1]]
+    frame = np.minimum(flash_start[segment] + np.arange(len(segment)) - segment_first[segment], len(times) - 1)
+    trace = values[frame, flash_channel[segment]]
+    low, spread = trace.min(), trace.max() - trace.min() + 1.0
+    running = np.maximum.accumulate(trace - low + segment * spread) - segment * spread + low
+
+    # 3. Delta per flash and latency
+    deltas = np.full((len(flash_offset), len(latencies)), -np.inf)
+    within = _segment_search(keys, base[flash_session][:, None], span,
+                             flash_offset[:, None] + latencies[None, :] - t_min, "right") - flash_start[:, None]
+    windowed_flash = windowed[flash_session]
+    # Latency-windowed engine (DEEPSHIELD_STOP_AFTER_LATENCY_WINDOW): peak within [flash, flash + L]
+    rows = has_frames[:, None] & windowed_flash[:, None] & (within > 0)
+    peak = running[segment_first[:, None] + np.maximum(within, 1) - 1]
+    deltas[rows] = (peak - flash_baseline[:, None])[rows]
+    # Unwindowed engine: the peak over the rest of the trace, verified only if it came within L
+    if not windowed_flash.all():
+        last = segment_first + sizes - 1
+        global_peak = running[last]
+        at_peak = trace == global_peak[segment]
+        peak_frame = np.minimum.reduceat(np.where(at_peak, frame, len(times)), segment_first)
+        peak_latency = times[np.minimum(peak_frame, len(times) - 1)] - flash_offset
+        rows = has_frames[:, None] & ~windowed_flash[:, None] & (peak_latency[:, None] <= latencies[None, :])
+        deltas[rows] = np.broadcast_to((global_peak - flash_baseline)[:, None], deltas.shape)[rows]
+
+    # 4. Every flash must be verified: the session scores as its weakest flash
+    return np.minimum.reduceat(deltas, np.r_[0, np.cumsum([len(m["flashes"]) for m in metas])[:-1]], axis=0)
+
+
+def load_labels(sessions, labels_file: str = None, corpus: str = None) -> np.ndarray:
+    """Ground truth per session (1 live, 0 fake, -1 unknown) by session id, source name or stored label."""
+    labels = {}
+    if corpus:
+        from synthetic_clips import load_corpus
+        labels.update({spec.filename: spec.expected for spec in load_corpus(corpus)})
+    if labels_file:
+        with open(labels_file, encoding="utf-8") as f:
+            labels.update(json.load(f))
+    truth = np.full(len(sessions), -1, dtype=np.int8)
+    for i, (session_id, meta) in enumerate(sessions):
+        source = os.path.basename(meta["source"]) if meta.get("source") else None
+        for key in (session_id, source, meta.get("source")):
+            if key in labels:
+                truth[i] = int(bool(labels[key]))
+                break
+        else:
+            if "label" in meta:
+                truth[i] = int(bool(meta["label"]))
+    return truth
+
+
+def roc(scores: np.ndarray, truth: np.ndarray, thresholds: np.ndarray):
+    """(thresholds, latencies) true and false accept rates: a session is accepted iff score > threshold."""
+    rates = []
+    for label in (1, 0):
+        group = np.sort(scores[truth == label], axis=0)
+        if not len(group):
+            rates.append(np.full((len(thresholds), scores.shape[1]), np.nan))
+            continue
+        accepted = [len(group) - np.searchsorted(group[:, j], thresholds, side="right")
+                    for j in range(scores.shape[1])]
+        rates.append(np.stack(accepted, axis=1) / len(group))
+    return rates
+
+
+def auc(scores: np.ndarray, truth: np.ndarray) -> np.ndarray:
+    """Area under the ROC curve per latency (Mann-Whitney, ties count half)."""
+    live, fake = scores[truth == 1], np.sort(scores[truth == 0], axis=0)
+    if not len(live) or not len(fake):
+        return np.full(scores.shape[1], np.nan)
+    areas = []
+    for j in range(scores.shape[1]):
+        below = np.searchsorted(fake[:, j], live[:, j], side="left")
+        ties = np.searchsorted(fake[:, j], live[:, j], side="right") - below
+        areas.append(float((below + 0.5 * ties).sum() / (len(live) * len(fake))))
+    return np.array(areas)
+
+
+def operating_point(tar, far, thresholds, latencies, target_far: float):
+    """Highest true accept rate with false accepts <= target_far (then the lowest FAR, then threshold)."""
+    ok = far <= target_far
+    if not ok.any():
+        return None
+    # lexsort: last key is primary
+    order = np.lexsort((-np.broadcast_to(thresholds[:, None], tar.shape)[ok], far[ok], -tar[ok]))
+    i, j = (axis[order[0]] for axis in np.nonzero(ok))
+    return _point(tar, far, thresholds, latencies, i, j)
+
+
+def _point(tar, far, thresholds, latencies, i, j) -> dict:
+    return {
+        "delta_threshold": float(thresholds[i]),
+        "max_latency_ms": float(latencies[j]),
+        "true_accept_rate": float(tar[i, j]),
+        "false_accept_rate": float(far[i, j]),
+        "false_reject_rate": float(1.0 - tar[i, j]),
+    }
+
+
+def _probit(rates: np.ndarray, count: int) -> np.ndarray:
+    # Normal deviate for a DET axis; 0 and 1 are clipped to half a sample
+    eps = 0.5 / max(count, 1)
+    return np.array([_PROBIT(p) for p in np.clip(rates, eps, 1.0 - eps)])
+
+
+def plot(path: str, report: dict, tar, far, latencies, live: int, fake: int):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (roc_ax, det_ax) = plt.subplots(1, 2, figsize=(12, 5))
+    for j, latency in enumerate(latencies):
+        label = f"{latency:.0f} ms (AUC {report['latencies'][j]['auc']:.3f})"
+        roc_ax.plot(far[:, j], tar[:, j], label=label)
+        det_ax.plot(_probit(far[:, j], fake), _probit(1.0 - tar[:, j], live), label=label)
+    current = report["current"]
+    if current:
+        roc_ax.plot(current["false_accept_rate"], current["true_accept_rate"], "k*", markersize=12, label="current")
+    roc_ax.set_xlabel("False accept rate")
+    roc_ax.set_ylabel("True accept rate")
+    roc_ax.set_title("ROC by max latency")
+    roc_ax.legend(fontsize="small")
+    ticks = [0.001, 0.01, 0.05, 0.2, 0.5, 0.8]
+    for axis in (det_ax.xaxis, det_ax.yaxis):
+        axis.set_ticks([_PROBIT(t) for t in ticks])
+        axis.set_ticklabels([f"{t:g}" for t in ticks])
+    det_ax.set_xlabel("False accept rate")
+    det_ax.set_ylabel("False reject rate")
+    det_ax.set_title("DET")
+    det_ax.grid(True, alpha=0.3)
+    fig.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-score stored traces over a grid of engine thresholds")
+    parser.add_argument("store", nargs="?", default=config.TRACE_STORE,
+                        help="Trace store directory (default: DEEPSHIELD_TRACE_STORE)")
+    parser.add_argument("--labels", help="JSON {session id | video name: is_live}")
+    parser.add_argument("--corpus", help="Synthetic corpus directory whose corpus.json labels the sessions")
+    parser.add_argument("--deltas", default="0:20:0.25", help="Delta thresholds, start:stop:step or a list")
+    parser.add_argument("--latencies", default="200:2000:200", help="Max latencies (ms), start:stop:step or a list")
+    parser.add_argument("--target-far", default="0.01,0.001", help="False accept rates to pick operating points for")
+    parser.add_argument("--json", help="Write the report (with the full curves) to this JSON file")
+    parser.add_argument("--plot", help="Write ROC / DET curves to this image")
+    args = parser.parse_args()
+    if not args.store:
+        parser.error("no trace store given (and DEEPSHIELD_TRACE_STORE is not set)")
+
+    store = TraceStore(args.store)
+    if not len(store):
+        raise SystemExit(f"No sessions in {args.store}")
+    thresholds = _grid(args.deltas)
+    latencies = _grid(args.latencies)
+    recorded = recorded_latency(store.shards)
+    if latencies.max() > recorded:
+        print(f"⚠️  Latencies above {recorded:.0f} ms were not recorded for the latency-windowed sessions; dropped")
+        latencies = latencies[latencies <= recorded]
+    current_latency = config.MAX_LATENCY_MS
+    if current_latency <= recorded and current_latency not in latencies:
+        latencies = np.sort(np.append(latencies, current_latency))
+    if not len(latencies):
+        raise SystemExit("No latency left to evaluate")
+
+    scores = np.vstack([score_shard(shard, latencies) for shard in store.shards])
+    sessions = [(f"{os.path.basename(shard.path)}/{i}", meta)
+                for shard in store.shards for i, meta in enumerate(shard.sessions)]
+    truth = load_labels(sessions, args.labels, args.corpus)
+
+    # Agreement with the verdicts the engine gave, at the settings it ran with
+    agree, compared = 0, 0
+    for i, (_, meta) in enumerate(sessions):
+        if meta["early_exit"] or meta["max_latency_ms"] not in latencies \
+                or str(meta.get("message", "")).startswith("Spoof Detected:"):
+            continue
+        j = int(np.flatnonzero(latencies == meta["max_latency_ms"])[0])
+        compared += 1
+        agree += bool(scores[i, j] > meta["delta_threshold"]) == meta["is_liveness_verified"]
+    early = sum(1 for _, meta in sessions if meta["early_exit"])
+
+    live, fake = int((truth == 1).sum()), int((truth == 0).sum())
+    print(f"📼 {len(sessions)} sessions in {len(store.shards)} shard(s): {live} live, {fake} fake, "
+          f"{len(sessions) - live - fake} unlabeled")
+    if compared:
+        print(f"🔁 Re-scoring reproduces {agree}/{compared} stored verdicts")
+    if early:
+        print(f"⚠️  {early} session(s) stopped early (DEEPSHIELD_EARLY_EXIT): their traces end at the first "
+              f"crossing, so higher thresholds under-score them")
+
+    report = {"store": args.store, "sessions": len(sessions), "live": live, "fake": fake,
+              "agreement": {"compared": compared, "agree": agree}, "latencies": [], "operating_points": [],
+              "current": None}
+    if not live or not fake:
+        print("No live and fake labels to draw curves from (use --labels or --corpus)")
+    else:
+        tar, far = roc(scores, truth, thresholds)
+        areas = auc(scores, truth)
+        print(f"{'latency':>8} {'AUC':>6} {'EER':>6} {'at delta':>9}")
+        for j, latency in enumerate(latencies):
+            frr = 1.0 - tar[:, j]
+            i = int(np.argmin(np.abs(far[:, j] - frr)))
+            eer = float((far[i, j] + frr[i]) / 2)
+            report["latencies"].append({"max_latency_ms": float(latency), "auc": float(areas[j]), "eer": eer,
+                                        "eer_delta_threshold": float(thresholds[i]),
+                                        "true_accept_rate": tar[:, j].tolist(),
+                                        "false_accept_rate": far[:, j].tolist()})
+            print(f"{latency:>8.0f} {areas[j]:>6.3f} {eer:>6.1%} {thresholds[i]:>9.2f}")
+        report["delta_thresholds"] = thresholds.tolist()
+
+        live_scores = scores[truth == 1][:, latencies == current_latency]
+        fake_scores = scores[truth == 0][:, latencies == current_latency]
+        if live_scores.size:
+            report["current"] = {
+                "delta_threshold": config.DELTA_THRESHOLD,
+                "max_latency_ms": current_latency,
+                "true_accept_rate": float((live_scores > config.DELTA_THRESHOLD).mean()),
+                "false_accept_rate": float((fake_scores > config.DELTA_THRESHOLD).mean()),
+            }
+            current = report["current"]
+            print(f"📍 Current  delta > {config.DELTA_THRESHOLD:g}, latency <= {current_latency:.0f} ms: "
+                  f"TAR {current['true_accept_rate']:.1%}, FAR {current['false_accept_rate']:.1%}")
+        for target in (float(x) for x in args.target_far.split(",")):
+            point = operating_point(tar, far, thresholds, latencies, target)
+            report["operating_points"].append(dict(point or {}, target_far=target))
+            if point is None:
+                print(f"🎯 FAR <= {target:g}: no setting in the grid")
+            else:
+                print(f"🎯 FAR <= {target:g}: DEEPSHIELD_DELTA_THRESHOLD={point['delta_threshold']:g} "
+                      f"DEEPSHIELD_MAX_LATENCY_MS={point['max_latency_ms']:g} "
+                      f"(TAR {point['true_accept_rate']:.1%}, FAR {point['false_accept_rate']:.2%})")
+        if args.plot:
+            plot(args.plot, report, tar, far, latencies, live, fake)
+            print(f"📈 Curves written to {args.plot}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import asyncio
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+
+import config
+
+# Result cache for retried and duplicate uploads.
+# Verdicts are keyed by a SHA-256 of the upload bytes plus the flash parameters, kept in an LRU
+# bounded by entry count and TTL. Concurrent identical requests are single-flighted: the first
+# one runs the engine, the others await its result. Clients may send an Idempotency-Key so a
+# retry is recognised as such; a byte-identical upload that is not a retry of the same key is
+# flagged as a repeat (a possible replay). Everything runs on the event loop, so no locks.
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+# Results that describe the server rather than the upload are never reused
+_UNCACHEABLE_MESSAGES = ("Internal Server Error", "Timed out", "Challenge rejected", "Server busy")
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class IdempotencyConflict(Exception):
+    """The Idempotency-Key was already used for a different upload or different parameters."""
+
+
+def upload_digest(video) -> str:
+    """SHA-256 of an upload (bytes, or the path of an upload spooled to disk)."""
+    digest = hashlib.sha256()
+    if isinstance(video, str):
+        with open(video, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), b""):
+                digest.update(chunk)
+    else:
+        digest.update(video)
+    return digest.hexdigest()
+
+
+def cache_key(digest: str, **params) -> str:
+    """Upload digest plus the parameters that change the verdict (flash offset, schedule, ...)."""
+    encoded = json.dumps(params, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(f"{digest}:{encoded}".encode()).hexdigest()
+
+
+def cacheable(result: dict) -> bool:
+    return not result.get("message", "").startswith(_UNCACHEABLE_MESSAGES)
+
+
+class _TtlLru:
+    """OrderedDict LRU whose entries also expire ttl seconds after they were stored."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.max_entries = config.RESULT_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl = config.RESULT_CACHE_TTL if ttl is None else ttl
+        self._results = _TtlLru(self.max_entries, self.ttl)
+        # Upload digest -> Idempotency-Key it first arrived with (None without one)
+        self._uploads = _TtlLru(self.max_entries, self.ttl)
+        # Idempotency-Key -> cache key of the request that used it
+        self._idempotency = _TtlLru(self.max_entries, self.ttl)
+        self._inflight = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def __len__(self):
+        return len(self._results)
+
+    def claim_idempotency_key(self, idempotency_key: str, key: str) -> bool:
+        """
+        Binds the key to this request's cache key; raises IdempotencyConflict if it was used otherwise.
+        Returns True for a retry (the key was already bound to this request).
+        """
+        if not idempotency_key:
+            return False
+        previous = self._idempotency.get(idempotency_key)
+        if previous is not None and previous != key:
+            raise IdempotencyConflict(f"{IDEMPOTENCY_HEADER} was already used for a different upload or parameters")
+        self._idempotency.put(idempotency_key, key)
+        return previous is not None
+
+    def note_upload(self, digest: str, idempotency_key: str = None) -> bool:
+        """Records an upload; True if the same bytes were seen before outside a retry of the same key."""
+        seen = self._uploads.get(digest)
+        if seen is None:
+            self._uploads.put(digest, (idempotency_key,))
+            return False
+        return not (idempotency_key and seen[0] == idempotency_key)
+
+    async def run(self, key: str, compute):
+        """
+        Returns (result, outcome): "hit" from the cache, "shared" from a concurrent identical request,
+        or "miss" when compute() ran here. Callers get their own copy of the result.
+        """
+        result = self._results.get(key)
+        if result is not None:
+            return copy.deepcopy(result), "hit"
+
+        future = self._inflight.get(key)
+        if future is not None:
+            result = await asyncio.shield(future)
+            return copy.deepcopy(result), "shared"
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Mark it retrieved: with no waiters it would be logged as never retrieved
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+        stored = {k: v for k, v in result.items() if k not in ("timings", "profile")}
+        future.set_result(stored)
+        if cacheable(result):
+            self._results.put(key, copy.deepcopy(stored))
+        return result, "miss"
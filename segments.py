@@ -0,0 +1,295 @@
+import asyncio
+import math
+import time
+from functools import partial
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+import config
+from detectors import DetectorUnavailable
+from ingest import open_video
+from metrics import StageTimer
+from physics_engine import LivenessSession, _analysis_window, score_schedule, score_trace
+from signals import Trace
+from trace_store import record_trace
+from tracking import FrameClock
+
+# Segment-parallel decoding.
+# One cv2.VideoCapture loop keeps a long or high-resolution upload on a single core. Here the
+# analysis window is split at keyframes into time segments; each segment is an ordinary engine
+# pool job that seeks to its keyframe, decodes only its own frames and samples the forehead ROI,
+# and the partial traces are merged in timestamp order and scored exactly like a sequential run.
+#
+# Keyframes come from a demux-only pass (CAP_PROP_FORMAT = -1 returns the packets undecoded), a few
+# ms even for minutes of video. Segments start side by side on idle workers; a segment that finds
+# no idle worker waits for the one before it and resumes from its face tracker state, so "track"
+# mode continues across the boundary instead of starting over. If a seek lands past its keyframe
+# or the merged trace has a gap, the upload is analyzed sequentially instead.
+
+
+def scan_keyframes(video, until_ms: float = math.inf) -> list:
+    """Timestamps (ms) of the keyframes up to until_ms, without decoding a frame."""
+    cap, _, cleanup = open_video(video)
+    keyframes = []
+    try:
+        if cap is None or not cap.isOpened() or not cap.set(cv2.CAP_PROP_FORMAT, -1):
+            return keyframes
+        while cap.grab():
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC)
+            if timestamp > until_ms:
+                break
+            if cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) and (not keyframes or timestamp > keyframes[-1]):
+                keyframes.append(timestamp)
+    finally:
+        if cap is not None:
+            cap.release()
+        cleanup()
+    return keyframes
+
+
+def plan_segments(keyframes, window_start_ms: float, window_end_ms: float, count: int, min_ms: float = None):
+    """
+    Splits [window start, window end] into up to `count` segments at keyframes, each at least min_ms
+    long. Returns [(start_ms, end_ms, seek_ms), ...] (end exclusive, seek_ms None = decode from the
+    start), or None when fewer than two segments fit.
+    """
+    min_ms = config.SEGMENT_MIN_MS if min_ms is None else min_ms
+    start = max(0.0, window_start_ms)
+    span = window_end_ms - start
+    count = min(count, int(span // max(min_ms, 1.0)))
+    if count < 2:
+        return None
+
+    bounds = [start]
+    for i in range(1, count):
+        target = start + span * i / count
+        candidates = [k for k in keyframes if k >= bounds[-1] + min_ms and k <= window_end_ms - min_ms]
+        if not candidates:
+            break
+        bounds.append(min(candidates, key=lambda k: abs(k - target)))
+    if len(bounds) < 2:
+        return None
+
+    # The first segment seeks to the last keyframe before the window (frames up to it are skipped)
+    earlier = [k for k in keyframes if k <= start]
+    first_seek = earlier[-1] if earlier and earlier[-1] > 0 else None
+    # The last segment includes the window end itself, like the sequential engine
+    ends = bounds[1:] + [math.nextafter(window_end_ms, math.inf)]
+    return [(bound, end, first_seek if i == 0 else bound) for i, (bound, end) in enumerate(zip(bounds, ends))]
+
+
+def plan_upload(video, info: dict, first_flash_ms: float, last_flash_ms: float, workers: int):
+    """Segments for an upload if it is worth splitting (DEEPSHIELD_SEGMENT_*), else None."""
+    workers = min(workers, config.SEGMENT_MAX or workers)
+    if workers < 2:
+        return None
+    window_start_ms, window_end_ms = _analysis_window(first_flash_ms, last_flash_ms)
+    if info.get("duration_ms") is not None:
+        window_end_ms = min(window_end_ms, info["duration_ms"])
+    if math.isinf(window_end_ms):
+        return None
+    large = info["width"] * info["height"] >= config.SEGMENT_MIN_PIXELS
+    if not large and window_end_ms < config.SEGMENT_MIN_DURATION_S * 1000.0:
+        return None
+    keyframes = scan_keyframes(video, window_end_ms)
+    return plan_segments(keyframes, window_start_ms, window_end_ms, workers)
+
+
+def extract_segment(video, start_ms: float, end_ms: float, seek_ms: float = None, roi_mode: str = None,
+                    detect_width: int = None, scale_factor: float = None, roi_state: dict = None,
+                    deadline: float = None) -> dict:
+    """
+    Engine worker job: forehead trace of the frames in [start_ms, end_ms). roi_state is the previous
+    segment's tracker state, if it was done before this one started.
+    """
+    timer = StageTimer()
+    begin = perf_counter()
+    cap, ingest_path, cleanup = open_video(video)
+    timer.add("open", perf_counter() - begin)
+    part = {"start_ms": start_ms, "end_ms": end_ms, "ingest": ingest_path, "first_ms": None,
+            "handoff": roi_state is not None, "timed_out": False, "error": None}
+    try:
+        if cap is None or not cap.isOpened():
+            part["error"] = "Error opening video file."
+            return part
+        try:
+            session = LivenessSession(roi_mode=roi_mode, detect_width=detect_width, scale_factor=scale_factor,
+                                      early_exit=False, timer=timer)
+        except DetectorUnavailable:
+            part["error"] = "Face Detector Initialization Failed"
+            return part
+        session.tracker.resume(roi_state)
+
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if fps == 0 or np.isnan(fps):
+            fps = 30.0
+        if seek_ms:
+            start = perf_counter()
+            cap.set(cv2.CAP_PROP_POS_MSEC, seek_ms)
+            timer.add("seek", perf_counter() - start)
+        clock = FrameClock(fps)
+        while True:
+            if deadline is not None and time.time() > deadline:
+                part["timed_out"] = True
+                break
+            start = perf_counter()
+            grabbed = cap.grab()
+            timer.add("decode", perf_counter() - start)
+            if not grabbed:
+                break
+            timer.count("decoded")
+
+            timestamp = clock.next(cap)
+            if part["first_ms"] is None:
+                part["first_ms"] = timestamp
+            if timestamp >= end_ms:
+                break
+            if timestamp < start_ms:
+                session.skip_frame()
+                continue
+
+            start = perf_counter()
+            ret, frame = cap.retrieve()
+            timer.add("decode", perf_counter() - start)
+            if not ret:
+                break
+            session.push_frame(frame, timestamp)
+    finally:
+        if cap is not None:
+            cap.release()
+        cleanup()
+
+    timer.add("engine", perf_counter() - begin)
+    part.update({
+        "fps": fps,
+        "timestamps": session.trace.timestamps.copy(),
+        "bgr": session.trace.means("forehead").copy(),
+        "roi_mode": session.tracker.mode,
+        "roi_state": session.tracker.state(),
+        "full_detection_frames": session.tracker.full_detection_frames,
+        "tracked_frames": session.tracker.tracked_frames,
+        "skipped_frames": session.skipped_frames,
+        "repaired_timestamps": clock.repaired,
+        "timings": timer.to_dict(),
+    })
+    return part
+
+
+def merge_segments(parts):
+    """The segments' traces as one Trace, or (None, reason) if they do not join up."""
+    interval = 1000.0 / parts[0]["fps"]
+    for i, part in enumerate(parts):
+        # A seek must land on (or before) its keyframe; later means frames were lost
+        if part["first_ms"] is not None and part["first_ms"] > part["start_ms"] + interval / 2:
+            return None, f"segment {i} seek landed at {part['first_ms']:.0f} ms, not {part['start_ms']:.0f} ms"
+    timestamps = np.concatenate([part["timestamps"] for part in parts])
+    bgr = np.concatenate([part["bgr"] for part in parts])
+    if len(timestamps) > 1:
+        steps = np.diff(timestamps)
+        if np.any(steps <= 0):
+            return None, "segment timestamps overlap"
+        # Across a boundary, allow no longer a step than the video has anywhere else
+        joins = np.cumsum([len(part["timestamps"]) for part in parts])[:-1] - 1
+        joins = joins[(joins >= 0) & (joins < len(steps))]
+        inner = np.delete(steps, joins)
+        allowed = max(2.5 * max(float(np.median(inner)) if len(inner) else 0.0, interval),
+                      float(inner.max()) if len(inner) else 0.0)
+        if len(joins) and steps[joins].max() > allowed:
+            return None, "gap between segments"
+    return Trace.from_arrays(timestamps, bgr, "forehead", parts[0]["fps"]), None
+
+
+def _merge_timings(parts, wall: float) -> dict:
+    timer = StageTimer()
+    for part in parts:
+        for stage, ms in part["timings"]["stages_ms"].items():
+            timer.add(stage, ms / 1000.0)
+        for kind, n in part["timings"]["frames"].items():
+            timer.count(kind, n)
+    timings = timer.to_dict()
+    # Stages are summed over segments (CPU time); engine is the longest segment (what was waited for)
+    timings["stages_ms"]["engine"] = max(part["timings"]["stages_ms"].get("engine", 0.0) for part in parts)
+    timings["wall_ms"] = round(wall * 1000.0, 3)
+    return timings
+
+
+async def analyze_segmented(pool, video, plan, flash_offset: float = None, flash_schedule=None, template=None,
+                            detect_width: int = None, deadline: float = None, cost: float = 0.0,
+                            fallback=None) -> dict:
+    """
+    Runs the segments of `plan` (plan_upload) in the engine pool and scores the merged trace.
+    fallback(video, flash_offset) is the sequential engine call, used if the segments do not join up.
+    """
+    started = perf_counter()
+    parts = [None] * len(plan)
+    done = [asyncio.Event() for _ in plan]
+
+    async def run(i):
+        start_ms, end_ms, seek_ms = plan[i]
+        roi_state = None
+        if i and not pool.idle_slots:
+            # No idle worker: start where the previous segment's tracker left off
+            await done[i - 1].wait()
+            roi_state = parts[i - 1]["roi_state"] if parts[i - 1] and not parts[i - 1]["error"] else None
+        try:
+            job = partial(extract_segment, seek_ms=seek_ms, detect_width=detect_width, roi_state=roi_state,
+                          deadline=deadline)
+            parts[i] = await pool.run(job, video, start_ms, end_ms, cost=cost / len(plan))
+        finally:
+            done[i].set()
+
+    tasks = [asyncio.ensure_future(run(i)) for i in range(len(plan))]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+    errors = [part["error"] for part in parts if part["error"]]
+    if errors:
+        return {
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": errors[0]
+        }
+    trace, reason = merge_segments(parts)
+    if trace is None:
+        result = await pool.run(fallback, video, flash_offset, cost=cost)
+        result["segments"] = {"count": len(plan), "fallback": reason}
+        return result
+
+    schedule = flash_schedule or [("red", flash_offset)]
+    offsets = [offset for _, offset in schedule]
+    if flash_schedule:
+        result = score_schedule(trace, flash_schedule, template=template)
+    else:
+        result = score_trace(trace, flash_offset)
+    result.update({
+        "roi_mode": parts[0]["roi_mode"],
+        "full_detection_frames": sum(part["full_detection_frames"] for part in parts),
+        "tracked_frames": sum(part["tracked_frames"] for part in parts),
+        "analyzed_frames": len(trace),
+        "skipped_frames": sum(part["skipped_frames"] for part in parts),
+        "early_exit": False,
+        "repaired_timestamps": sum(part["repaired_timestamps"] for part in parts),
+        "segments": {
+            "count": len(parts),
+            "bounds_ms": [round(part["start_ms"], 3) for part in parts],
+            "handoffs": sum(part["handoff"] for part in parts),
+        },
+    })
+    if any(part["timed_out"] for part in parts):
+        result.update({
+            "is_liveness_verified": False,
+            "message": "Timed out: analysis deadline exceeded."
+        })
+    else:
+        record_trace(trace, schedule, _analysis_window(offsets[0], offsets[-1]), result,
+                     video if isinstance(video, str) else None)
+    result["ingest"] = parts[0]["ingest"]
+    result["timings"] = _merge_timings(parts, perf_counter() - started)
+    return result
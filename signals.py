@@ -0,0 +1,188 @@
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+import config
+from detectors import get_detector
+from ingest import open_video
+from tracking import FaceTracker, FrameClock
+
+# Signal extraction.
+# Every analyzer works on the same thing: per-frame channel means of some region of interest.
+# A Trace holds them in preallocated float32 arrays (timestamps plus B/G/R means for each ROI
+# strategy), filled with cv2.mean on frame views, so no per-frame Python lists or float64 copies
+# are built. extract_trace() decodes a video once for any number of ROI strategies; the physics
+# engine, monitor.py and secure_monitor.py all score from a Trace.
+#
+# ROI strategies:
+#   forehead - top 30% / center 60% of the tracked face box (physics engine)
+#   face     - the whole face box
+#   center   - fixed 50x50 box in the middle of the frame (monitor / secure_monitor)
+
+ROI_STRATEGIES = ("forehead", "face", "center")
+FACE_ROIS = ("forehead", "face")
+CHANNELS = {"b": 0, "g": 1, "r": 2}
+
+CENTER_ROI_SIZE = 50
+
+
+def forehead_box(face):
+    # Forehead ROI: top 30% of the face box, center 60% horizontally to avoid hair/background
+    x, y, w, h = face
+    return x + int(w * 0.2), y, x + int(w * 0.2) + int(w * 0.6), y + int(h * 0.3)
+
+
+def face_box(face):
+    x, y, w, h = face
+    return x, y, x + w, y + h
+
+
+def center_box(frame_shape, size: int = CENTER_ROI_SIZE):
+    height, width = frame_shape[:2]
+    cx, cy = width // 2, height // 2
+    half = size // 2
+    return max(0, cx - half), max(0, cy - half), min(width, cx + half), min(height, cy + half)
+
+
+class Trace:
+    """
+    Timestamps (ms) and per-ROI B/G/R means for a run of frames, in float32 arrays that grow
+    by doubling. A ROI that could not be sampled in a frame (no face) is NaN for that frame.
+    """
+
+    def __init__(self, rois=("forehead",), capacity: int = 256):
+        unknown = [roi for roi in rois if roi not in ROI_STRATEGIES]
+        if unknown:
+            raise ValueError(f"Unknown ROI strategy '{unknown[0]}' (choose from {', '.join(ROI_STRATEGIES)})")
+        self.rois = tuple(rois)
+        self._roi_index = {roi: i for i, roi in enumerate(self.rois)}
+        self._timestamps = np.empty(max(1, capacity), dtype=np.float32)
+        self._means = np.empty((max(1, capacity), len(self.rois), 3), dtype=np.float32)
+        self.length = 0
+        self.fps = None
+
+    def __len__(self):
+        return self.length
+
+    @classmethod
+    def from_arrays(cls, timestamps, bgr, roi: str = "forehead", fps: float = None) -> "Trace":
+        """Single-ROI trace from existing timestamps (ms) and (frames, 3) B/G/R means."""
+        trace = cls((roi,), capacity=len(timestamps))
+        trace._timestamps[:len(timestamps)] = timestamps
+        trace._means[:len(timestamps), 0] = bgr
+        trace.length = len(timestamps)
+        trace.fps = fps
+        return trace
+
+    def append(self, timestamp_ms: float) -> int:
+        """Adds a frame (all ROIs NaN until sampled) and returns its index."""
+        if self.length == len(self._timestamps):
+            capacity = 2 * len(self._timestamps)
+            self._timestamps = np.resize(self._timestamps, capacity)
+            self._means = np.resize(self._means, (capacity, len(self.rois), 3))
+        index = self.length
+        self._timestamps[index] = timestamp_ms
+        self._means[index] = np.nan
+        self.length += 1
+        return index
+
+    def row(self, index: int):
+        """(rois, 3) view of one frame's means, for in-place writes."""
+        return self._means[index]
+
+    @property
+    def timestamps(self):
+        return self._timestamps[:self.length]
+
+    def means(self, roi: str):
+        """(frames, 3) B/G/R view for one ROI strategy."""
+        return self._means[:self.length, self._roi_index[roi]]
+
+    def channel(self, roi: str, channel: str = "r"):
+        """(frames,) view of one channel ("b", "g" or "r") for one ROI strategy."""
+        return self._means[:self.length, self._roi_index[roi], CHANNELS[channel]]
+
+
+class RoiSampler:
+    """
+    Fills a Trace row from a frame. Face-based strategies share a single tracker.locate()
+    per frame; `tracker` is any object with locate(frame) -> (x, y, w, h) or None.
+    """
+
+    def __init__(self, rois, tracker=None, timer=None):
+        self.rois = tuple(rois)
+        self.tracker = tracker
+        self.timer = timer
+        self._needs_face = any(roi in FACE_ROIS for roi in self.rois)
+        if self._needs_face and tracker is None:
+            raise ValueError("Face-based ROI strategies need a face tracker")
+
+    def _box(self, roi, frame, face):
+        if roi == "center":
+            return center_box(frame.shape)
+        if face is None:
+            return None
+        return forehead_box(face) if roi == "forehead" else face_box(face)
+
+    def sample(self, frame, trace: Trace, index: int):
+        """Writes the means for frame `index` and returns the face box (None if no face was found)."""
+        face = self.tracker.locate(frame) if self._needs_face else None
+        start = perf_counter()
+        row = trace.row(index)
+        height, width = frame.shape[:2]
+        for i, roi in enumerate(self.rois):
+            box = self._box(roi, frame, face)
+            if box is None:
+                continue
+            x0, y0 = max(0, box[0]), max(0, box[1])
+            x1, y1 = min(width, box[2]), min(height, box[3])
+            if x1 <= x0 or y1 <= y0:
+                continue
+            row[i] = cv2.mean(frame[y0:y1, x0:x1])[:3]
+        if self.timer is not None:
+            self.timer.add("roi", perf_counter() - start)
+        return face
+
+
+def extract_trace(video, rois=("center",), roi_mode: str = None, max_frames: int = None):
+    """
+    Decodes a video (path or bytes) once and samples every frame for all requested ROI
+    strategies. Returns a Trace, or None if the video cannot be opened.
+    """
+    cap, _, cleanup = open_video(video)
+    try:
+        if cap is None or not cap.isOpened():
+            return None
+
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        if fps == 0 or np.isnan(fps):
+            fps = 30.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if max_frames:
+            frame_count = min(frame_count, max_frames) if frame_count > 0 else max_frames
+
+        # The container's frame count is only a hint (and comes from the upload): preallocate at most
+        # what the admission duration limit allows at this frame rate; the trace doubles past it if needed
+        limit = int(config.MAX_DURATION_S * min(fps, 1000.0)) + 1
+        trace = Trace(rois, capacity=min(frame_count + 1, limit) if frame_count > 0 else 256)
+        trace.fps = fps
+        tracker = None
+        if any(roi in FACE_ROIS for roi in trace.rois):
+            tracker = FaceTracker(get_detector(), mode=roi_mode or config.ROI_MODE)
+        sampler = RoiSampler(trace.rois, tracker)
+
+        clock = FrameClock(fps)
+        while not max_frames or len(trace) < max_frames:
+            if not cap.grab():
+                break
+            timestamp_ms = clock.next(cap)
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
+            sampler.sample(frame, trace, trace.append(timestamp_ms))
+        return trace
+    finally:
+        if cap is not None:
+            cap.release()
+        cleanup()
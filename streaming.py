@@ -0,0 +1,299 @@
+import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import cv2
+import numpy as np
+
+import config
+from detectors import DetectorUnavailable, get_detector
+from metrics import StageTimer
+from physics_engine import FLASH_COLORS, MAX_FLASHES, LivenessSession
+from tracking import FrameClock
+
+# Streaming verification.
+# The SDK sends timesliced MediaRecorder WebM chunks while the flash sequence is still running.
+# Chunks are appended to a ChunkStream; a decode thread reads it through one buffer-backed
+# cv2.VideoCapture and pushes frames into a LivenessSession as they arrive, so by the time the
+# last chunk lands only its few frames are left to analyze.
+#
+# Sessions run on a bounded pool of DEEPSHIELD_STREAM_MAX_SESSIONS threads that load their face
+# detector once (warm_up_threads() at startup), not on a new thread with a new detector per
+# stream. A session counts as active until its decode loop has really returned: abort() and a
+# finish() timeout stop the loop before its next frame, and active_sessions() (the
+# deepshield_active_streams gauge and the admission check) keeps counting it until then.
+
+_executor = None
+_lock = threading.Lock()
+_active = 0
+
+
+def _load_detector():
+    # Thread initializer: the detector stays loaded for every session this thread runs
+    try:
+        get_detector()
+    except DetectorUnavailable:
+        pass  # Reported by the first session on this thread
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=max(1, config.STREAM_MAX_SESSIONS),
+                                           thread_name_prefix="deepshield-stream", initializer=_load_detector)
+        return _executor
+
+
+def warm_up_threads(timeout: float = 30.0):
+    """Starts every stream thread (loading its detector) before the first stream arrives."""
+    threads = max(1, config.STREAM_MAX_SESSIONS)
+    # Each task holds its thread until all have started, so the pool really creates them all
+    barrier = threading.Barrier(threads)
+    futures = [_get_executor().submit(barrier.wait, timeout) for _ in range(threads)]
+    for future in futures:
+        future.result()
+
+
+def active_sessions() -> int:
+    """Sessions whose decode loop has not returned yet (including aborted ones still stopping)."""
+    return _active
+
+
+def shutdown():
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class StreamTooLarge(Exception):
+    """Raised when a stream exceeds the ingest memory limit."""
+
+
+class ChunkStream(io.BufferedIOBase):
+    """
+    Growing in-memory file fed by WebSocket chunks.
+    read() blocks until more bytes arrive or the stream is finished, so the FFmpeg demuxer simply
+    waits for the next chunk. The total size is reported as unknown (-1) until the end, which
+    keeps FFmpeg from seeking to the end of a file that is still being recorded.
+    """
+
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self._buffer = bytearray()
+        self._pos = 0
+        self._finished = False
+        self._max_bytes = max_bytes
+        self._cond = threading.Condition()
+
+    def feed(self, data: bytes):
+        with self._cond:
+            if len(self._buffer) + len(data) > self._max_bytes:
+                raise StreamTooLarge(f"Stream exceeds {self._max_bytes} bytes")
+            self._buffer += data
+            self._cond.notify_all()
+
+    def finish(self):
+        with self._cond:
+            self._finished = True
+            self._cond.notify_all()
+
+    @property
+    def size(self) -> int:
+        return len(self._buffer)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        with self._cond:
+            while self._pos >= len(self._buffer) and not self._finished:
+                self._cond.wait()
+            end = len(self._buffer) if size is None or size < 0 else self._pos + size
+            data = bytes(self._buffer[self._pos:end])
+            self._pos += len(data)
+            return data
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        with self._cond:
+            if whence == io.SEEK_SET:
+                self._pos = offset
+            elif whence == io.SEEK_CUR:
+                self._pos += offset
+            elif whence == io.SEEK_END:
+                if not self._finished:
+                    return -1
+                self._pos = len(self._buffer) + offset
+            return self._pos
+
+
+class StreamingVerification:
+    """
+    One streaming verification: feed() chunks, set_flash_offset() when the red flash starts
+    (and for every further flash color, to score the whole sequence), then finish() to get the
+    verdict. Decoding and analysis run on one of the stream threads.
+    """
+
+    def __init__(self, roi_mode: str = None):
+        self.stream = ChunkStream(int(config.INGEST_MAX_MEMORY_MB * 1024 * 1024))
+        self.session = None
+        self.clock = None
+        self.error = None
+        self.timer = StageTimer()
+        self._roi_mode = roi_mode
+        self._pending_offset = None
+        self._pending_flashes = ()
+        self._stop = threading.Event()
+        self._done = threading.Event()
+        global _active
+        with _lock:
+            _active += 1
+        try:
+            _get_executor().submit(self._run_session)
+        except BaseException:
+            self._exited()
+            raise
+
+    def feed(self, chunk: bytes):
+        self.stream.feed(chunk)
+
+    def set_flash_offset(self, flash_offset: float, color: str = "red"):
+        # Picked up by the decode thread before its next frame (no lock on the event loop).
+        # A red flash on its own is the classic single-flash check (a repeat replaces it);
+        # any further color turns the flashes so far into a schedule.
+        color = str(color).lower()
+        if color not in FLASH_COLORS:
+            raise ValueError(f"Unknown flash color '{color}'")
+        flash = (color, float(flash_offset))
+        if color == "red" and all(c == "red" for c, _ in self._pending_flashes):
+            self._pending_offset = flash[1]
+            self._pending_flashes = (flash,)
+            return
+        if len(self._pending_flashes) >= MAX_FLASHES:
+            raise ValueError(f"More than {MAX_FLASHES} flashes")
+        self._pending_flashes = self._pending_flashes + (flash,)
+
+    def _apply_offset(self):
+        flashes = self._pending_flashes
+        if len(flashes) > 1 or (flashes and flashes[0][0] != "red"):
+            if self.session.schedule != sorted(flashes, key=lambda flash: flash[1]):
+                self.session.set_flash_schedule(flashes)
+            return
+        offset = self._pending_offset
+        if offset is not None and self.session.flash_offset != offset:
+            self.session.set_flash_offset(offset)
+
+    @property
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """Waits for the decode loop to return; False if it is still running after timeout."""
+        return self._done.wait(timeout)
+
+    def abort(self):
+        # Stops the decoder before its next frame and unblocks it; whatever was received is discarded
+        self._stop.set()
+        self.stream.finish()
+
+    def finish(self, timeout: float = None) -> dict:
+        """Marks the end of the stream and waits for the decoder to drain the last chunk."""
+        self.stream.finish()
+        if not self._done.wait(timeout):
+            # Do not leave it analyzing the backlog for nobody
+            self._stop.set()
+            return self._error_result("Timed out finishing stream analysis.")
+        if self.error is not None:
+            result = self._error_result(self.error)
+        else:
+            self._apply_offset()
+            result = self.session.result()
+            result["repaired_timestamps"] = self.clock.repaired if self.clock else 0
+            result["ingest"] = "stream"
+            result["stream_bytes"] = self.stream.size
+        result["timings"] = self.timer.to_dict()
+        return result
+
+    @staticmethod
+    def _error_result(message: str) -> dict:
+        return {
+            "is_liveness_verified": False,
+            "latency_ms": 0.0,
+            "delta": 0.0,
+            "message": message
+        }
+
+    def _exited(self):
+        global _active
+        with _lock:
+            _active -= 1
+        self._done.set()
+
+    def _run_session(self):
+        try:
+            self._run()
+        finally:
+            self._exited()
+
+    def _run(self):
+        if self._stop.is_set():
+            return
+        try:
+            self.session = LivenessSession(self._pending_offset, roi_mode=self._roi_mode, timer=self.timer)
+        except DetectorUnavailable:
+            self.error = "Face Detector Initialization Failed"
+            return
+
+        timer = self.timer
+        cap = None
+        try:
+            # Blocks inside read() until the first chunk (container header) has arrived,
+            # so "open" includes waiting for the client's first chunk
+            start = perf_counter()
+            cap = cv2.VideoCapture(self.stream, cv2.CAP_FFMPEG, [])
+            timer.add("open", perf_counter() - start)
+            if not cap.isOpened():
+                self.error = "Error opening video stream."
+                return
+
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            if fps == 0 or np.isnan(fps):
+                fps = 30.0
+            clock = self.clock = FrameClock(fps)
+
+            while not self._stop.is_set():
+                # Decode time here includes waiting for chunks that have not arrived yet
+                start = perf_counter()
+                grabbed = cap.grab()
+                timer.add("decode", perf_counter() - start)
+                if not grabbed:
+                    break
+                timer.count("decoded")
+                current_time_ms = clock.next(cap)
+                self._apply_offset()
+                # Once past the latency window the verdict can no longer change; later chunks
+                # are still accepted by the stream but never decoded.
+                if self.session.past_window(current_time_ms):
+                    break
+                if not self.session.wants(current_time_ms):
+                    self.session.skip_frame()
+                    continue
+                start = perf_counter()
+                ret, frame = cap.retrieve()
+                timer.add("decode", perf_counter() - start)
+                if not ret:
+                    break
+                self.session.push_frame(frame, current_time_ms)
+                if self.session.early_exit_hit:
+                    break
+        except Exception as e:
+            self.error = f"Stream decode error: {e}"
+        finally:
+            if cap is not None:
+                cap.release()
@@ -0,0 +1,275 @@
+import argparse
+import json
+import os
+import tempfile
+
+import cv2
+import numpy as np
+
+# Synthetic challenge clips.
+# Deterministically renders webcam-like challenge videos with a drawn face the Haar cascade
+# detects, so the engine can be benchmarked and regression-tested without real recordings.
+# Every clip is fully described by a ClipSpec (resolution, fps, codec, flash timing, reflection
+# strength / latency, noise, fake kind) and the same spec + seed always renders the same frames.
+#
+# Kinds:
+#   live    - skin red channel rises after the flash (after `latency_ms`, over `rise_ms`)
+#   replay  - a screen replaying a recorded face: scanlines, refresh flicker, no flash response
+#   delayed - a relayed / injected feed whose response arrives after the engine's latency window
+
+KINDS = ("live", "replay", "delayed")
+
+# name -> (fourcc, container extension)
+CODECS = {
+    "mjpg": ("MJPG", ".avi"),
+    "mp4v": ("mp4v", ".mp4"),
+    "vp8": ("VP80", ".webm"),
+    "h264": ("avc1", ".mp4"),
+}
+
+RESOLUTIONS = ((320, 240), (640, 480), (1280, 720), (1920, 1080))
+FRAME_RATES = (15.0, 24.0, 30.0, 60.0)
+
+CORPUS_FILE = "corpus.json"
+# Same format batch.py reads from archives, so a zipped corpus can go straight to /api/verify_batch
+MANIFEST_FILE = "manifest.json"
+
+
+class ClipSpec:
+    """Everything needed to render one clip; `expected` is the ground-truth liveness label."""
+
+    def __init__(self, name: str, kind: str = "live", width: int = 640, height: int = 480, fps: float = 30.0,
+                 codec: str = "mjpg", flash_offset_ms: float = 1000.0, duration_ms: float = None,
+                 reflection: float = 12.0, latency_ms: float = 100.0, rise_ms: float = 120.0,
+                 noise: float = 2.0, sway: float = 0.005, flicker: float = 0.01, seed: int = 0):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown clip kind '{kind}' (expected one of {', '.join(KINDS)})")
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}' (expected one of {', '.join(CODECS)})")
+        self.name = name
+        self.kind = kind
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.codec = codec
+        self.flash_offset_ms = flash_offset_ms
+        self.duration_ms = duration_ms if duration_ms is not None else flash_offset_ms + 2000.0
+        self.reflection = reflection
+        self.latency_ms = latency_ms
+        self.rise_ms = rise_ms
+        self.noise = noise
+        # Head motion, as a fraction of the frame size
+        self.sway = sway
+        # Screen refresh flicker of replays, as a fraction of brightness
+        self.flicker = flicker
+        self.seed = seed
+
+    @property
+    def expected(self) -> bool:
+        return self.kind == "live"
+
+    @property
+    def filename(self) -> str:
+        return self.name + CODECS[self.codec][1]
+
+    def to_dict(self) -> dict:
+        data = dict(vars(self))
+        data["filename"] = self.filename
+        data["expected"] = self.expected
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ClipSpec":
+        fields = {k: v for k, v in data.items() if k not in ("filename", "expected")}
+        return cls(**fields)
+
+
+def draw_face(img, cx: int, cy: int, face_width: int, skin=(140, 160, 200)):
+    """
+    Cartoon frontal face (BGR skin) with eyes, brows, nose and mouth; enough structure for Haar.
+    face_width is the feature span; the head is drawn wider so the detector's box (and with it the
+    forehead ROI) lands mostly on skin, as it does on real faces.
+    """
+    fw = face_width
+    fh = int(fw * 1.25)
+    cv2.ellipse(img, (cx, cy), (int(fw * 0.85), int(fh * 1.15)), 0, 0, 360, skin, -1)
+    ey = cy - fh // 8
+    ex = fw // 5
+    er = max(2, fw // 12)
+    for side in (-1, 1):
+        cv2.ellipse(img, (cx + side * ex, ey), (er * 2, er), 0, 0, 360, (255, 255, 255), -1)
+        cv2.circle(img, (cx + side * ex, ey), er, (30, 30, 30), -1)
+        cv2.line(img, (cx + side * ex - er * 2, ey - er * 2), (cx + side * ex + er * 2, ey - er * 2 - 2),
+                 (40, 40, 60), max(2, fw // 30))
+    dark = tuple(int(c * 0.6) for c in skin)
+    cv2.line(img, (cx, ey), (cx, cy + fh // 10), dark, max(2, fw // 25))
+    cv2.ellipse(img, (cx, cy + fh // 5), (fw // 5, fw // 14), 0, 0, 360, (60, 60, 140), -1)
+
+
+def _reflection_at(spec: ClipSpec, t_ms: float) -> float:
+    """Red-channel lift on the skin at time t (0 for replays)."""
+    if spec.kind == "replay":
+        return 0.0
+    onset = spec.flash_offset_ms + spec.latency_ms
+    if t_ms < onset:
+        return 0.0
+    return spec.reflection * min(1.0, (t_ms - onset) / max(spec.rise_ms, 1.0))
+
+
+def _background(spec: ClipSpec, rng) -> np.ndarray:
+    # Static warm-lit wall: vertical gradient plus low-frequency texture, rendered once per clip.
+    # Its red level sits near the skin's, as under indoor lighting, so the few background pixels
+    # the forehead ROI picks up when the detector box jitters do not swamp the reflection.
+    h, w = spec.height, spec.width
+    wall = np.array([70, 85, 160], dtype=np.float32) + rng.uniform(-10, 10, 3)
+    gradient = np.linspace(0.85, 1.05, h, dtype=np.float32)[:, None, None] * wall
+    texture = cv2.resize(rng.uniform(-6, 6, (h // 40 + 2, w // 40 + 2, 3)).astype(np.float32), (w, h))
+    return np.clip(gradient + texture, 0, 255).astype(np.uint8)
+
+
+def render_frames(spec: ClipSpec):
+    """Yields (t_ms, BGR frame) for every frame of the clip."""
+    rng = np.random.default_rng(spec.seed)
+    background = _background(spec, rng)
+    h, w = spec.height, spec.width
+    face_width = int(min(w, h * 4 / 3) * 0.2)
+    base_skin = np.array([140, 160, 200], dtype=np.float32) + rng.uniform(-15, 15, 3)
+    frame_count = int(round(spec.duration_ms * spec.fps / 1000.0))
+
+    if spec.noise > 0:
+        # Sensor noise drawn from a small per-clip bank; generating fresh Gaussian fields per frame
+        # would dominate render time at 720p and above
+        noise_bank = np.round(rng.normal(0.0, spec.noise, (4, h, w, 3))).astype(np.int16)
+
+    if spec.kind == "replay":
+        # Screen replay: darkened pixel rows and a refresh beat against the camera's frame rate
+        scanlines = np.ones((h, 1, 1), dtype=np.float32)
+        scanlines[::3] = 0.9
+        beat_hz = rng.uniform(2.0, 7.0)
+
+    for i in range(frame_count):
+        t_ms = i * 1000.0 / spec.fps
+        frame = background.copy()
+
+        skin = base_skin.copy()
+        skin[2] += _reflection_at(spec, t_ms)
+        cx = w // 2 + int(spec.sway * w * np.sin(i / 10.0))
+        cy = h // 2 + int(spec.sway * h * 0.5 * np.cos(i / 13.0))
+        draw_face(frame, cx, cy, face_width, tuple(float(c) for c in np.clip(skin, 0, 255)))
+        frame = cv2.GaussianBlur(frame, (5, 5), 0)
+
+        if spec.kind == "replay":
+            gain = 1.0 + spec.flicker * np.sin(2 * np.pi * beat_hz * t_ms / 1000.0)
+            frame = np.clip(frame.astype(np.float32) * scanlines * gain, 0, 255).astype(np.uint8)
+
+        if spec.noise > 0:
+            noise = noise_bank[rng.integers(len(noise_bank))]
+            frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+        yield t_ms, frame
+
+
+def codec_available(codec: str) -> bool:
+    fourcc, ext = CODECS[codec]
+    fd, path = tempfile.mkstemp(suffix=ext)
+    os.close(fd)
+    try:
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), 30.0, (64, 48))
+        ok = writer.isOpened()
+        if ok:
+            writer.write(np.zeros((48, 64, 3), dtype=np.uint8))
+        writer.release()
+        return ok and os.path.getsize(path) > 0
+    finally:
+        os.remove(path)
+
+
+def write_clip(spec: ClipSpec, directory: str) -> str:
+    path = os.path.join(directory, spec.filename)
+    fourcc, _ = CODECS[spec.codec]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), spec.fps, (spec.width, spec.height))
+    if not writer.isOpened():
+        raise RuntimeError(f"Cannot write {spec.codec} ({fourcc}) with this OpenCV build")
+    try:
+        for _, frame in render_frames(spec):
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+def corpus_specs(count: int, seed: int = 0, codecs=None, max_height: int = 720):
+    """
+    Deterministic mix of clips covering the parameter space. Roughly 60% live (including weak
+    and slow responders), 25% screen replays and 15% delayed-response injections.
+    """
+    rng = np.random.default_rng(seed)
+    codecs = list(codecs or CODECS)
+    resolutions = [r for r in RESOLUTIONS if r[1] <= max_height]
+    specs = []
+    for i in range(count):
+        kind = str(rng.choice(KINDS, p=(0.6, 0.25, 0.15)))
+        width, height = resolutions[rng.integers(len(resolutions))]
+        fps = float(rng.choice(FRAME_RATES))
+        codec = codecs[rng.integers(len(codecs))]
+        flash_offset = float(np.round(rng.uniform(600, 2500), -1))
+        if kind == "delayed":
+            latency = float(np.round(rng.uniform(1400, 2000), -1))
+        else:
+            latency = float(np.round(rng.uniform(0, 500), -1))
+        reflection = float(np.round(rng.uniform(5, 20), 1))
+        specs.append(ClipSpec(
+            name=f"clip_{i:03d}_{kind}_{height}p_{int(fps)}fps",
+            kind=kind, width=width, height=height, fps=fps, codec=codec,
+            flash_offset_ms=flash_offset,
+            duration_ms=flash_offset + max(latency, 1200.0) + 800.0,
+            reflection=reflection, latency_ms=latency,
+            rise_ms=float(np.round(rng.uniform(60, 250), -1)),
+            noise=float(np.round(rng.uniform(0, 3), 1)),
+            sway=float(np.round(rng.uniform(0, 0.004), 4)),
+            flicker=float(np.round(rng.uniform(0.003, 0.01), 3)),
+            seed=seed * 100003 + i,
+        ))
+    return specs
+
+
+def generate_corpus(directory: str, count: int = 24, seed: int = 0, codecs=None, max_height: int = 720):
+    """Renders a corpus into `directory` and writes corpus.json (specs) and manifest.json (offsets)."""
+    os.makedirs(directory, exist_ok=True)
+    codecs = [c for c in (codecs or CODECS) if codec_available(c)]
+    if not codecs:
+        raise RuntimeError("No usable video codec in this OpenCV build")
+
+    specs = corpus_specs(count, seed, codecs, max_height)
+    for spec in specs:
+        write_clip(spec, directory)
+
+    with open(os.path.join(directory, CORPUS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"seed": seed, "clips": [spec.to_dict() for spec in specs]}, f, indent=2)
+    with open(os.path.join(directory, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({spec.filename: spec.flash_offset_ms for spec in specs}, f, indent=2)
+    return specs
+
+
+def load_corpus(directory: str):
+    with open(os.path.join(directory, CORPUS_FILE), encoding="utf-8") as f:
+        return [ClipSpec.from_dict(data) for data in json.load(f)["clips"]]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic challenge-video corpus")
+    parser.add_argument("directory", help="Output directory")
+    parser.add_argument("--count", type=int, default=24, help="Number of clips")
+    parser.add_argument("--seed", type=int, default=0, help="Corpus seed (same seed = same clips)")
+    parser.add_argument("--codecs", help=f"Comma-separated subset of {','.join(CODECS)} (default: all available)")
+    parser.add_argument("--max-height", type=int, default=720, help="Largest resolution height to include")
+    args = parser.parse_args()
+
+    specs = generate_corpus(args.directory, args.count, args.seed,
+                            args.codecs.split(",") if args.codecs else None, args.max_height)
+    kinds = {kind: sum(1 for s in specs if s.kind == kind) for kind in KINDS}
+    print(f"🎞️  Wrote {len(specs)} clips to {args.directory} ({', '.join(f'{k}: {n}' for k, n in kinds.items())})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+# Settings are read at import: keep the app small and side-effect free before anything imports config
+os.environ.setdefault("DEEPSHIELD_ENGINE_WORKERS", "1")
+os.environ.setdefault("DEEPSHIELD_JOB_QUEUE", "memory")
+os.environ.setdefault("DEEPSHIELD_AUDIT_LOG", "off")
+os.environ.setdefault("DEEPSHIELD_CAPTURE_RATE", "0")
+
+from synthetic_clips import ClipSpec, write_clip  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def live_clip(tmp_path_factory):
+    """Short 320x240 MJPG clip of a live responder to a red flash at 1000 ms."""
+    spec = ClipSpec("live", kind="live", width=320, height=240, fps=15.0)
+    return write_clip(spec, str(tmp_path_factory.mktemp("clips")))
+
+
+@pytest.fixture(scope="session")
+def client():
+    from fastapi.testclient import TestClient
+
+    import main
+
+    with TestClient(main.app) as test_client:
+        yield test_client
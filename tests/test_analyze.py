@@ -0,0 +1,41 @@
+import json
+import os
+import shutil
+
+import analyze
+
+
+def _records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_runs_resume_and_redo_skipped_analyses(tmp_path, live_clip, capsys):
+    # Two recordings with the same name in different folders
+    inputs = []
+    for folder in ("a", "b"):
+        os.makedirs(tmp_path / folder)
+        inputs.append(str(tmp_path / folder))
+        shutil.copy(live_clip, tmp_path / folder / "clip.avi")
+    out, plots = str(tmp_path / "results.jsonl"), str(tmp_path / "plots")
+    args = inputs + ["--analyses", "engine,spikes", "--out", out, "--workers", "1", "--plots", plots]
+
+    # No flash offset anywhere: the engine analysis is skipped, the spike check runs and is plotted
+    assert analyze.main(args) == 0
+    first = _records(out)
+    assert sorted(record["file"] for record in first) == sorted(os.path.join(i, "clip.avi") for i in inputs)
+    assert all("skipped" in record["analyses"]["engine"] for record in first)
+    plotted = [record["plots"]["spikes"] for record in first]
+    assert len(set(plotted)) == 2 and all(os.path.getsize(path) for path in plotted)
+
+    # With an offset the skipped engine analysis is still to do
+    assert analyze.main(args + ["--flash-offset", "1000"]) == 0
+    second = _records(out)[len(first):]
+    assert len(second) == 2
+    assert all(record["analyses"]["engine"]["is_liveness_verified"] for record in second)
+
+    # Everything is done now
+    capsys.readouterr()
+    assert analyze.main(args + ["--flash-offset", "1000"]) == 0
+    assert "Nothing to analyze" in capsys.readouterr().out
+    assert len(_records(out)) == 4
@@ -0,0 +1,46 @@
+import glob
+import json
+import os
+import time
+
+from audit_log import AuditLog, verify_record
+
+
+def _records(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_log_rotates_by_size_and_keeps_the_newest_backups(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    log = AuditLog(path, batch_size=1, fsync_interval=0, max_bytes=600, rotate_interval=0, backups=2)
+    log.start()
+    for i in range(12):
+        assert log.write(verify_record(f"request-{i}", 200, "ok", upload_bytes=i))
+    log.close()
+
+    rotated = sorted(glob.glob(path + ".*"), key=log._rotation_age)
+    assert len(rotated) == 2
+    files = rotated + [path]
+    ids = [record["request_id"] for name in files for record in _records(name)]
+    # Nothing lost across the rotations that are kept, in write order, each file under the limit
+    assert ids == [f"request-{i}" for i in range(12 - len(ids), 12)]
+    assert all(len(open(name, "rb").read()) <= 600 for name in files)
+
+
+def test_log_rotates_by_age(tmp_path):
+    path = str(tmp_path / "audit.jsonl")
+    log = AuditLog(path, batch_size=1, fsync_interval=0, max_bytes=0, rotate_interval=0.2, backups=5)
+    log.start()
+    log.write(verify_record("old", 200, "ok"))
+    deadline = time.monotonic() + 5
+    while not (os.path.exists(path) and os.path.getsize(path)) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.3)
+    log.write(verify_record("new", 200, "ok"))
+    log.close()
+
+    rotated = glob.glob(path + ".*")
+    assert len(rotated) == 1
+    assert [record["request_id"] for record in _records(rotated[0])] == ["old"]
+    assert [record["request_id"] for record in _records(path)] == ["new"]
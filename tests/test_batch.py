@@ -0,0 +1,71 @@
+import io
+import json
+import zipfile
+
+import config
+import main
+
+
+def _archive(live_clip, names=("a.avi", "b.avi")) -> bytes:
+    with open(live_clip, "rb") as f:
+        video = f.read()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name in names:
+            archive.writestr(name, video)
+        archive.writestr("manifest.json", json.dumps({name: 1000 for name in names}))
+    return buffer.getvalue()
+
+
+def _lines(response):
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    return sorted(lines[:-1], key=lambda line: line["index"]), lines[-1]
+
+
+def test_archive_items_are_verified(client, live_clip):
+    response = client.post("/api/verify_batch", files={"archive": ("batch.zip", _archive(live_clip))})
+    items, summary = _lines(response)
+    assert [item["name"] for item in items] == ["a.avi", "b.avi"]
+    assert all(item["ok"] and item["result"]["is_liveness_verified"] for item in items)
+    assert summary == {"summary": True, "total": 2, "succeeded": 2, "failed": 0}
+
+
+def test_items_over_the_admission_limits_are_rejected_before_decoding(client, live_clip, monkeypatch):
+    runs = []
+    run = main.engine_pool.run
+    monkeypatch.setattr(main.engine_pool, "run", lambda *args, **kwargs: (runs.append(args), run(*args, **kwargs))[1])
+    monkeypatch.setattr(config, "MAX_DURATION_S", 1.0)
+
+    with open(live_clip, "rb") as f:
+        response = client.post("/api/verify_batch", files={"video_files": ("clip.avi", f.read())},
+                               data={"flash_offset": "1000"})
+    items, summary = _lines(response)
+    assert items[0]["ok"] is False and items[0]["status"] == 413
+    assert "longer than" in items[0]["error"]
+    assert summary["failed"] == 1
+    assert runs == []
+
+
+def test_items_run_under_the_request_deadline(client, live_clip, monkeypatch):
+    monkeypatch.setattr(config, "REQUEST_DEADLINE_S", 0.001)
+    response = client.post("/api/verify_batch", files={"archive": ("batch.zip", _archive(live_clip, ("a.avi",)))})
+    items, _ = _lines(response)
+    assert items[0]["ok"] is True
+    assert items[0]["result"]["message"].startswith("Timed out")
+    assert items[0]["result"]["is_liveness_verified"] is False
+
+
+def test_large_archive_members_are_streamed_to_a_temp_file(live_clip, monkeypatch):
+    from batch import _extract_member
+
+    archive = zipfile.ZipFile(io.BytesIO(_archive(live_clip, ("a.avi",))))
+    monkeypatch.setattr(config, "INGEST_MAX_MEMORY_MB", 0.001)
+    source = _extract_member(archive, "a.avi")
+    try:
+        assert isinstance(source.video, str)
+        with open(source.video, "rb") as f, open(live_clip, "rb") as original:
+            assert f.read() == original.read()
+    finally:
+        source.cleanup()
+    assert source.video is None
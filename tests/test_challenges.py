@@ -0,0 +1,44 @@
+import main
+
+
+def _upload(client, clip, challenge_id, headers=None):
+    with open(clip, "rb") as f:
+        return client.post("/api/verify_liveness", files={"video_file": ("clip.avi", f.read())},
+                           data={"flash_offset": "1000", "challenge_id": challenge_id}, headers=headers or {})
+
+
+def test_used_challenge_is_not_answered_from_the_cache(client, live_clip):
+    assert main.result_cache.enabled
+    challenge_id = client.post("/api/challenge").json()["challenge_id"]
+
+    first = _upload(client, live_clip, challenge_id).json()
+    assert not first["message"].startswith("Challenge rejected")
+
+    replay = _upload(client, live_clip, challenge_id).json()
+    assert replay["message"].startswith("Challenge rejected")
+    assert replay["cache"] != "hit"
+
+
+def test_retry_with_same_idempotency_key_is_served_from_the_cache(client, live_clip):
+    challenge_id = client.post("/api/challenge").json()["challenge_id"]
+    headers = {"Idempotency-Key": "retry-" + challenge_id}
+
+    first = _upload(client, live_clip, challenge_id, headers).json()
+    retry = _upload(client, live_clip, challenge_id, headers).json()
+    assert retry["cache"] == "hit"
+    assert retry["is_liveness_verified"] == first["is_liveness_verified"]
+
+
+def test_unknown_challenge_is_rejected(client, live_clip):
+    result = _upload(client, live_clip, "never-issued").json()
+    assert result["message"].startswith("Challenge rejected")
+    assert result["is_liveness_verified"] is False
+
+
+def test_session_gauge_is_only_exported_for_countable_stores(client):
+    from challenges import RedisChallengeStore
+
+    # A Redis count would scan the keyspace on every scrape
+    assert not RedisChallengeStore.countable
+    assert main.challenge_store.countable
+    assert "deepshield_challenge_sessions " in client.get("/metrics").text
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+import config
+from physics_engine import analyze_video_challenge
+from signals import extract_trace
+from synthetic_clips import ClipSpec, write_clip
+
+# Default settings must give the verdicts of the original engine: baseline = mean of every
+# pre-flash frame, peak = highest frame anywhere after the flash, rejected if it came later than
+# the max latency. The reference below scores a full per-frame detect-mode trace that way.
+
+CORPUS = (
+    ClipSpec("live", kind="live", width=320, height=240, fps=15.0, seed=1),
+    ClipSpec("early_flash", kind="live", width=320, height=240, fps=15.0, flash_offset_ms=300.0, seed=2),
+    ClipSpec("replay", kind="replay", width=320, height=240, fps=15.0, seed=3),
+    ClipSpec("delayed", kind="delayed", width=320, height=240, fps=15.0, latency_ms=1600.0,
+             duration_ms=3600.0, seed=4),
+)
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("parity"))
+    return [(spec, write_clip(spec, directory)) for spec in CORPUS]
+
+
+def reference_verdict(path: str, flash_offset: float) -> dict:
+    trace = extract_trace(path, rois=("forehead",), roi_mode="detect")
+    red = np.nan_to_num(trace.channel("forehead", "r"), nan=0.0).astype(np.float64)
+    times = trace.timestamps.astype(np.float64)
+    pre = times < flash_offset
+    baseline = red[pre].mean() if pre.any() else red[:max(1, len(red) // 10)].mean()
+    post = np.flatnonzero(times >= flash_offset)
+    peak = post[np.argmax(red[post])]
+    delta = red[peak] - baseline
+    latency = times[peak] - flash_offset
+    return {
+        "is_liveness_verified": bool(delta > config.DELTA_THRESHOLD and 0 <= latency <= config.MAX_LATENCY_MS),
+        "delta": float(delta),
+        "latency_ms": float(latency),
+    }
+
+
+def test_default_decode_window_keeps_the_original_verdicts(corpus):
+    assert config.BASELINE_WINDOW_MS == 0
+    assert not config.STOP_AFTER_LATENCY_WINDOW
+    assert config.ROI_MODE == "detect"
+    verdicts = {}
+    for spec, path in corpus:
+        expected = reference_verdict(path, spec.flash_offset_ms)
+        result = analyze_video_challenge(path, spec.flash_offset_ms)
+        assert result["is_liveness_verified"] == expected["is_liveness_verified"], spec.name
+        assert result["delta"] == pytest.approx(expected["delta"], abs=1e-3), spec.name
+        assert result["latency_ms"] == pytest.approx(expected["latency_ms"], abs=1e-3), spec.name
+        verdicts[spec.name] = result["is_liveness_verified"]
+    # A response later than the max latency rejects the clip
+    assert verdicts["live"] and verdicts["early_flash"] and not verdicts["delayed"]
+
+
+def test_track_mode_samples_the_detect_mode_roi(corpus):
+    # Track mode trades per-frame detection for a box held between full detections; the ROI (and
+    # with it the delta) must stay that of detect mode rather than drift with the window detector
+    for spec, path in corpus:
+        detect = analyze_video_challenge(path, spec.flash_offset_ms, roi_mode="detect")
+        track = analyze_video_challenge(path, spec.flash_offset_ms, roi_mode="track")
+        assert track["tracked_frames"] > track["full_detection_frames"], spec.name
+        assert track["delta"] == pytest.approx(detect["delta"], abs=1.0), spec.name
+
+
+@pytest.mark.parametrize("threads, baseline_window_ms", [(1, 0), (2, 0), (2, 500)])
+def test_pipeline_keeps_the_sequential_verdicts(corpus, monkeypatch, threads, baseline_window_ms):
+    import pipeline
+
+    # A baseline window makes the decoder skip the frames before it
+    monkeypatch.setattr(config, "BASELINE_WINDOW_MS", baseline_window_ms)
+    sequential = [analyze_video_challenge(path, spec.flash_offset_ms, record=False) for spec, path in corpus]
+    monkeypatch.setattr(config, "PIPELINE", True)
+    monkeypatch.setattr(config, "PIPELINE_THREADS", threads)
+    # The executor is sized on first use; start one for this thread count
+    monkeypatch.setattr(pipeline, "_executor", None)
+    for (spec, path), expected in zip(corpus, sequential):
+        result = analyze_video_challenge(path, spec.flash_offset_ms, record=False)
+        assert result["is_liveness_verified"] == expected["is_liveness_verified"], spec.name
+        assert result["delta"] == pytest.approx(expected["delta"], abs=1e-6), spec.name
+        assert result["latency_ms"] == pytest.approx(expected["latency_ms"], abs=1e-6), spec.name
+        assert result["timings"]["frames"] == expected["timings"]["frames"], spec.name
+        assert result["skipped_frames"] == expected["skipped_frames"], spec.name
+    pipeline._get_executor().shutdown()
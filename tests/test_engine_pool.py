@@ -0,0 +1,34 @@
+import asyncio
+import operator
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from engine_pool import EnginePool
+
+
+def test_pool_recovers_once_after_a_worker_crash():
+    async def scenario():
+        pool = EnginePool(workers=2, max_pending=8)
+        starts = []
+        start = pool.start
+        pool.start = lambda: (starts.append(1), start())
+        pool.start()
+        assert await pool.wait_ready(timeout=60)
+        try:
+            # One worker exits: every job in flight on that pool fails, but it is replaced only once
+            results = await asyncio.gather(pool.run(os._exit, 1), pool.run(time.sleep, 0.5),
+                                           return_exceptions=True)
+            assert all(isinstance(result, BrokenProcessPool) for result in results)
+            assert len(starts) == 2
+            assert not pool.ready
+
+            assert await asyncio.wait_for(pool._rewarm, 60)
+            assert pool.ready
+            assert await pool.run(operator.add, 1, 2) == 3
+            assert len(starts) == 2
+            assert pool.pending == 0
+        finally:
+            pool.shutdown()
+
+    asyncio.run(scenario())
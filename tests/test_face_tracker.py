@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from tracking import FaceTracker, FrameClock
+
+
+class ScriptedDetector:
+    """Returns the next scripted box (in the coordinates of the image it is given) per call."""
+
+    name = "scripted"
+    needs_gray = False
+
+    def __init__(self, boxes):
+        self.boxes = list(boxes)
+        self.calls = []
+
+    def detect(self, image, scale_factor, min_neighbors, min_size, max_size=None):
+        self.calls.append(image.shape[:2])
+        box = self.boxes.pop(0)
+        return np.array([box]) if box is not None else np.empty((0, 4))
+
+
+def test_windowed_hits_keep_the_last_full_detection_box():
+    frame = np.zeros((240, 320, 3), dtype=np.uint8)
+    # Full detection at (100, 60, 100, 100); the search window then starts at (75, 35).
+    # Window hits jitter in size and position by a few pixels, then the face moves by 30 px.
+    detector = ScriptedDetector([(100, 60, 100, 100), (25, 28, 106, 106), (28, 20, 92, 92), (22, 27, 100, 100),
+                                 (55, 25, 100, 100), (130, 60, 100, 100)])
+    tracker = FaceTracker(detector, mode="track", keyframe_interval=100, max_drift=0.1, detect_width=0)
+
+    boxes = [tracker.locate(frame) for _ in range(4)]
+    assert boxes == [(100, 60, 100, 100)] * 4
+    assert tracker.full_detection_frames == 1
+    assert tracker.tracked_frames == 3
+
+    # The window hit of the moved face is only a trigger: the box comes from a full detection
+    assert tracker.locate(frame) == (130, 60, 100, 100)
+    assert tracker.full_detection_frames == 2
+    assert detector.calls[-1] == frame.shape[:2]
+
+
+class ScriptedCapture:
+    """Reports the next scripted CAP_PROP_POS_MSEC per call, like a capture after each grab()."""
+
+    def __init__(self, pts):
+        self.pts = list(pts)
+
+    def get(self, prop):
+        return self.pts.pop(0)
+
+
+def test_frame_clock_repairs_missing_pts_from_the_observed_interval():
+    # 40 ms frames (nominal 30 fps says 33.3), one dropped frame, then PTS goes missing
+    pts = [0.0, 40.0, 80.0, 120.0, 200.0, 240.0, 0.0, 0.0, 360.0]
+    clock = FrameClock(30.0)
+    timestamps = [clock.next(ScriptedCapture(pts[i:])) for i in range(len(pts))]
+
+    assert timestamps[:6] == pts[:6]
+    # The dropped frame's 80 ms step does not pull the estimate off 40 ms by much
+    assert timestamps[6] == pytest.approx(280.0, abs=1.0)
+    assert timestamps[7] == pytest.approx(320.0, abs=2.0)
+    assert timestamps[8] == 360.0
+    assert clock.repaired == 2
+    # Only the last timestamp is kept, whatever the length of the video
+    assert clock.last == 360.0 and not hasattr(clock, "timestamps")
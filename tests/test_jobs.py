@@ -0,0 +1,39 @@
+import importlib
+import time
+
+import config
+import main
+
+
+def test_memory_queue_is_the_default(monkeypatch):
+    # conftest pins DEEPSHIELD_JOB_QUEUE; read the setting again without it
+    monkeypatch.delenv("DEEPSHIELD_JOB_QUEUE")
+    try:
+        assert importlib.reload(config).JOB_QUEUE == "memory"
+    finally:
+        monkeypatch.undo()
+        importlib.reload(config)
+    assert config.JOB_QUEUE == "memory"
+
+
+def test_idle_runners_back_off_and_wake_on_submit(client, live_clip, monkeypatch):
+    claims = []
+    claim = main.job_queue.claim
+    monkeypatch.setattr(main.job_queue, "claim", lambda worker: (claims.append(worker), claim(worker))[1])
+
+    # Each empty check is a write transaction: an idle runner must not keep polling every interval
+    # (the app may already have been idle for a while, backed off to a poll every few seconds)
+    time.sleep(3.0)
+    fixed_rate = 3.0 / config.JOB_POLL_INTERVAL
+    assert len(claims) < fixed_rate / 2
+
+    with open(live_clip, "rb") as f:
+        submitted = client.post("/api/jobs", files={"video_file": ("clip.avi", f.read())},
+                                data={"flash_offset": "1000"})
+    assert submitted.status_code == 202
+    started = time.monotonic()
+    job = client.get(f"/api/jobs/{submitted.json()['job_id']}", params={"wait": 20}).json()
+    assert job["status"] == "done"
+    assert job["result"]["is_liveness_verified"] is True
+    # Woken by the submission, not by its next (backed-off) poll
+    assert time.monotonic() - started < 1.5
@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+import pytest
+
+import config
+import trace_store
+from physics_engine import analyze_video_challenge
+from rescore import recorded_latency, score_shard
+from synthetic_clips import ClipSpec, write_clip
+from trace_store import TraceStore
+
+CLIPS = (
+    ClipSpec("live", kind="live", width=320, height=240, fps=15.0, seed=11),
+    ClipSpec("replay", kind="replay", width=320, height=240, fps=15.0, seed=12),
+    ClipSpec("delayed", kind="delayed", width=320, height=240, fps=15.0, latency_ms=1600.0,
+             duration_ms=3600.0, seed=13),
+)
+
+
+@pytest.mark.parametrize("windowed", [False, True], ids=["default", "decode-window"])
+def test_rescore_reproduces_the_engine_verdicts(tmp_path, monkeypatch, windowed):
+    store = str(tmp_path / "traces")
+    monkeypatch.setattr(config, "TRACE_STORE", store)
+    monkeypatch.setattr(trace_store, "_writer", None)
+    if windowed:
+        monkeypatch.setattr(config, "BASELINE_WINDOW_MS", 500.0)
+        monkeypatch.setattr(config, "STOP_AFTER_LATENCY_WINDOW", True)
+
+    results = [analyze_video_challenge(write_clip(spec, str(tmp_path)), spec.flash_offset_ms) for spec in CLIPS]
+
+    shards = TraceStore(store).shards
+    assert len(shards) == 1 and len(shards[0]) == len(CLIPS)
+    # One latency column at the engine's own setting: the session score is its delta, -inf if rejected on latency
+    scores = score_shard(shards[0], np.array([config.MAX_LATENCY_MS]))[:, 0]
+    # Only traces cut off after the latency window limit the latencies to re-score at
+    assert recorded_latency(shards) == (config.MAX_LATENCY_MS if windowed else np.inf)
+    for spec, result, score in zip(CLIPS, results, scores):
+        assert bool(score > config.DELTA_THRESHOLD) == result["is_liveness_verified"], spec.name
+        if np.isfinite(score):
+            assert score == pytest.approx(result["delta"], abs=1e-3), spec.name
+
+
+def test_warm_up_leaves_the_store_empty(tmp_path, monkeypatch):
+    from detectors import warm_up
+
+    store = str(tmp_path / "traces")
+    monkeypatch.setattr(config, "TRACE_STORE", store)
+    monkeypatch.setattr(trace_store, "_writer", None)
+    warm_up()
+    # Pool starts, re-warms after a broken pool and job workers all warm up this way
+    assert not os.path.exists(store) or len(TraceStore(store)) == 0
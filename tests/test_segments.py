@@ -0,0 +1,71 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import config
+import main
+from physics_engine import analyze_video_challenge
+from probe import probe_video
+from segments import analyze_segmented, scan_keyframes
+
+
+class InlinePool:
+    """Runs engine jobs in the test process, with as many idle workers as asked for."""
+
+    def __init__(self, slots=3):
+        self.slots = self.idle_slots = slots
+        self.pending = 0
+        self.max_pending = 16
+
+    async def run(self, fn, *args, cost=0.0):
+        return fn(*args)
+
+
+@pytest.fixture
+def split_small_uploads(monkeypatch):
+    # Split even a 3 s 320x240 clip, in segments of at least 500 ms
+    monkeypatch.setattr(config, "SEGMENT_MIN_PIXELS", 0)
+    monkeypatch.setattr(config, "SEGMENT_MIN_DURATION_S", 0.0)
+    monkeypatch.setattr(config, "SEGMENT_MIN_MS", 500.0)
+    monkeypatch.setattr(main, "engine_pool", InlinePool())
+
+
+def _plan(clip):
+    source = SimpleNamespace(video=clip)
+    return asyncio.run(main._segment_plan(source, probe_video(clip), None, 1000.0))
+
+
+def test_split_analysis_matches_the_sequential_one(live_clip, split_small_uploads):
+    # MJPG: every frame is a keyframe, so the window splits anywhere
+    assert len(scan_keyframes(live_clip)) > 10
+    plan = _plan(live_clip)
+    assert plan is not None and len(plan) == 3
+
+    split = asyncio.run(analyze_segmented(main.engine_pool, live_clip, plan, 1000.0,
+                                          fallback=analyze_video_challenge))
+    whole = analyze_video_challenge(live_clip, 1000.0, early_exit=False, record=False)
+    assert split["segments"]["count"] == 3 and "fallback" not in split["segments"]
+    assert split["is_liveness_verified"] == whole["is_liveness_verified"]
+    assert split["delta"] == pytest.approx(whole["delta"], abs=1e-6)
+    assert split["latency_ms"] == pytest.approx(whole["latency_ms"], abs=1e-6)
+    assert split["analyzed_frames"] == whole["analyzed_frames"]
+
+
+def test_no_split_without_enough_idle_workers(live_clip, split_small_uploads):
+    main.engine_pool.idle_slots = 1
+    assert _plan(live_clip) is None
+
+
+def test_seek_past_the_segment_start_falls_back_to_the_sequential_engine(live_clip, split_small_uploads):
+    plan = _plan(live_clip)
+    # The second segment's seek lands half a second after its start: its first frames are lost
+    start_ms, end_ms, _ = plan[1]
+    plan[1] = (start_ms, end_ms, start_ms + 500.0)
+
+    result = asyncio.run(analyze_segmented(main.engine_pool, live_clip, plan, 1000.0,
+                                           fallback=analyze_video_challenge))
+    whole = analyze_video_challenge(live_clip, 1000.0, record=False)
+    assert result["segments"]["fallback"].startswith("segment 1 seek landed")
+    assert result["is_liveness_verified"] == whole["is_liveness_verified"]
+    assert result["delta"] == pytest.approx(whole["delta"], abs=1e-6)
@@ -0,0 +1,41 @@
+import cv2
+import numpy as np
+
+import config
+import signals
+
+
+class FakeCapture:
+    """Capture whose metadata claims a billion frames but which only has a few."""
+
+    def __init__(self, frames: int):
+        self.frames = frames
+        self.position = 0
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return {cv2.CAP_PROP_FPS: 30.0, cv2.CAP_PROP_FRAME_COUNT: 1e9,
+                cv2.CAP_PROP_POS_MSEC: self.position * 1000.0 / 30.0}.get(prop, 0.0)
+
+    def grab(self):
+        if self.position >= self.frames:
+            return False
+        self.position += 1
+        return True
+
+    def retrieve(self):
+        return True, np.full((120, 160, 3), self.position, dtype=np.uint8)
+
+    def release(self):
+        pass
+
+
+def test_extract_trace_does_not_trust_the_container_frame_count(monkeypatch):
+    monkeypatch.setattr(signals, "open_video", lambda video: (FakeCapture(200), "disk", lambda: None))
+    trace = signals.extract_trace("upload.webm", rois=("center",))
+    assert len(trace) == 200
+    # Preallocated for at most the admitted duration, then grown as frames arrived
+    assert len(trace._timestamps) <= config.MAX_DURATION_S * 30 + 1
+    assert trace.means("center")[-1, 2] == 200
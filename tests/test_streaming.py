@@ -0,0 +1,57 @@
+import time
+
+import pytest
+
+import streaming
+from synthetic_clips import ClipSpec, write_clip
+
+
+@pytest.fixture(scope="module")
+def late_flash_clip(tmp_path_factory):
+    """10 s WebM (like MediaRecorder chunks) flashing at 9 s: decoded up to its last frame."""
+    spec = ClipSpec("late", kind="live", width=320, height=240, fps=30.0, codec="vp8", flash_offset_ms=9000.0,
+                    duration_ms=10000.0)
+    with open(write_clip(spec, str(tmp_path_factory.mktemp("stream"))), "rb") as f:
+        return f.read()
+
+
+def _wait_for_frames(verification, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while not verification.timer.frames.get("decoded") and time.monotonic() < deadline:
+        time.sleep(0.005)
+
+
+def test_abort_stops_decoding_and_releases_the_session(late_flash_clip):
+    before = streaming.active_sessions()
+    verification = streaming.StreamingVerification()
+    verification.feed(late_flash_clip)
+    verification.set_flash_offset(9000.0)
+    assert streaming.active_sessions() == before + 1
+
+    _wait_for_frames(verification)
+    verification.abort()
+    assert verification.wait(10)
+    # Stopped before its next frame, not after analyzing everything already buffered
+    assert verification.timer.frames.get("decoded", 0) < 300
+    assert streaming.active_sessions() == before
+
+
+def test_finish_timeout_stops_decoding(late_flash_clip):
+    verification = streaming.StreamingVerification()
+    verification.feed(late_flash_clip)
+    verification.set_flash_offset(9000.0)
+    _wait_for_frames(verification)
+    result = verification.finish(timeout=0.0)
+    assert result["message"].startswith("Timed out")
+    assert verification.wait(10)
+
+
+def test_sessions_reuse_the_warmed_stream_threads(late_flash_clip):
+    streaming.warm_up_threads()
+    threads = set(streaming._get_executor()._threads)
+    for _ in range(3):
+        verification = streaming.StreamingVerification()
+        verification.feed(late_flash_clip)
+        verification.set_flash_offset(9000.0)
+        assert verification.finish(timeout=60)["message"] == "Liveness Verified"
+    assert set(streaming._get_executor()._threads) == threads
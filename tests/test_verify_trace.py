@@ -0,0 +1,42 @@
+import asyncio
+import json
+
+from starlette.requests import Request
+
+import config
+import main
+
+
+def _trace(frames=60):
+    # 15 fps, red rises 20 levels 200 ms after a flash at 1000 ms
+    timestamps = [i * 1000.0 / 15 for i in range(frames)]
+    rgb = [[120.0 + (20.0 if t >= 1200 else 0.0), 100.0, 90.0] for t in timestamps]
+    return {"roi": "center", "width": 320, "height": 240, "timestamps": timestamps, "rgb": rgb,
+            "flash_offset": 1000}
+
+
+def test_small_trace_is_scored(client):
+    result = client.post("/api/verify_trace", json=_trace()).json()
+    assert result["is_liveness_verified"]
+    assert result["delta"] > config.DELTA_THRESHOLD
+
+
+def test_declared_oversize_body_is_rejected_before_reading(client, monkeypatch):
+    monkeypatch.setattr(config, "TRACE_MAX_KB", 1.0)
+    body = json.dumps(_trace()).encode()
+    assert len(body) > 1024
+    response = client.post("/api/verify_trace", content=body, headers={"Content-Type": "application/json"})
+    assert response.status_code == 413
+
+
+def test_streamed_body_is_cut_off_at_the_limit():
+    # No Content-Length: reading must stop at the first chunk past the limit
+    received = []
+
+    async def receive():
+        received.append(512)
+        return {"type": "http.request", "body": b" " * 512, "more_body": len(received) < 64}
+
+    request = Request({"type": "http", "method": "POST", "headers": []}, receive)
+    assert asyncio.run(main._read_body(request, 1024)) is None
+    assert sum(received) == 1536
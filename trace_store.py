@@ -0,0 +1,154 @@
+import json
+import logging
+import os
+import socket
+import time
+
+import numpy as np
+
+import config
+
+# Trace store.
+# The engine can keep every trace it analyzed (DEEPSHIELD_TRACE_STORE), so thresholds can be
+# re-tuned later (rescore.py) without decoding a single video again. The store is a directory of
+# append-only shards, one per writing process, so engine workers never contend for a lock:
+#
+#   <store>/<host>-<pid>-<start>/timestamps.f32   all frames' timestamps (ms), float32
+#   <store>/<host>-<pid>-<start>/bgr.f32          all frames' forehead B/G/R means, float32 (frames, 3)
+#   <store>/<host>-<pid>-<start>/sessions.jsonl   one JSON line per session (flashes, verdict, source, ...)
+#   <store>/<host>-<pid>-<start>/index.bin        one INDEX_DTYPE record per session: where its frames are
+#
+# A session is appended as frames first, then its metadata line, then its index record; the index
+# record is the commit, so a crash mid-append leaves data that readers simply never see. Readers
+# memory-map the columns and hand out views, so opening thousands of sessions copies nothing.
+
+INDEX_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4")])
+
+TIMESTAMPS_FILE = "timestamps.f32"
+BGR_FILE = "bgr.f32"
+SESSIONS_FILE = "sessions.jsonl"
+INDEX_FILE = "index.bin"
+
+logger = logging.getLogger("deepshield.trace_store")
+
+
+class TraceStoreWriter:
+    """Appends sessions to this process's own shard of a store."""
+
+    def __init__(self, directory: str, shard: str = None):
+        shard = shard or f"{socket.gethostname()}-{os.getpid()}-{int(time.time() * 1000)}"
+        self.path = os.path.join(directory, shard)
+        os.makedirs(self.path, exist_ok=True)
+        self.frames = os.path.getsize(self._file(TIMESTAMPS_FILE)) // 4 if os.path.exists(
+            self._file(TIMESTAMPS_FILE)) else 0
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def append(self, timestamps, bgr, metadata: dict):
+        """Appends one session: (frames,) timestamps in ms, (frames, 3) B/G/R means, JSON metadata."""
+        timestamps = np.ascontiguousarray(timestamps, dtype="<f4")
+        bgr = np.ascontiguousarray(bgr, dtype="<f4").reshape(len(timestamps), 3)
+        record = np.array([(self.frames, len(timestamps))], dtype=INDEX_DTYPE)
+        with open(self._file(TIMESTAMPS_FILE), "ab") as f:
+            f.write(timestamps.tobytes())
+        with open(self._file(BGR_FILE), "ab") as f:
+            f.write(bgr.tobytes())
+        with open(self._file(SESSIONS_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(metadata, separators=(",", ":")) + "\n")
+        with open(self._file(INDEX_FILE), "ab") as f:
+            f.write(record.tobytes())
+        self.frames += len(timestamps)
+
+
+class Shard:
+    """Read-only, memory-mapped view of one shard."""
+
+    def __init__(self, path: str):
+        self.path = path
+        index = np.fromfile(os.path.join(path, INDEX_FILE), dtype=INDEX_DTYPE)
+        with open(os.path.join(path, SESSIONS_FILE), encoding="utf-8") as f:
+            sessions = [json.loads(line) for line in f if line.endswith("\n")]
+        frames = os.path.getsize(os.path.join(path, TIMESTAMPS_FILE)) // 4
+        # Only committed sessions whose frames are fully on disk
+        count = min(len(index), len(sessions))
+        while count and int(index[count - 1]["offset"]) + int(index[count - 1]["length"]) > frames:
+            count -= 1
+        self.index = index[:count]
+        self.sessions = sessions[:count]
+        frames = int(self.index[-1]["offset"] + self.index[-1]["length"]) if count else 0
+        if frames:
+            self.timestamps = np.memmap(os.path.join(path, TIMESTAMPS_FILE), dtype="<f4", mode="r", shape=(frames,))
+            self.bgr = np.memmap(os.path.join(path, BGR_FILE), dtype="<f4", mode="r", shape=(frames, 3))
+        else:
+            self.timestamps = np.empty(0, dtype="<f4")
+            self.bgr = np.empty((0, 3), dtype="<f4")
+
+    def __len__(self):
+        return len(self.index)
+
+    def session(self, i: int):
+        """(timestamps, bgr, metadata) of session i; the arrays are views into the mapped files."""
+        start, length = int(self.index[i]["offset"]), int(self.index[i]["length"])
+        return self.timestamps[start:start + length], self.bgr[start:start + length], self.sessions[i]
+
+
+class TraceStore:
+    """All shards of a store directory, opened read-only."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        names = sorted(name for name in os.listdir(directory)
+                       if os.path.exists(os.path.join(directory, name, INDEX_FILE)))
+        self.shards = [shard for shard in (Shard(os.path.join(directory, name)) for name in names) if len(shard)]
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __iter__(self):
+        for shard in self.shards:
+            for i in range(len(shard)):
+                yield shard.session(i)
+
+
+_writer = None
+
+
+def _finite(value: float):
+    return float(value) if np.isfinite(value) else None
+
+
+def record_session(session, result: dict, source: str = None):
+    """
+    Engine hook: appends a finished LivenessSession's trace when DEEPSHIELD_TRACE_STORE is set.
+    Failures are logged, never raised, so the store cannot cost a verdict.
+    """
+    if session.flash_offset is None:
+        return
+    record_trace(session.trace, session.schedule or [("red", session.flash_offset)],
+                 (session.window_start_ms, session.window_end_ms), result, source)
+
+
+def record_trace(trace, schedule, window, result: dict, source: str = None):
+    """Same as record_session for a trace scored outside a LivenessSession (segments.py)."""
+    global _writer
+    if not config.TRACE_STORE or not len(trace):
+        return
+    try:
+        if _writer is None:
+            _writer = TraceStoreWriter(config.TRACE_STORE)
+        _writer.append(trace.timestamps, trace.means("forehead"), {
+            "recorded_at": time.time(),
+            "source": source,
+            "flashes": [[color, float(offset)] for color, offset in schedule],
+            "window_ms": [_finite(window[0]), _finite(window[1])],
+            "delta_threshold": config.DELTA_THRESHOLD,
+            "max_latency_ms": config.MAX_LATENCY_MS,
+            "is_liveness_verified": bool(result.get("is_liveness_verified")),
+            "delta": result.get("delta"),
+            "latency_ms": result.get("latency_ms"),
+            "early_exit": bool(result.get("early_exit")),
+            "message": result.get("message"),
+        })
+    except Exception:
+        logger.exception("Could not record the trace")
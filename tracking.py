@@ -0,0 +1,206 @@
+from time import perf_counter
+
+import cv2
+
+import config
+from detectors import get_detector
+from metrics import StageTimer
+
+# Face tracking and frame timing.
+# Both are shared by every decoding loop (the physics engine, the pipeline and segment workers,
+# streaming sessions) and by signals.extract_trace(). They live here, below physics_engine and
+# signals, so neither has to import the other to get them.
+
+# Detection parameters shared by full-frame and windowed detection.
+# MIN_FACE_SIZE is in native frame pixels; it is scaled with the detection image.
+DETECT_MIN_NEIGHBORS = 5
+MIN_FACE_SIZE = (50, 50)
+
+ROI_MODES = ("detect", "track")
+
+
+def _largest_face(faces):
+    # Sort by area to get the largest face
+    x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+    return int(x), int(y), int(w), int(h)
+
+
+class FaceTracker:
+    """
+    Locates the face box for each frame, in native frame coordinates.
+
+    "detect" mode runs full-frame detection on every frame (original behaviour).
+    "track" mode runs full detection only on keyframes or when tracking confidence drops;
+    in between it re-detects inside a small window around the last box and, if that misses,
+    carries the last box forward with decaying confidence. A windowed hit does not replace the
+    box (window detections jitter more than full-frame ones, and the forehead ROI would drift
+    with them): the box stays that of the last full detection until the face has moved more
+    than max_drift of its size, which triggers a full detection.
+
+    Detection itself runs on a copy downscaled to `detect_width` pixels wide (0 = native);
+    boxes are mapped back so the forehead ROI is still sampled from the full-resolution frame.
+    """
+
+    def __init__(self, detector, mode: str = "detect", keyframe_interval: int = None,
+                 search_margin: float = None, min_confidence: float = None, max_drift: float = None,
+                 detect_width: int = None, scale_factor: float = None, timer: StageTimer = None):
+        if mode not in ROI_MODES:
+            raise ValueError(f"Unknown ROI mode '{mode}' (choose from {', '.join(ROI_MODES)})")
+        self.detector = detector
+        self.mode = mode
+        self.keyframe_interval = max(1, keyframe_interval or config.TRACK_KEYFRAME_INTERVAL)
+        self.search_margin = config.TRACK_SEARCH_MARGIN if search_margin is None else search_margin
+        self.min_confidence = config.TRACK_MIN_CONFIDENCE if min_confidence is None else min_confidence
+        self.max_drift = config.TRACK_MAX_DRIFT if max_drift is None else max_drift
+        self.detect_width = config.DETECT_WIDTH if detect_width is None else detect_width
+        self.scale_factor = scale_factor or config.DETECT_SCALE_FACTOR
+        self.timer = timer or StageTimer()
+
+        self.scale = None  # detection image / native frame, fixed on the first frame
+        self.box = None
+        self.confidence = 0.0
+        self._since_detection = 0
+
+        # Per-video counters reported with the verdict
+        self.full_detection_frames = 0
+        self.tracked_frames = 0
+
+    def _detection_image(self, region):
+        # Downscale first so the grayscale conversion only touches the pixels actually scanned
+        if self.scale < 1.0:
+            region = cv2.resize(region, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if self.detector.needs_gray:
+            return cv2.cvtColor(region, cv2.COLOR_BGR2GRAY)
+        return region
+
+    def _detect(self, region, min_size, max_size=None):
+        s = self.scale
+        start = perf_counter()
+        image = self._detection_image(region)
+        converted = perf_counter()
+        faces = self.detector.detect(
+            image,
+            scale_factor=self.scale_factor,
+            min_neighbors=DETECT_MIN_NEIGHBORS,
+            min_size=(max(1, int(min_size[0] * s)), max(1, int(min_size[1] * s))),
+            max_size=(int(max_size[0] * s) + 1, int(max_size[1] * s) + 1) if max_size else None,
+        )
+        self.timer.add("convert", converted - start)
+        self.timer.add("detect", perf_counter() - converted)
+        if len(faces) == 0:
+            return None
+        # Map back from the detection image to native coordinates
+        x, y, w, h = _largest_face(faces)
+        return int(x / s), int(y / s), int(w / s), int(h / s)
+
+    def _detect_full(self, frame):
+        self.full_detection_frames += 1
+        self._since_detection = 0
+        box = self._detect(frame, MIN_FACE_SIZE)
+        self.box = box
+        self.confidence = 0.0 if box is None else 1.0
+        return box
+
+    def _detect_in_window(self, frame):
+        x, y, w, h = self.box
+        frame_h, frame_w = frame.shape[:2]
+        mx, my = int(w * self.search_margin), int(h * self.search_margin)
+        x0, y0 = max(0, x - mx), max(0, y - my)
+        x1, y1 = min(frame_w, x + w + mx), min(frame_h, y + h + my)
+
+        # Only scan the search window, and only for faces close to the last size
+        min_size = (max(MIN_FACE_SIZE[0], int(w * 0.7)), max(MIN_FACE_SIZE[1], int(h * 0.7)))
+        max_size = (int(w * 1.4), int(h * 1.4))
+        box = self._detect(frame[y0:y1, x0:x1], min_size, max_size)
+        if box is None:
+            return None
+        fx, fy, fw, fh = box
+        return fx + x0, fy + y0, fw, fh
+
+    def _drifted(self, box) -> bool:
+        x, y, w, h = self.box
+        bx, by, bw, bh = box
+        shift = max(abs((bx + bw / 2) - (x + w / 2)) / w, abs((by + bh / 2) - (y + h / 2)) / h)
+        return shift > self.max_drift
+
+    def fork(self, timer: StageTimer = None) -> "FaceTracker":
+        """Same settings with this thread's own detector instance (pipeline.py analysis threads)."""
+        return FaceTracker(get_detector(self.detector.name), mode=self.mode, keyframe_interval=self.keyframe_interval,
+                           search_margin=self.search_margin, min_confidence=self.min_confidence,
+                           max_drift=self.max_drift, detect_width=self.detect_width, scale_factor=self.scale_factor,
+                           timer=timer)
+
+    def state(self):
+        """Tracking state to hand to the tracker of the next segment (segments.py)."""
+        return {"box": self.box, "confidence": self.confidence, "since_detection": self._since_detection}
+
+    def resume(self, state: dict):
+        """Continues from another tracker's state(): the first frame is tracked, not fully detected."""
+        if self.mode == "track" and state and state["box"] is not None:
+            self.box = tuple(state["box"])
+            self.confidence = state["confidence"]
+            self._since_detection = state["since_detection"]
+
+    def locate(self, frame):
+        """Returns the face box (x, y, w, h) for this frame, or None if no face is known."""
+        if self.scale is None:
+            frame_w = frame.shape[1]
+            self.scale = min(1.0, self.detect_width / frame_w) if self.detect_width > 0 else 1.0
+
+        if self.mode == "detect" or self.box is None:
+            return self._detect_full(frame)
+
+        self._since_detection += 1
+        if self._since_detection >= self.keyframe_interval or self.confidence < self.min_confidence:
+            return self._detect_full(frame)
+
+        box = self._detect_in_window(frame)
+        if box is not None:
+            if self._drifted(box):
+                return self._detect_full(frame)
+            self.confidence = 1.0
+        else:
+            # Carry the last box forward; repeated misses force a full detection
+            self.confidence *= 0.5
+            if self.confidence < self.min_confidence:
+                return self._detect_full(frame)
+        self.tracked_frames += 1
+        return self.box
+
+
+class FrameClock:
+    """
+    Builds the per-frame timestamp index (ms) for a capture.
+
+    Container PTS (CAP_PROP_POS_MSEC) is used whenever it is present and increasing. MediaRecorder
+    WebM is variable-rate, so a missing or non-monotonic PTS is repaired from a running estimate of
+    the frame interval observed so far rather than from frame_count / nominal fps. Only the last
+    timestamp and that estimate are kept, however long the video.
+    """
+
+    def __init__(self, fps: float):
+        self.interval = 1000.0 / fps
+        self.last = None
+        self.repaired = 0
+        self._observed = 0
+
+    def _observe(self, interval: float):
+        # Running mean of the frame intervals: a step over several intervals counts as that many
+        # frames (dropped ones), and a burst of frames as no less than half an interval
+        if self._observed:
+            interval = max(interval / max(1, round(interval / self.interval)), 0.5 * self.interval)
+        self._observed = min(self._observed + 1, 30)
+        self.interval += (interval - self.interval) / self._observed
+
+    def next(self, cap) -> float:
+        pts_ms = cap.get(cv2.CAP_PROP_POS_MSEC)
+        if self.last is None:
+            timestamp = pts_ms if pts_ms > 0 else 0.0
+        elif pts_ms > self.last:
+            timestamp = pts_ms
+            self._observe(pts_ms - self.last)
+        else:
+            timestamp = self.last + self.interval
+            self.repaired += 1
+        self.last = timestamp
+        return timestamp